@@ -0,0 +1,153 @@
+"""
+Local stand-in for the Zendesk API, with configurable latency, error rate
+and rate limiting, to benchmark the plugin without reaching Zendesk.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import itertools
+import json
+import random
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from urlparse import parse_qs, urlparse
+
+
+class FakeZendesk(ThreadingMixIn, HTTPServer):
+    """
+    :param latency: seconds each response is delayed
+    :param error_rate: fraction of requests answered with a 500
+    :param rate_limit_rate: fraction of requests answered with a 429
+    :param search_results: number of tickets in each search page
+    """
+
+    daemon_threads = True
+
+    def __init__(self, latency=0, error_rate=0, rate_limit_rate=0,
+                 search_results=20):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), FakeZendeskHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.search_results = search_results
+        self.requests = 0
+        self.ids = itertools.count(1)
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def next_id(self):
+        with self._lock:
+            self.requests += 1
+            return next(self.ids)
+
+
+class FakeZendeskHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def _handle(self, method):
+        server = self.server
+        ticket_id = server.next_id()
+        if server.latency:
+            time.sleep(server.latency)
+
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        draw = random.random()
+        if draw < server.rate_limit_rate:
+            return self._respond(429, {'error': 'TooManyRequests'},
+                                 {'Retry-After': '0'})
+        if draw < server.rate_limit_rate + server.error_rate:
+            return self._respond(500, {'error': 'InternalError'})
+
+        url = urlparse(self.path)
+        if method == 'POST' and url.path == '/api/v2/tickets.json':
+            return self._respond(201, make_create_response(
+                ticket_id, body['ticket']))
+        if method == 'POST' and url.path.endswith('/create_many.json'):
+            job_id = 'job{}'.format(ticket_id)
+            server.jobs[job_id] = [server.next_id() for t in body['tickets']]
+            return self._respond(200, {'job_status': {
+                'id': job_id, 'status': 'queued'}})
+        if url.path.startswith('/api/v2/job_statuses/'):
+            job_id = url.path.rsplit('/', 1)[1].split('.')[0]
+            return self._respond(200, {'job_status': {
+                'id': job_id, 'status': 'completed',
+                'results': [{'index': i, 'id': id} for i, id in
+                            enumerate(server.jobs.get(job_id, []))]}})
+        if url.path == '/api/v2/search.json':
+            query = parse_qs(url.query).get('query', [''])[0]
+            word = query.split('subject:')[-1].rstrip('*')
+            return self._respond(200, make_search_response(
+                word, server.search_results))
+        return self._respond(404, {'error': 'RecordNotFound'})
+
+    def _respond(self, status, data, headers=None):
+        body = json.dumps(data).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_ticket(ticket_id, subject, ticket_type='problem'):
+    return {
+        'id': ticket_id,
+        'url': 'https://example.zendesk.com/api/v2/tickets/{}.json'.format(
+            ticket_id),
+        'type': ticket_type,
+        'subject': subject,
+        'raw_subject': subject,
+        'description': subject * 5,
+        'status': 'open',
+        'tags': ['sentry', 'benchmark'],
+        'custom_fields': [{'id': i, 'value': None} for i in range(20)],
+        'via': {'channel': 'api', 'source': {'from': {}, 'to': {}}},
+    }
+
+
+def make_create_response(ticket_id, ticket):
+    return {
+        'ticket': make_ticket(ticket_id, ticket['subject'], ticket['type']),
+        'audit': {
+            'id': ticket_id,
+            'ticket_id': ticket_id,
+            'events': [{'id': i, 'type': 'Create', 'value': 'x' * 200}
+                       for i in range(30)],
+        },
+    }
+
+
+def make_search_response(word, count):
+    return {
+        'results': [make_ticket(i, 'Ticket about {} number {}'.format(word, i))
+                    for i in range(1, count + 1)],
+        'next_page': None,
+        'count': count,
+    }
@@ -0,0 +1,60 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+import os
+import platform
+import time
+
+from django.conf import settings
+from sentry.utils import json
+
+
+def get_env(name, default, type=float):
+    return type(os.environ.get('SENTRY_ZENDESK_BENCH_' + name, default))
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def summarize(durations):
+    """
+    Latency summary, in milliseconds, of the given durations in seconds.
+    """
+    return {
+        'count': len(durations),
+        'mean': 1000 * sum(durations) / len(durations),
+        'p50': 1000 * percentile(durations, 0.5),
+        'p90': 1000 * percentile(durations, 0.9),
+        'p99': 1000 * percentile(durations, 0.99),
+        'max': 1000 * max(durations),
+    }
+
+
+class Recorder(object):
+    """
+    Collects the results of the benchmarks to write them as JSON.
+    """
+
+    def __init__(self):
+        self.results = {}
+
+    def record(self, name, **values):
+        self.results[name] = values
+
+    def dump(self, path):
+        data = {
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'settings': dict(
+                (name, getattr(settings, name)) for name in dir(settings)
+                if name.startswith('SENTRY_ZENDESK_')),
+            'benchmarks': self.results,
+        }
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+
+
+recorder = Recorder()
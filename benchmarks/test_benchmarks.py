@@ -0,0 +1,151 @@
+"""
+Benchmarks of the plugin against a local fake Zendesk server.
+
+Run with `py.test benchmarks`; the server is tuned with the environment
+variables below and the results are written as JSON to
+`$SENTRY_ZENDESK_BENCH_OUTPUT` (`benchmark-results.json` by default).
+
+- `SENTRY_ZENDESK_BENCH_LATENCY`: seconds each response is delayed
+- `SENTRY_ZENDESK_BENCH_ERROR_RATE`: fraction of responses which are a 500
+- `SENTRY_ZENDESK_BENCH_RATE_LIMIT_RATE`: fraction of responses which are
+  a 429
+- `SENTRY_ZENDESK_BENCH_EVENTS`: number of events/requests of each benchmark
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import gc
+import resource
+import time
+
+from django.test import RequestFactory
+from exam import fixture
+from sentry.models import GroupMeta
+from sentry.testutils import TestCase
+from sentry_plugins.exceptions import ApiError
+
+from fake_zendesk import FakeZendesk
+from recorder import get_env, recorder, summarize
+from sentry_zendesk.batching import incidents
+from sentry_zendesk.client import get_client
+from sentry_zendesk.dispatch import dispatcher
+from sentry_zendesk.plugin import ZendeskPlugin
+from sentry_zendesk.testutils import reset_state
+
+
+class ZendeskBenchmark(TestCase):
+
+    @fixture
+    def plugin(self):
+        return ZendeskPlugin()
+
+    @fixture
+    def events(self):
+        return get_env('EVENTS', 200, int)
+
+    def setUp(self):
+        super(ZendeskBenchmark, self).setUp()
+        self.server = FakeZendesk(
+            latency=get_env('LATENCY', 0),
+            error_rate=get_env('ERROR_RATE', 0),
+            rate_limit_rate=get_env('RATE_LIMIT_RATE', 0),
+        ).start()
+        self.plugin.set_option('zendesk_url', self.server.url, self.project)
+        self.plugin.set_option('username', 'Bob', self.project)
+        self.plugin.set_option('password', 'bob123', self.project)
+
+    def tearDown(self):
+        self.server.stop()
+        reset_state()
+        super(ZendeskBenchmark, self).tearDown()
+
+    def test_post_process_new_events(self):
+        self.plugin.set_option('auto_create_problems', True, self.project)
+        groups = [self.create_group(message='Group {}'.format(i))
+                  for i in range(self.events)]
+
+        elapsed, durations, errors = self._post_process(groups, is_new=True)
+        self._record_throughput('post_process_new', elapsed, durations, errors)
+
+    def test_post_process_repeated_events(self):
+        self.plugin.set_option('auto_create_incidents', True, self.project)
+        group = self.create_group(message='Hello world')
+        GroupMeta.objects.set_value(
+            group, '%s:tid' % self.plugin.get_conf_key(), '12345')
+
+        elapsed, durations, errors = self._post_process(
+            [group] * self.events, is_new=False)
+        self._record_throughput(
+            'post_process_repeated', elapsed, durations, errors)
+
+    def test_autocomplete_latency(self):
+        group = self.create_group(message='Hello world')
+        # Half of the queries are new words, the other half repeat them, the
+        # way users refine what they type
+        queries = ['word{}'.format(i // 2) for i in range(self.events)]
+
+        durations = []
+        errors = 0
+        for query in queries:
+            request = RequestFactory().get('/', {
+                'autocomplete_query': query,
+                'autocomplete_field': 'issue_id',
+            })
+            start = time.time()
+            try:
+                self.plugin.view_autocomplete(request, group)
+            except ApiError:
+                errors += 1
+            durations.append(time.time() - start)
+
+        recorder.record(
+            'autocomplete', errors=errors, requests=self.server.requests,
+            latency_ms=summarize(durations))
+
+    def test_client_memory_per_request(self):
+        client = get_client(self.server.url, 'Bob', 'bob123')
+        ticket = ('Hello world', 'Some comment', 'problem', None)
+        # Warm up the session and its pool before measuring
+        client.create_ticket(*ticket)
+
+        gc.collect()
+        objects_before = len(gc.get_objects())
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        errors = 0
+        for i in range(self.events):
+            try:
+                client.create_ticket(*ticket)
+            except ApiError:
+                errors += 1
+        gc.collect()
+        objects_after = len(gc.get_objects())
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        recorder.record(
+            'client_memory', requests=self.events, errors=errors,
+            retained_objects_per_request=(
+                float(objects_after - objects_before) / self.events),
+            peak_rss_growth_kb=rss_after - rss_before)
+
+    def _post_process(self, groups, is_new):
+        durations = []
+        errors = 0
+        start = time.time()
+        for group in groups:
+            event_start = time.time()
+            try:
+                self.plugin.post_process(
+                    group, event=self.event, is_new=is_new, is_sample=False)
+            except ApiError:
+                errors += 1
+            durations.append(time.time() - event_start)
+        # Background work is part of the cost of processing the events
+        dispatcher.join()
+        incidents.flush()
+        return time.time() - start, durations, errors
+
+    def _record_throughput(self, name, elapsed, durations, errors):
+        recorder.record(
+            name, events=len(durations), errors=errors,
+            requests=self.server.requests, seconds=elapsed,
+            events_per_second=len(durations) / elapsed,
+            latency_ms=summarize(durations))
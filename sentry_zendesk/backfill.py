@@ -0,0 +1,241 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+import threading
+import time
+from collections import deque
+
+from sentry.models import Group, GroupStatus
+from sentry_plugins.exceptions import ApiError
+
+from sentry_zendesk import logger, metrics
+from sentry_zendesk.client import ZendeskClient, get_client
+from sentry_zendesk.fanout import ConcurrentClient
+from sentry_zendesk.ratelimit import RateLimitExceeded
+
+
+CHECKPOINT_OPTION = 'backfill_checkpoint'
+JOBS_OPTION = 'backfill_jobs'
+
+# Seconds a request waits for the rate limit of this process before failing
+THROTTLED_TIMEOUT = 300
+
+
+class Backfill(object):
+    """
+    Creates and links Zendesk problems for the unresolved groups of a project
+    which have no linked ticket yet, e.g. the ones which existed before
+    `auto_create_problems` was enabled.
+
+    Groups are walked by id in chunks, each one created with a single bulk
+    request. Up to `concurrency` chunks are sent to Zendesk at the same time,
+    while links are written (in bulk) by the calling thread.
+
+    The id of the last group processed is saved as a plugin option after
+    each chunk, so an interrupted backfill resumes from there. It only
+    advances past fully linked chunks: groups whose ticket failed are tried
+    again by the next run. Each bulk job is saved as soon as Zendesk accepts
+    it, until its tickets are linked, so the next run polls it again instead
+    of creating its tickets twice.
+
+    :param rate_limit: requests per minute this process sends to Zendesk,
+        defaults to the rate limit of the project
+    """
+
+    def __init__(self, plugin, project, chunk_size=None, concurrency=4,
+                 rate_limit=None, stdout=None):
+        self.plugin = plugin
+        self.project = project
+        self.chunk_size = min(chunk_size or ZendeskClient.MAX_BULK_TICKETS,
+                              ZendeskClient.MAX_BULK_TICKETS)
+        self.concurrency = concurrency
+        self.rate_limit = rate_limit
+        self.stdout = stdout
+        self.created = 0
+        self.failed = 0
+        self.skipped = 0
+        # Jobs are saved by the threads creating tickets
+        self._jobs_lock = threading.Lock()
+
+    def get_client(self):
+        config = self.plugin.get_project_config(self.project)
+        return get_client(config.zendesk_url, config.username,
+                          config.password,
+                          rate_limit=self.rate_limit or config.rate_limit)
+
+    def get_checkpoint(self):
+        return self.plugin.get_option(CHECKPOINT_OPTION, self.project) or 0
+
+    def set_checkpoint(self, group_id):
+        self.plugin.set_state(CHECKPOINT_OPTION, group_id, self.project)
+
+    def reset(self):
+        # Jobs are kept, as their tickets exist whatever the checkpoint
+        self.plugin.unset_state(CHECKPOINT_OPTION, self.project)
+
+    def get_jobs(self):
+        """
+        Ids of the groups of each bulk job not linked yet, by job id.
+        """
+        return self.plugin.get_option(JOBS_OPTION, self.project) or {}
+
+    def _add_job(self, job_id, group_ids):
+        with self._jobs_lock:
+            jobs = self.get_jobs()
+            jobs[job_id] = group_ids
+            self.plugin.set_state(JOBS_OPTION, jobs, self.project)
+
+    def _remove_job(self, job_id):
+        with self._jobs_lock:
+            jobs = self.get_jobs()
+            jobs.pop(job_id, None)
+            if jobs:
+                self.plugin.set_state(JOBS_OPTION, jobs, self.project)
+            else:
+                self.plugin.unset_state(JOBS_OPTION, self.project)
+
+    def iter_chunks(self, after):
+        """
+        Unresolved groups with id greater than `after`, in chunks, along with
+        the id of the last group of each chunk.
+        """
+        while True:
+            groups = list(Group.objects.filter(
+                project=self.project,
+                status=GroupStatus.UNRESOLVED,
+                id__gt=after,
+            ).order_by('id')[:self.chunk_size])
+            if not groups:
+                return
+            after = groups[-1].id
+            yield after, groups
+
+    def run(self):
+        client = self.get_client()
+        self.resume_jobs(client)
+        # Groups of the jobs which could not be resumed
+        queued = set(group_id for group_ids in self.get_jobs().values()
+                     for group_id in group_ids)
+        concurrent = ConcurrentClient(client, self.concurrency)
+        # Chunks sent to Zendesk, in the order they were read
+        in_flight = deque()
+        advancing = True
+        try:
+            for last_id, groups in self.iter_chunks(self.get_checkpoint()):
+                # Keeps the rate limit of the backfill applying to the
+                # instance (it expires unless it is used)
+                self.get_client()
+                linked = self.plugin.get_linked_tickets(groups)
+                pending = [group for group in groups
+                           if not linked[group.id] and group.id not in queued]
+                waiting = sum(1 for group in groups if group.id in queued)
+                self.skipped += len(groups) - len(pending) - waiting
+                # Groups have the title of their latest event, which saves
+                # loading an event per group
+                tickets = [self.plugin._build_ticket(group, group, 'problem')
+                           for group in pending]
+                in_flight.append((last_id, pending, waiting, concurrent.submit(
+                    self._create_tickets, client, tickets,
+                    [group.id for group in pending])))
+                while len(in_flight) >= self.concurrency:
+                    advancing = self._finish(
+                        client, in_flight.popleft(), advancing)
+            while in_flight:
+                advancing = self._finish(
+                    client, in_flight.popleft(), advancing)
+        finally:
+            concurrent.close()
+        return self.created, self.failed, self.skipped
+
+    def resume_jobs(self, client):
+        """
+        Links the groups of the jobs an interrupted run didn't link.
+        """
+        for job_id, group_ids in sorted(self.get_jobs().items()):
+            try:
+                ticket_ids = retry_throttled(client.wait_for_job, job_id)
+            except ApiError as e:
+                if e.code != 404:
+                    logger.exception('Failed to resume job "{}"'.format(
+                        job_id))
+                    self.failed += len(group_ids)
+                    continue
+                # Zendesk no longer knows the job, so its groups are sent
+                # again
+                logger.warning('Job "{}" is gone, creating its {} problems '
+                               'again'.format(job_id, len(group_ids)))
+                self._remove_job(job_id)
+                continue
+            self._link(group_ids, ticket_ids)
+            self._remove_job(job_id)
+
+    def _create_tickets(self, client, tickets, group_ids):
+        if not tickets:
+            return None
+        job_id = retry_throttled(client.create_tickets, tickets)
+        # Saved right away, since the tickets exist from now on, while the
+        # calling thread may still be polling the jobs of earlier chunks
+        self._add_job(job_id, group_ids)
+        return job_id
+
+    def _finish(self, client, chunk, advancing):
+        last_id, groups, waiting, result = chunk
+        group_ids = [group.id for group in groups]
+        ticket_ids = [None] * len(groups)
+        job_id = None
+        try:
+            job_id = result.get()
+            if job_id is not None:
+                ticket_ids = retry_throttled(client.wait_for_job, job_id)
+        except Exception:
+            logger.exception('Failed to create problems for {} groups'.format(
+                len(groups)))
+            failed = self._link(group_ids, [None] * len(groups))
+        else:
+            failed = self._link(group_ids, ticket_ids)
+            if job_id is not None:
+                self._remove_job(job_id)
+
+        advancing = advancing and not failed and not waiting
+        if advancing:
+            self.set_checkpoint(last_id)
+        self._report('Linked {} problems up to group {} ({} failed, {} '
+                     'already linked)'.format(self.created, last_id,
+                                              self.failed, self.skipped))
+        return advancing
+
+    def _link(self, group_ids, ticket_ids):
+        """
+        Links the created tickets, returning how many groups failed.
+        """
+        links = dict((group_id, ticket_id)
+                     for group_id, ticket_id in zip(group_ids, ticket_ids)
+                     if ticket_id is not None)
+        self.plugin.set_linked_tickets(self.project, links)
+        failed = len(group_ids) - len(links)
+        self.created += len(links)
+        self.failed += failed
+        metrics.incr('backfill.created', len(links))
+        if failed:
+            metrics.incr('backfill.failed', failed)
+        return failed
+
+    def _report(self, message):
+        logger.info(message)
+        if self.stdout is not None:
+            self.stdout.write(message)
+
+
+def retry_throttled(fn, *args):
+    """
+    Calls `fn`, waiting while the rate limit of this process is exhausted,
+    for `THROTTLED_TIMEOUT` seconds at most.
+    """
+    deadline = time.time() + THROTTLED_TIMEOUT
+    while True:
+        try:
+            return fn(*args)
+        except RateLimitExceeded:
+            if time.time() >= deadline:
+                raise
+            logger.info('Backfill throttled by the rate limit')
+            time.sleep(1)
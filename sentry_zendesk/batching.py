@@ -0,0 +1,226 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+import atexit
+import threading
+from collections import namedtuple
+
+from django.conf import settings
+
+from sentry_zendesk import logger, metrics
+from sentry_zendesk.dispatch import SPILL, Dispatcher
+
+
+# Full batches waiting for the sender thread, the ones over it are sent by
+# the caller filling them
+SENDER_QUEUE_SIZE = 10
+
+
+def get_batch_window():
+    """
+    Seconds incidents are held before being sent. Zero disables batching, so
+    every incident is created right away with its own request.
+    """
+    return getattr(settings, 'SENTRY_ZENDESK_INCIDENT_BATCH_WINDOW', 0)
+
+
+def get_batch_size():
+    from sentry_zendesk.client import ZendeskClient
+    size = getattr(settings, 'SENTRY_ZENDESK_INCIDENT_BATCH_SIZE',
+                   ZendeskClient.MAX_BULK_TICKETS)
+    return min(size, ZendeskClient.MAX_BULK_TICKETS)
+
+
+class Batch(namedtuple('Batch', ['client', 'tickets'])):
+
+    # Logged by the sender, which must not log the tickets themselves
+    def __repr__(self):
+        return '<Batch of {} tickets>'.format(len(self.tickets))
+
+
+class TicketBatcher(object):
+    """
+    Gathers tickets waiting to be created and sends them to Zendesk through
+    the bulk endpoint, either when `size` tickets are pending for the same
+    client or `window` seconds after the first one arrived. Batches are
+    sent in background by a single sender thread, so the caller doesn't
+    wait for Zendesk unless the sender falls `SENDER_QUEUE_SIZE` batches
+    behind.
+
+    The bulk job of each batch is polled, and the tickets it failed to
+    create are sent again one by one. Tickets whose creation fails for a
+    transient reason are spooled (see `sentry_zendesk.spool`) when the spool
+    is enabled.
+    """
+
+    def __init__(self, window=None, size=None):
+        self._window = window
+        self._size = size
+        # client -> list of pending (ticket, project id, group id)
+        self._pending = {}
+        self._timers = {}
+        self._sender = Dispatcher(workers=1, queue_size=SENDER_QUEUE_SIZE,
+                                  overflow=SPILL, name='batch-sender')
+        self._lock = threading.Lock()
+
+    @property
+    def window(self):
+        return self._window if self._window is not None else get_batch_window()
+
+    @property
+    def size(self):
+        return self._size if self._size is not None else get_batch_size()
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    def add(self, client, ticket, project_id=None, group_id=None):
+        """
+        :param project_id: project (and group) the ticket is created for,
+            needed to spool it
+        """
+        batch = None
+        with self._lock:
+            pending = self._pending.setdefault(client, [])
+            pending.append((ticket, project_id, group_id))
+            if len(pending) >= self.size:
+                batch = self._take(client)
+            elif client not in self._timers:
+                timer = threading.Timer(
+                    self.window, self.flush_client, args=(client,))
+                timer.daemon = True
+                self._timers[client] = timer
+                timer.start()
+        if batch:
+            self._send_later(client, batch)
+
+    def flush_client(self, client):
+        with self._lock:
+            batch = self._take(client)
+        if batch:
+            self._send_later(client, batch)
+
+    def flush(self):
+        """
+        Sends every pending ticket, waiting for the batches already being
+        sent in background.
+        """
+        with self._lock:
+            batches = [(client, self._take(client))
+                       for client in list(self._pending)]
+        for client, batch in batches:
+            if batch:
+                self._send(client, batch)
+        self._sender.join()
+
+    def pending_count(self):
+        with self._lock:
+            return sum(len(tickets) for tickets in self._pending.values())
+
+    def clear(self):
+        """
+        Drops the pending tickets without sending them.
+        """
+        with self._lock:
+            for client in list(self._pending):
+                self._take(client)
+
+    def _take(self, client):
+        timer = self._timers.pop(client, None)
+        if timer is not None:
+            timer.cancel()
+        return self._pending.pop(client, [])
+
+    def _send_later(self, client, batch):
+        self._sender.submit(self._send_batch, Batch(client, batch))
+
+    def _send_batch(self, batch):
+        self._send(batch.client, batch.tickets)
+
+    def _send(self, client, batch):
+        from sentry_zendesk.client import is_transient_error
+
+        try:
+            if len(batch) == 1:
+                self._try_create_one(client, batch[0])
+                return
+            try:
+                job_id = client.create_tickets(
+                    [ticket for ticket, _, _ in batch])
+            except Exception as e:
+                if is_transient_error(e) and self._spool(batch):
+                    return
+                # Nothing was created, so it is safe to go one by one
+                logger.exception('Bulk ticket creation failed, falling back '
+                                 'to single ticket creation')
+                for item in batch:
+                    self._try_create_one(client, item)
+            else:
+                self._check_job(client, job_id, batch)
+        except Exception:
+            logger.exception('Failed to create batch of {} tickets'.format(
+                len(batch)))
+
+    def _check_job(self, client, job_id, batch):
+        """
+        Waits for the bulk job of a batch, creating one by one the tickets
+        it failed to create (e.g. invalid ones, or whose problem was
+        closed meanwhile).
+        """
+        try:
+            job_status = client.poll_job(job_id)
+        except Exception:
+            # The tickets may exist already, so they aren't sent again
+            logger.exception('Failed to check tickets job "{}"'.format(
+                job_id))
+            metrics.incr('batching.unknown', len(batch))
+            return
+        created = set(result.get('index')
+                      for result in job_status.get('results') or []
+                      if result.get('id') is not None)
+        failed = [item for index, item in enumerate(batch)
+                  if index not in created]
+        metrics.incr('batching.sent', len(batch) - len(failed))
+        if failed:
+            logger.warning('Tickets job "{}" {} failing to create {} of {} '
+                           'tickets, creating them one by one'.format(
+                               job_id, job_status['status'], len(failed),
+                               len(batch)))
+            for item in failed:
+                self._try_create_one(client, item)
+
+    def _try_create_one(self, client, item):
+        from sentry_zendesk.client import is_transient_error, unpack_ticket
+
+        ticket = item[0]
+        try:
+            return client.create_ticket(**unpack_ticket(ticket))
+        except Exception as e:
+            if is_transient_error(e) and self._spool([item]):
+                return None
+            logger.exception('Failed to create {} ticket'.format(
+                ticket['type']))
+            metrics.incr('batching.failed')
+            return None
+
+    def _spool(self, batch):
+        """
+        Spools the tickets, returning whether it was possible.
+        """
+        from sentry_zendesk.spool import spool
+
+        if not spool.enabled or any(
+                project_id is None for _, project_id, _ in batch):
+            return False
+        for ticket, project_id, group_id in batch:
+            spool.append({
+                'project_id': project_id,
+                'group_id': group_id,
+                'ticket': ticket,
+            })
+        logger.warning('Spooled {} tickets'.format(len(batch)))
+        return True
+
+
+incidents = TicketBatcher()
+atexit.register(incidents.flush)
@@ -0,0 +1,209 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class LRUCache(object):
+    """
+    Thread safe cache which keeps at most `max_size` entries, discarding the
+    least recently used ones, and expires entries older than `ttl` seconds.
+
+    Both can be functions returning them (e.g. the getter of a setting), so
+    module level caches read their settings when used rather than on import.
+    """
+
+    def __init__(self, max_size, ttl=None):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def max_size(self):
+        return self._max_size() if callable(self._max_size) else self._max_size
+
+    @property
+    def ttl(self):
+        return self._ttl() if callable(self._ttl) else self._ttl
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires = self._entries.pop(key)
+            except KeyError:
+                return default
+            if expires is not None and expires < time.time():
+                return default
+            self._entries[key] = value, expires
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl if ttl is not None else self.ttl
+        expires = time.time() + ttl if ttl else None
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value, expires
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+
+def get_search_cache_ttl():
+    return getattr(settings, 'SENTRY_ZENDESK_SEARCH_CACHE_TTL', 60)
+
+
+def get_search_cache_size():
+    return getattr(settings, 'SENTRY_ZENDESK_SEARCH_CACHE_SIZE', 1000)
+
+
+_word_re = re.compile(r'\W+', re.UNICODE)
+
+
+def subject_matches(subject, query):
+    """
+    Local approximation of Zendesk's `subject:<query>*` search: some word of
+    the subject starts with the query.
+    """
+    query = query.lower()
+    return any(word.startswith(query)
+               for word in _word_re.split((subject or '').lower()))
+
+
+class SearchCache(object):
+    """
+    Cache of ticket searches, scoped by project.
+
+    Searches are cached along with whether they hold every matching ticket
+    (`complete`). A query whose shorter prefix has a complete cached result is
+    answered by filtering it, as Zendesk would return a subset of it anyway.
+    Such results expire along with the one they come from, so typing longer
+    queries doesn't keep old results alive.
+    """
+
+    def __init__(self, max_size=None, ttl=None):
+        self._cache = LRUCache(max_size or get_search_cache_size,
+                               ttl if ttl is not None else
+                               get_search_cache_ttl)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, project_id, query):
+        cached = self._cache.get((project_id, query))
+        if cached is not None:
+            self.hits += 1
+            return cached[0]
+
+        if not _word_re.search(query):
+            for size in range(len(query) - 1, 0, -1):
+                cached = self._cache.get((project_id, query[:size]))
+                if cached is not None and cached[1]:
+                    self.hits += 1
+                    results = [result for result in cached[0]
+                               if subject_matches(result['subject'], query)]
+                    self._set(project_id, query, results, True, cached[2])
+                    return results
+
+        self.misses += 1
+        return None
+
+    def set(self, project_id, query, results, complete):
+        ttl = self._cache.ttl
+        expires = time.time() + ttl if ttl else None
+        self._set(project_id, query, results, complete, expires)
+
+    def _set(self, project_id, query, results, complete, expires):
+        if expires is None:
+            ttl = None
+        else:
+            ttl = expires - time.time()
+            if ttl <= 0:
+                return
+        self._cache.set((project_id, query), (results, complete, expires),
+                        ttl=ttl)
+
+    def clear(self):
+        self._cache.clear()
+
+
+searches = SearchCache()
+
+
+def get_link_cache_ttl():
+    return getattr(settings, 'SENTRY_ZENDESK_LINK_CACHE_TTL', 60)
+
+
+def get_link_cache_negative_ttl():
+    return getattr(settings, 'SENTRY_ZENDESK_LINK_CACHE_NEGATIVE_TTL', 10)
+
+
+def get_link_cache_size():
+    return getattr(settings, 'SENTRY_ZENDESK_LINK_CACHE_SIZE', 10000)
+
+
+class LinkCache(object):
+    """
+    Cache of the ticket linked to each group (by group id), including groups
+    without a linked ticket.
+
+    Every process has its own cache, so links changed by other processes
+    (e.g. the user linking a ticket through the web) are only seen once the
+    entry expires. Groups without a link expire sooner, as that is what
+    changes when a ticket is linked.
+    """
+
+    MISSING = object()
+
+    def __init__(self, max_size=None):
+        self._cache = LRUCache(max_size or get_link_cache_size)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, group_id):
+        """
+        The linked ticket id, `None` if the group is known to have no linked
+        ticket or `MISSING` if it isn't cached.
+        """
+        value = self._cache.get(group_id, self.MISSING)
+        if value is self.MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, group_id, ticket_id):
+        if ticket_id is None:
+            ttl = get_link_cache_negative_ttl()
+        else:
+            ttl = get_link_cache_ttl()
+        self._cache.set(group_id, ticket_id, ttl=ttl)
+
+    def set_many(self, ticket_ids):
+        for group_id, ticket_id in ticket_ids.items():
+            self.set(group_id, ticket_id)
+
+    def delete(self, group_id):
+        self._cache.delete(group_id)
+
+    def clear(self):
+        self._cache.clear()
+
+
+links = LinkCache()
@@ -0,0 +1,138 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+import threading
+import time
+
+from django.conf import settings
+from sentry_plugins.exceptions import ApiError
+
+from sentry_zendesk import logger, metrics
+
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+def get_failure_threshold():
+    return getattr(settings, 'SENTRY_ZENDESK_BREAKER_THRESHOLD', 5)
+
+
+def get_reset_timeout():
+    return getattr(settings, 'SENTRY_ZENDESK_BREAKER_RESET_TIMEOUT', 30)
+
+
+class CircuitOpenError(ApiError):
+    code = 503
+
+
+class CircuitBreaker(object):
+    """
+    Stops sending requests to a Zendesk instance which keeps failing.
+
+    After `failure_threshold` consecutive failures the circuit opens and
+    requests fail right away. Once `reset_timeout` seconds have passed a
+    single trial request is let through (half-open): the circuit closes
+    again if it succeeds, and reopens otherwise.
+    """
+
+    def __init__(self, key, failure_threshold=None, reset_timeout=None):
+        self.key = key
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def failure_threshold(self):
+        if self._failure_threshold is not None:
+            return self._failure_threshold
+        return get_failure_threshold()
+
+    @property
+    def reset_timeout(self):
+        if self._reset_timeout is not None:
+            return self._reset_timeout
+        return get_reset_timeout()
+
+    def allow_request(self):
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if time.time() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = HALF_OPEN
+            if self._trial_running:
+                return False
+            self._trial_running = True
+            return True
+
+    def before_request(self):
+        if not self.allow_request():
+            metrics.incr('circuit.rejected')
+            raise CircuitOpenError(
+                'Zendesk instance "{}" is unhealthy, not sending requests '
+                'until {:.0f}s after it started failing'
+                .format(self.key, self.reset_timeout))
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info('Circuit of "{}" closed'.format(self.key))
+            self.state = CLOSED
+            self.failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.state == HALF_OPEN or (
+                    self.state == CLOSED and
+                    self.failures >= self.failure_threshold):
+                self.state = OPEN
+                self.opened_at = time.time()
+                self.trips += 1
+                metrics.incr('circuit.trip')
+                logger.warning('Circuit of "{}" opened after {} failures'
+                               .format(self.key, self.failures))
+
+    def get_stats(self):
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'trips': self.trips,
+            'opened_at': self.opened_at,
+        }
+
+
+class CircuitBreakerRegistry(object):
+
+    def __init__(self):
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, zendesk_url):
+        with self._lock:
+            breaker = self._breakers.get(zendesk_url)
+            if breaker is None:
+                breaker = self._breakers[zendesk_url] = CircuitBreaker(
+                    zendesk_url)
+            return breaker
+
+    def get_stats(self):
+        with self._lock:
+            return dict((url, breaker.get_stats())
+                        for url, breaker in self._breakers.items())
+
+    def clear(self):
+        with self._lock:
+            self._breakers.clear()
+
+
+breakers = CircuitBreakerRegistry()
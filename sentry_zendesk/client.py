@@ -1,60 +1,567 @@
 from __future__ import absolute_import, print_function, unicode_literals
 
-from django.utils.encoding import force_bytes  # noqa
-from requests.exceptions import HTTPError
-from sentry.http import build_session
+import hashlib
+import random
+import sys
+import threading
+import time
+import zlib
+from functools import partial
+
+import six
+from django.conf import settings
+from django.utils.encoding import force_bytes
+from requests.exceptions import ConnectionError, HTTPError, Timeout
+from sentry.http import BlacklistAdapter, build_session
+from sentry.utils import json
 from sentry_plugins.exceptions import ApiError
 
-from sentry_zendesk import logger
+from sentry_zendesk import logger, metrics
+from sentry_zendesk.circuitbreaker import breakers
+from sentry_zendesk.parsing import get_path, project
+from sentry_zendesk.ratelimit import HIGH, LOW, get_max_wait, limiters
+from sentry_zendesk.singleflight import canonical_key, flights
+
+
+# Transient errors worth retrying
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+GZIP_LEVEL = 6
 
 
 class ZendeskClient(object):
 
     SEARCH_URL = '/api/v2/search.json'
+    SEARCH_EXPORT_URL = '/api/v2/search/export.json'
+    SEARCH_PAGE_SIZE = 100
     CREATE_URL = '/api/v2/tickets.json'
+    CREATE_MANY_URL = '/api/v2/tickets/create_many.json'
+    UPDATE_URL = '/api/v2/tickets/{}.json'
+    UPDATE_MANY_URL = '/api/v2/tickets/update_many.json'
+    JOB_STATUS_URL = '/api/v2/job_statuses/{}.json'
+    EXPORT_URL = '/api/v2/incremental/tickets/cursor.json'
     HTTP_TIMEOUT = 5
+    # Zendesk refuses bulk requests with more tickets than this
+    MAX_BULK_TICKETS = 100
+    JOB_POLL_INTERVAL = 1
+    JOB_POLL_TIMEOUT = 60
+    RATE_LIMIT_RETRIES = 1
 
-    def __init__(self, zendesk_url, username, password):
+    def __init__(self, zendesk_url, username, password, pool_size=None):
         self.zendesk_url = zendesk_url.rstrip('/')
         self.username = username
         self.password = password
+        self.pool_size = pool_size or get_pool_size()
+        self.last_used = time.time()
+        self._session = None
+        self._session_lock = threading.Lock()
 
-    def create_ticket(self, title, comment, ticket_type, problem_id):
+    def create_ticket(self, title, comment, ticket_type, problem_id,
+                      **fields):
+        """
+        :param fields: other fields of the ticket, e.g. `tags`
+        """
         params = {
-            'ticket': {
-                'type': ticket_type,
-                'subject': title,
-                'comment': comment,
-            }
+            'ticket': build_ticket(title, comment, ticket_type, problem_id,
+                                   **fields)
         }
-        if problem_id is not None:
-            params['ticket']['problem_id'] = problem_id
-
-        response = self.make_request('post', self.CREATE_URL, params)
-        created_ticket = response.json()['ticket']
-        ticket_id = unicode(created_ticket['id'])
+        response = self.make_request('post', self.CREATE_URL, params,
+                                     priority=HIGH, stream=True)
+        # The ticket comes along with its (big) audit, which is never used
+        ticket = self._project(response, ['ticket.id'])
+        ticket_id = unicode(ticket['ticket.id'])
         logger.info('Created new ticket id "{}"'.format(ticket_id))
         return ticket_id
 
-    def search_tickets(self, query):
+    def create_tickets(self, tickets):
+        """
+        Creates many tickets (as returned by `build_ticket`) in a single
+        request. Zendesk processes them asynchronously, so this returns the
+        id of the job which can be given to `wait_for_job`.
+        """
+        assert len(tickets) <= self.MAX_BULK_TICKETS
+        response = self.make_request(
+            'post', self.CREATE_MANY_URL, {'tickets': tickets})
+        job_id = response.json()['job_status']['id']
+        logger.info('Queued creation of {} tickets on job "{}"'.format(
+            len(tickets), job_id))
+        return job_id
+
+    def add_comment(self, ticket_id, comment):
+        """
+        Adds a public comment to an existing ticket.
+        """
+        self.make_request(
+            'put', self.UPDATE_URL.format(ticket_id),
+            {'ticket': {'comment': {'body': comment}}})
+        logger.info('Added comment to ticket id "{}"'.format(ticket_id))
+
+    def add_comments(self, comments):
+        """
+        Adds comments to many tickets (ticket id -> comment) in a single
+        request, returning the id of the job processing it.
+        """
+        assert len(comments) <= self.MAX_BULK_TICKETS
+        response = self.make_request('put', self.UPDATE_MANY_URL, {
+            'tickets': [{'id': int(ticket_id), 'comment': {'body': comment}}
+                        for ticket_id, comment in sorted(comments.items())],
+        })
+        job_id = response.json()['job_status']['id']
+        logger.info('Queued comments to {} tickets on job "{}"'.format(
+            len(comments), job_id))
+        return job_id
+
+    def get_job_status(self, job_id):
+        response = self.make_request('get', self.JOB_STATUS_URL.format(job_id))
+        return response.json()['job_status']
+
+    def poll_job(self, job_id, poll_interval=None, timeout=None):
+        """
+        Polls the given job until it finishes, returning its last status.
+        """
+        if poll_interval is None:
+            poll_interval = self.JOB_POLL_INTERVAL
+        if timeout is None:
+            timeout = self.JOB_POLL_TIMEOUT
+        deadline = time.time() + timeout
+        while True:
+            job_status = self.get_job_status(job_id)
+            if job_status['status'] in ('completed', 'failed', 'killed'):
+                break
+            if time.time() >= deadline:
+                raise ApiError('Timed out waiting for job "{}"'.format(job_id))
+            time.sleep(poll_interval)
+        return job_status
+
+    def wait_for_job(self, job_id, poll_interval=None, timeout=None):
+        """
+        Polls the given job until it finishes, returning the ids of the
+        created tickets in the same order they were sent (`None` for the
+        ones which failed).
+        """
+        job_status = self.poll_job(job_id, poll_interval, timeout)
+        results = sorted(job_status.get('results') or [],
+                         key=lambda result: result.get('index', 0))
+        ticket_ids = [
+            unicode(result['id']) if result.get('id') is not None else None
+            for result in results
+        ]
+        logger.info('Job "{}" {} creating tickets {}'.format(
+            job_id, job_status['status'], ticket_ids))
+        return ticket_ids
+
+    def search_tickets(self, query, fields=None):
+        """
+        First page of tickets whose subject starts with `query`. When
+        `fields` is given, only those fields of each ticket are read from
+        the response (along with `next_page` and `count`).
+        """
         params = {'query': 'type:ticket subject:{}*'.format(query)}
-        response = self.make_request('get', self.SEARCH_URL, params)
-        return response.json()
+        return self._coalesce(self._search, self.SEARCH_URL, params, fields)
+
+    def _search(self, url, params, fields):
+        if fields is None:
+            return self.make_request('get', url, params).json()
+        response = self.make_request('get', url, params, stream=True)
+        return self._project(response, ['next_page', 'count'],
+                             items=('results', fields))
+
+    def _coalesce(self, read, url, params, *args):
+        """
+        Concurrent identical reads share a single request.
+        """
+        key = canonical_key(self.zendesk_url, self.username, 'get', url,
+                            params, args)
+        return flights.do(key, read, url, params, *args)
+
+    def iter_tickets(self, query, fields=None, limit=None, prefetch=False,
+                     cursor=False):
+        """
+        Lazily iterates over all the tickets whose subject starts with
+        `query`, fetching pages as they are needed.
+
+        :param fields: only read these fields of each ticket
+        :param limit: stop after this many tickets
+        :param prefetch: fetch the next page in background while the current
+            one is consumed
+        :param cursor: use Zendesk's cursor based search export, which has
+            no limit on the number of results (offset pagination stops at
+            1000)
+        """
+        query = 'type:ticket subject:{}*'.format(query)
+        if cursor:
+            url = self.SEARCH_EXPORT_URL
+            params = {'query': query, 'filter[type]': 'ticket',
+                      'page[size]': self.SEARCH_PAGE_SIZE}
+        else:
+            url = self.SEARCH_URL
+            params = {'query': query}
+
+        count = 0
+        page = PageFetcher(self._coalesce, self._fetch_search_page, url,
+                           params, fields, cursor)
+        while page is not None:
+            results, next_url = page.get()
+            page = None
+            if next_url and (limit is None or
+                             count + len(results) < limit):
+                # The next page URL already has all the parameters
+                page = PageFetcher(self._coalesce, self._fetch_search_page,
+                                   next_url, None, fields, cursor)
+                if prefetch:
+                    page.start()
+            for result in results:
+                yield result
+                count += 1
+                if limit is not None and count >= limit:
+                    return
+
+    def _fetch_search_page(self, url, params, fields, cursor):
+        if cursor:
+            next_fields = ['links.next', 'meta.has_more']
+        else:
+            next_fields = ['next_page']
+        if fields is None:
+            data = self.make_request('get', url, params).json()
+            page = dict((field, get_path(data, field))
+                        for field in next_fields)
+            page['results'] = data.get('results') or []
+        else:
+            response = self.make_request('get', url, params, stream=True)
+            page = self._project(response, next_fields,
+                                 items=('results', fields))
 
-    def make_request(self, method, url, payload=None):
+        if cursor:
+            next_url = page['meta.has_more'] and page['links.next']
+        else:
+            next_url = page['next_page']
+        return page['results'], next_url
+
+    def export_tickets(self, cursor=None, start_time=0, fields=None):
+        """
+        A page of Zendesk's incremental ticket export: the tickets changed
+        since `cursor` (or `start_time`, for the first page), along with the
+        cursor for the next page. When `fields` is given, only those fields
+        of each ticket are read (along with `after_cursor` and
+        `end_of_stream`).
+        """
+        if cursor:
+            params = {'cursor': cursor}
+        else:
+            params = {'start_time': start_time}
+        if fields is None:
+            return self.make_request('get', self.EXPORT_URL, params).json()
+        response = self.make_request('get', self.EXPORT_URL, params,
+                                     stream=True)
+        return self._project(response, ['after_cursor', 'end_of_stream'],
+                             items=('tickets', fields))
+
+    def _project(self, response, fields=(), items=None):
+        """
+        Reads the given parts of a streamed response (see `project`),
+        counting its bytes once it was read.
+        """
+        return project(response, fields, items,
+                       on_read=partial(count_response_bytes, response))
+
+    @property
+    def session(self):
+        """
+        Session kept alive for the whole life of the client, so consecutive
+        requests reuse the pooled connections (and their TLS handshakes).
+        """
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    session = build_session()
+                    adapter = BlacklistAdapter(pool_connections=1,
+                                               pool_maxsize=self.pool_size)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session = session
+        return self._session
+
+    def close(self):
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    @property
+    def limiter(self):
+        return limiters.get(self.zendesk_url)
+
+    @property
+    def breaker(self):
+        return breakers.get(self.zendesk_url)
+
+    def make_request(self, method, url, payload=None, priority=None,
+                     stream=False):
         if url[:4] != "http":
             url = self.zendesk_url + url
+        if priority is None:
+            priority = LOW if method == 'get' else HIGH
+        self.last_used = time.time()
+        with metrics.timer('request', endpoint=metrics.endpoint(url),
+                           method=method) as tags:
+            response = self._send_with_retries(
+                method, url, payload, priority, stream)
+            tags['status'] = response.status_code
+            # Streamed bodies are counted once `project` has read them
+            if not stream or not response.ok:
+                count_response_bytes(response, len(response.content))
+            try:
+                response.raise_for_status()
+            except HTTPError as e:
+                tags['result'] = 'failure'
+                raise ApiError.from_response(e.response)
+        return response
+
+    def _send_with_retries(self, method, url, payload, priority, stream):
+        # Only reads are retried: a failed write may have been processed
+        retries = get_retries() if method == 'get' else 0
+        for attempt in range(retries + 1):
+            try:
+                response = self._send(method, url, payload, priority, stream)
+            except (ConnectionError, Timeout):
+                if attempt == retries:
+                    raise
+            else:
+                if (response.status_code not in RETRY_STATUS_CODES or
+                        attempt == retries):
+                    break
+                response.close()
+            delay = get_backoff_delay(attempt)
+            logger.info('Retrying request to "{}" in {:.2f}s'.format(
+                url, delay))
+            metrics.incr('request.retry', endpoint=metrics.endpoint(url))
+            time.sleep(delay)
+        return response
+
+    def _send(self, method, url, payload, priority, stream=False):
         auth = self.username.encode('utf8'), self.password.encode('utf8')
-        session = build_session()
-        if method == 'get':
-            response = session.get(url, params=payload, auth=auth,
-                                   verify=False, timeout=self.HTTP_TIMEOUT)
-        else:
-            response = session.post(url, json=payload, auth=auth,
-                                    verify=False, timeout=self.HTTP_TIMEOUT)
+        session = self.session
+        limiter = self.limiter
+        breaker = self.breaker
+        if method != 'get':
+            body, headers, size = encode_body(payload)
+            tags = {'endpoint': metrics.endpoint(url), 'method': method}
+        for attempt in range(self.RATE_LIMIT_RETRIES + 1):
+            limiter.acquire(priority)
+            breaker.before_request()
+            try:
+                if method == 'get':
+                    response = session.get(url, params=payload, auth=auth,
+                                           verify=False, stream=stream,
+                                           timeout=self.HTTP_TIMEOUT)
+                else:
+                    metrics.incr('request.bytes', size, **tags)
+                    metrics.incr('request.wire_bytes', len(body), **tags)
+                    response = session.request(
+                        method, url, data=body, headers=headers, auth=auth,
+                        verify=False, stream=stream,
+                        timeout=self.HTTP_TIMEOUT)
+            except Exception:
+                breaker.record_failure()
+                raise
+            if response.status_code >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            retry_after = limiter.update(response)
+            # Requests refused for exceeding the rate limit were not processed
+            # by Zendesk, so they are safe to send again
+            if retry_after is None or retry_after > get_max_wait():
+                break
+            response.close()
+            time.sleep(retry_after)
+        return response
+
+
+class PageFetcher(object):
+    """
+    Fetches a page of results, either when it is needed (`get`) or ahead of
+    time in background (`start`).
+    """
+
+    def __init__(self, fetch, *args):
+        self._fetch = fetch
+        self._args = args
+        self._thread = None
+        self._result = None
+        self._error = None
 
+    def start(self):
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def get(self):
+        if self._thread is None:
+            return self._fetch(*self._args)
+        self._thread.join()
+        if self._error is not None:
+            six.reraise(*self._error)
+        return self._result
+
+    def _run(self):
         try:
-            response.raise_for_status()
-        except HTTPError as e:
-            raise ApiError.from_response(e.response)
-        return response
+            self._result = self._fetch(*self._args)
+        except Exception:
+            self._error = sys.exc_info()
+
+
+def build_ticket(title, comment, ticket_type, problem_id=None, **fields):
+    ticket = {
+        'type': ticket_type,
+        'subject': title,
+        'comment': comment,
+    }
+    if problem_id is not None:
+        ticket['problem_id'] = problem_id
+    ticket.update(fields)
+    return ticket
+
+
+def unpack_ticket(ticket):
+    """
+    Arguments of `create_ticket` for a ticket returned by `build_ticket`.
+    """
+    kwargs = dict(ticket)
+    kwargs['title'] = kwargs.pop('subject')
+    kwargs['ticket_type'] = kwargs.pop('type')
+    kwargs.setdefault('problem_id', None)
+    return kwargs
+
+
+def encode_body(payload):
+    """
+    JSON body of a request, gzipped when it has at least
+    `get_compress_min_size()` bytes.
+
+    :return: the body, its headers and its size before compression
+    """
+    body = force_bytes(json.dumps(payload))
+    headers = {'Content-Type': 'application/json'}
+    size = len(body)
+    min_size = get_compress_min_size()
+    if min_size is not None and size >= min_size:
+        compressor = zlib.compressobj(
+            GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        body = compressor.compress(body) + compressor.flush()
+        headers['Content-Encoding'] = 'gzip'
+    return body, headers, size
+
+
+def count_response_bytes(response, size):
+    """
+    Counts the bytes of a response body which was fully read, as received
+    (`wire_bytes`) and once decoded (`bytes`, given as `size`).
+    """
+    tags = {'endpoint': metrics.endpoint(response.request.url),
+            'method': response.request.method.lower()}
+    metrics.incr('response.bytes', size, **tags)
+    metrics.incr('response.wire_bytes', response.raw.tell(), **tags)
+
+
+def get_compress_min_size():
+    """
+    Bodies of requests with at least this many bytes are gzipped, `None`
+    never compresses them.
+    """
+    return getattr(settings, 'SENTRY_ZENDESK_COMPRESS_MIN_SIZE', None)
+
+
+def is_transient_error(error):
+    """
+    Whether a request failed for reasons expected to go away (e.g. Zendesk
+    being unreachable or overloaded), so it's worth sending it again later.
+    """
+    if isinstance(error, (ConnectionError, Timeout)):
+        return True
+    if isinstance(error, ApiError):
+        return (error.code is None or error.code == 429 or
+                error.code in RETRY_STATUS_CODES)
+    return False
+
+
+def get_retries():
+    return getattr(settings, 'SENTRY_ZENDESK_RETRIES', 2)
+
+
+def get_backoff_delay(attempt):
+    """
+    Exponential backoff with full jitter, so clients failing at the same
+    time don't retry all together.
+    """
+    base = getattr(settings, 'SENTRY_ZENDESK_RETRY_BACKOFF', 0.5)
+    cap = getattr(settings, 'SENTRY_ZENDESK_RETRY_MAX_BACKOFF', 5)
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def get_pool_size():
+    return getattr(settings, 'SENTRY_ZENDESK_POOL_SIZE', 10)
+
+
+def get_pool_idle_timeout():
+    return getattr(settings, 'SENTRY_ZENDESK_POOL_IDLE_TIMEOUT', 300)
+
+
+def credential_fingerprint(password):
+    """
+    Used to tell apart clients of the same user after the password changes,
+    without keeping the password itself as part of the registry key.
+    """
+    return hashlib.sha1(force_bytes(password or '')).hexdigest()
+
+
+class ClientRegistry(object):
+    """
+    Process-wide registry of `ZendeskClient`s, so every project pointing to
+    the same Zendesk instance (with the same credentials) shares a single
+    pool of keep-alive connections. Clients unused for
+    `get_pool_idle_timeout()` seconds are closed.
+    """
+
+    def __init__(self):
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def get(self, zendesk_url, username, password, rate_limit=None):
+        zendesk_url = zendesk_url.rstrip('/')
+        key = (zendesk_url, username, credential_fingerprint(password))
+        with self._lock:
+            self._retire_idle()
+            client = self._clients.get(key)
+            if client is None:
+                # Clients with other credentials of the same user (e.g. the
+                # previous password, or a project with a stale one) may be
+                # in use, so they are only retired once idle
+                client = ZendeskClient(zendesk_url, username, password)
+                self._clients[key] = client
+            limiters.get(zendesk_url, rate_limit)
+            client.last_used = time.time()
+            return client
+
+    def clear(self):
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+
+    def __len__(self):
+        return len(self._clients)
+
+    def _retire_idle(self):
+        deadline = time.time() - get_pool_idle_timeout()
+        for key, client in list(self._clients.items()):
+            if client.last_used < deadline:
+                logger.info(
+                    'Retiring idle Zendesk client for "{}"'.format(key[0]))
+                self._clients.pop(key).close()
+
+
+clients = ClientRegistry()
+
+
+def get_client(zendesk_url, username, password, rate_limit=None):
+    return clients.get(zendesk_url, username, password, rate_limit)
@@ -0,0 +1,202 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+import atexit
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from sentry_zendesk import logger, metrics
+
+
+# Comments merged into a single update, the remaining ones are only counted
+MAX_MERGED_COMMENTS = 20
+# Times comments are sent while Zendesk is unavailable before dropping them
+MAX_ATTEMPTS = 3
+# Seconds before sending again comments which weren't buffered
+RETRY_INTERVAL = 10
+
+
+def get_flush_interval():
+    """
+    Seconds comments are held so the ones for the same ticket are sent
+    together. Zero sends each comment right away.
+    """
+    return getattr(settings, 'SENTRY_ZENDESK_COMMENT_FLUSH_INTERVAL', 10)
+
+
+def merge_comments(comments):
+    merged = '\n\n'.join(comments[:MAX_MERGED_COMMENTS])
+    if len(comments) > MAX_MERGED_COMMENTS:
+        merged += '\n\n(and {} more)'.format(
+            len(comments) - MAX_MERGED_COMMENTS)
+    return merged
+
+
+class CommentBuffer(object):
+    """
+    Holds comments to be added to Zendesk tickets, sending them every
+    `interval` seconds. Comments for the same ticket are merged into a single
+    one, and updates of many tickets of the same client go in a single bulk
+    request.
+
+    Comments failing for a transient reason go back to the buffer, ahead of
+    the ones added meanwhile, and are dropped after `MAX_ATTEMPTS`.
+    """
+
+    def __init__(self, interval=None):
+        self._interval = interval
+        # client -> ticket id -> list of comments
+        self._pending = {}
+        self._timers = {}
+        # (client, ticket id) -> failed attempts of its pending comments
+        self._attempts = {}
+        self._lock = threading.Lock()
+
+    @property
+    def interval(self):
+        if self._interval is not None:
+            return self._interval
+        return get_flush_interval()
+
+    def add(self, client, ticket_id, comment):
+        ticket_id = unicode(ticket_id)
+        if self.interval <= 0:
+            self._send(client, {ticket_id: [comment]})
+            return
+
+        with self._lock:
+            pending = self._pending.setdefault(client, OrderedDict())
+            if ticket_id in pending:
+                metrics.incr('comments.merged')
+            pending.setdefault(ticket_id, []).append(comment)
+            self._schedule(client, self.interval)
+
+    def flush_client(self, client):
+        with self._lock:
+            comments = self._take(client)
+        if comments:
+            self._send(client, comments)
+
+    def flush(self):
+        with self._lock:
+            batches = [(client, self._take(client))
+                       for client in list(self._pending)]
+        for client, comments in batches:
+            if comments:
+                self._send(client, comments)
+
+    def clear(self):
+        """
+        Drops the pending comments without sending them.
+        """
+        with self._lock:
+            for client in list(self._pending):
+                self._take(client)
+            self._attempts.clear()
+
+    def pending_count(self):
+        with self._lock:
+            return sum(len(comments) for tickets in self._pending.values()
+                       for comments in tickets.values())
+
+    def _schedule(self, client, delay):
+        if client not in self._timers:
+            timer = threading.Timer(delay, self.flush_client, args=(client,))
+            timer.daemon = True
+            self._timers[client] = timer
+            timer.start()
+
+    def _take(self, client):
+        timer = self._timers.pop(client, None)
+        if timer is not None:
+            timer.cancel()
+        return self._pending.pop(client, None)
+
+    def _send(self, client, comments):
+        from sentry_zendesk.client import is_transient_error
+
+        merged = OrderedDict((ticket_id, merge_comments(ticket_comments))
+                             for ticket_id, ticket_comments
+                             in comments.items())
+        ticket_ids = list(merged)
+        for start in range(0, len(ticket_ids), client.MAX_BULK_TICKETS):
+            chunk = ticket_ids[start:start + client.MAX_BULK_TICKETS]
+            job_id = None
+            try:
+                if len(chunk) == 1:
+                    client.add_comment(chunk[0], merged[chunk[0]])
+                else:
+                    job_id = client.add_comments(
+                        dict((ticket_id, merged[ticket_id])
+                             for ticket_id in chunk))
+            except Exception as e:
+                if is_transient_error(e):
+                    logger.warning('Failed to add comments to tickets {}, '
+                                   'sending them again later: {}'
+                                   .format(chunk, e))
+                    self._retry(client, chunk, merged)
+                    continue
+                logger.exception('Failed to add comments to tickets {}'
+                                 .format(chunk))
+                metrics.incr('comments.failed', len(chunk))
+                self._forget(client, chunk)
+                continue
+
+            self._forget(client, chunk)
+            failed = self._check_job(client, job_id) if job_id else 0
+            metrics.incr('comments.sent', len(chunk) - failed)
+
+    def _check_job(self, client, job_id):
+        """
+        Waits for a bulk update, logging the tickets it failed to update.
+        Those are not sent again, since the job may have updated them
+        partially.
+
+        :return: number of tickets which failed
+        """
+        try:
+            job_status = client.poll_job(job_id)
+        except Exception:
+            logger.exception('Failed to check comments job "{}"'.format(
+                job_id))
+            return 0
+        results = job_status.get('results') or []
+        failed = [result for result in results
+                  if result.get('errors') or result.get('error') or
+                  result.get('success') is False]
+        if job_status['status'] != 'completed' or failed:
+            logger.error('Comments job "{}" {}, failed tickets: {}'.format(
+                job_status['status'], job_id,
+                [result.get('id') for result in failed]))
+            metrics.incr('comments.failed', len(failed) or 1)
+        return len(failed)
+
+    def _retry(self, client, ticket_ids, merged):
+        with self._lock:
+            pending = self._pending.setdefault(client, OrderedDict())
+            for ticket_id in ticket_ids:
+                key = (client, ticket_id)
+                attempts = self._attempts.get(key, 0) + 1
+                if attempts >= MAX_ATTEMPTS:
+                    logger.error('Dropping comments to ticket {} after {} '
+                                 'attempts'.format(ticket_id, attempts))
+                    metrics.incr('comments.failed')
+                    self._attempts.pop(key, None)
+                    continue
+                self._attempts[key] = attempts
+                pending[ticket_id] = (
+                    [merged[ticket_id]] + pending.get(ticket_id, []))
+            if pending:
+                self._schedule(client, max(self.interval, RETRY_INTERVAL))
+            else:
+                self._pending.pop(client)
+
+    def _forget(self, client, ticket_ids):
+        with self._lock:
+            for ticket_id in ticket_ids:
+                self._attempts.pop((client, ticket_id), None)
+
+
+comments = CommentBuffer()
+atexit.register(comments.flush)
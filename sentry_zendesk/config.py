@@ -0,0 +1,92 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+from collections import namedtuple
+
+from django.conf import settings
+from sentry.models import ProjectOption
+
+from sentry_zendesk.caching import LRUCache
+
+
+OPTIONS = (
+    'zendesk_url',
+    'username',
+    'password',
+    'auto_create_problems',
+    'auto_create_incidents',
+    'comment_on_events',
+    'rate_limit',
+    'incident_limit',
+    'incident_window',
+    'incident_every',
+    'incident_sampled_only',
+    'webhook_secret',
+    'sync_ticket_status',
+    'subject_template',
+    'comment_template',
+    'ticket_tags',
+    'ticket_priority',
+    'custom_fields',
+)
+
+
+class PluginConfig(namedtuple('PluginConfig', OPTIONS)):
+    """
+    Immutable snapshot of the plugin options of a project.
+    """
+
+    @classmethod
+    def load(cls, plugin, project):
+        # All the options of a project come in a single lookup
+        values = ProjectOption.objects.get_all_values(project)
+        return cls(**dict(
+            (option, values.get('%s:%s' % (plugin.get_conf_key(), option)))
+            for option in OPTIONS
+        ))
+
+    @property
+    def templates(self):
+        """
+        Compiled templates of the tickets, which are only compiled once for
+        each configuration.
+        """
+        from sentry_zendesk.templates import templates
+        return templates.compile(
+            self.subject_template, self.comment_template, self.ticket_tags,
+            self.ticket_priority, self.custom_fields)
+
+
+def get_config_cache_ttl():
+    return getattr(settings, 'SENTRY_ZENDESK_CONFIG_CACHE_TTL', 30)
+
+
+def get_config_cache_size():
+    return getattr(settings, 'SENTRY_ZENDESK_CONFIG_CACHE_SIZE', 1000)
+
+
+class ConfigCache(object):
+    """
+    Snapshots of the plugin configuration by project id.
+
+    Snapshots are dropped when the configuration is saved by this process,
+    while other processes see the change once theirs expire.
+    """
+
+    def __init__(self):
+        self._cache = LRUCache(get_config_cache_size, get_config_cache_ttl)
+
+    def get(self, plugin, project):
+        config = self._cache.get(project.id)
+        if config is None:
+            config = PluginConfig.load(plugin, project)
+            self._cache.set(project.id, config)
+        return config
+
+    def delete(self, project_id):
+        self._cache.delete(project_id)
+
+    def clear(self):
+        self._cache.clear()
+
+
+configs = ConfigCache()
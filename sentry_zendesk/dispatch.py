@@ -0,0 +1,154 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+import os
+import threading
+from collections import namedtuple
+from Queue import Full, Queue
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from sentry_zendesk import logger, metrics
+
+
+DROP = 'drop'
+BLOCK = 'block'
+SPILL = 'spill'
+OVERFLOW_POLICIES = (DROP, BLOCK, SPILL)
+
+
+# Just enough to reload everything needed to create the ticket, so queued
+# items stay small and don't hold models
+WorkItem = namedtuple(
+    'WorkItem',
+    ['group_id', 'event_id', 'ticket_type', 'problem_id', 'skipped'])
+
+
+def get_workers():
+    """
+    Number of threads creating tickets in background. Zero keeps tickets
+    being created by the Sentry worker itself, inside `post_process`.
+    """
+    return getattr(settings, 'SENTRY_ZENDESK_DISPATCH_WORKERS', 0)
+
+
+def get_queue_size():
+    return getattr(settings, 'SENTRY_ZENDESK_DISPATCH_QUEUE_SIZE', 1000)
+
+
+def get_overflow():
+    overflow = getattr(settings, 'SENTRY_ZENDESK_DISPATCH_OVERFLOW', BLOCK)
+    if overflow not in OVERFLOW_POLICIES:
+        raise ValueError('Invalid SENTRY_ZENDESK_DISPATCH_OVERFLOW: {}'
+                         .format(overflow))
+    return overflow
+
+
+def get_block_timeout():
+    return getattr(settings, 'SENTRY_ZENDESK_DISPATCH_BLOCK_TIMEOUT', 5)
+
+
+class Dispatcher(object):
+    """
+    Bounded pool of threads which run the (slow) Zendesk work off the event
+    pipeline.
+
+    When the queue is full, what happens with new work depends on the
+    overflow policy:
+
+    - `drop`: the work is discarded (and counted)
+    - `block`: waits up to the block timeout for room, dropping it after that
+    - `spill`: the work is run right away by the caller
+    """
+
+    def __init__(self, workers=None, queue_size=None, overflow=None,
+                 name='dispatch'):
+        self.name = name
+        self._workers = workers
+        self._queue_size = queue_size
+        self._overflow = overflow
+        self._lock = threading.Lock()
+        self._queue = None
+        self._threads = []
+        self._pid = None
+        self.submitted = 0
+        self.dropped = 0
+        self.spilled = 0
+
+    @property
+    def workers(self):
+        return self._workers if self._workers is not None else get_workers()
+
+    @property
+    def queue_size(self):
+        if self._queue_size is not None:
+            return self._queue_size
+        return get_queue_size()
+
+    @property
+    def overflow(self):
+        return self._overflow if self._overflow is not None else get_overflow()
+
+    @property
+    def enabled(self):
+        return self.workers > 0
+
+    def submit(self, handler, item):
+        queue = self._ensure_started()
+        self.submitted += 1
+        try:
+            if self.overflow == BLOCK:
+                queue.put((handler, item), timeout=get_block_timeout())
+            else:
+                queue.put_nowait((handler, item))
+        except Full:
+            if self.overflow == SPILL:
+                self.spilled += 1
+                metrics.incr('dispatch.spilled')
+                logger.warning('Dispatch queue is full, running {} inline'
+                               .format(item))
+                handler(item)
+            else:
+                self.dropped += 1
+                metrics.incr('dispatch.dropped')
+                logger.error('Dispatch queue is full, dropping {}'
+                             .format(item))
+
+    def join(self):
+        """
+        Waits until all the queued work is done.
+        """
+        if self._queue is not None:
+            self._queue.join()
+
+    def _ensure_started(self):
+        # Threads don't survive a fork, so worker processes forked after the
+        # pool was started need their own
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = Queue(maxsize=self.queue_size)
+                    self._threads = []
+                    for i in range(self.workers):
+                        thread = threading.Thread(
+                            target=self._run, args=(self._queue,),
+                            name='sentry-zendesk-{}-{}'.format(self.name, i))
+                        thread.daemon = True
+                        thread.start()
+                        self._threads.append(thread)
+                    self._pid = os.getpid()
+        return self._queue
+
+    def _run(self, queue):
+        while True:
+            handler, item = queue.get()
+            try:
+                handler(item)
+            except Exception:
+                logger.exception('Failed to process {}'.format(item))
+            finally:
+                close_old_connections()
+                queue.task_done()
+
+
+dispatcher = Dispatcher()
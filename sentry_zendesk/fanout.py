@@ -0,0 +1,101 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+import os
+import threading
+from multiprocessing.pool import ThreadPool
+
+
+class ConcurrentClient(object):
+    """
+    Concurrent counterpart of a `ZendeskClient`, to fan out operations
+    touching many tickets instead of running them one after the other.
+
+    It has the same methods (`make_request`, `create_ticket`,
+    `search_tickets`), but they return right away with a pending result
+    (whose `get()` waits for it), while at most `concurrency` requests run at
+    the same time. Requests go through the wrapped client, so they share its
+    keep-alive connections, rate limit and circuit breaker; `concurrency`
+    defaults to its pool size, so no request waits for a connection.
+
+    Callers which don't want to deal with pending results use `gather` or
+    `map`, which block until everything is done::
+
+        with ConcurrentClient(client) as concurrent:
+            ticket_ids = concurrent.map('create_ticket', tickets)
+    """
+
+    def __init__(self, client, concurrency=None):
+        self.client = client
+        self.concurrency = concurrency or client.pool_size
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Runs `fn` concurrently, returning its pending result.
+        """
+        return self._ensure_pool().apply_async(fn, args, kwargs)
+
+    def make_request(self, *args, **kwargs):
+        return self.submit(self.client.make_request, *args, **kwargs)
+
+    def create_ticket(self, *args, **kwargs):
+        return self.submit(self.client.create_ticket, *args, **kwargs)
+
+    def search_tickets(self, *args, **kwargs):
+        return self.submit(self.client.search_tickets, *args, **kwargs)
+
+    def gather(self, pending, return_exceptions=False):
+        """
+        Waits for the given pending results, returning them in the same
+        order. The first error is raised, unless `return_exceptions` is set,
+        in which case errors are returned in place of their results.
+        """
+        results = []
+        for result in pending:
+            try:
+                results.append(result.get())
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                results.append(e)
+        return results
+
+    def map(self, method, calls, return_exceptions=False):
+        """
+        Calls the given client method once for each item of `calls` (a dict
+        of keyword arguments or a tuple of positional ones), returning the
+        results in order.
+        """
+        fn = getattr(self.client, method)
+        pending = [
+            self.submit(fn, **call) if isinstance(call, dict)
+            else self.submit(fn, *call)
+            for call in calls
+        ]
+        return self.gather(pending, return_exceptions)
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None and self._pid == os.getpid():
+                self._pool.close()
+                self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _ensure_pool(self):
+        # Threads don't survive a fork
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._pool = ThreadPool(self.concurrency)
+                    self._pid = os.getpid()
+        if self._pool is None:
+            raise ValueError('ConcurrentClient is closed')
+        return self._pool
@@ -0,0 +1,198 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from sentry_zendesk import logger
+
+
+def is_index_enabled():
+    return getattr(settings, 'SENTRY_ZENDESK_TICKET_INDEX', False)
+
+
+def get_sync_interval():
+    return getattr(settings, 'SENTRY_ZENDESK_INDEX_SYNC_INTERVAL', 60)
+
+
+def get_max_tickets():
+    return getattr(settings, 'SENTRY_ZENDESK_INDEX_MAX_TICKETS', 100000)
+
+
+def trigrams(text):
+    return set(text[i:i + 3] for i in range(len(text) - 2))
+
+
+class TicketIndex(object):
+    """
+    In memory index of the tickets of a Zendesk instance, answering subject
+    prefix/substring searches through a trigram map.
+
+    It is kept up to date through Zendesk's incremental ticket export, and
+    only answers searches once the export has been read up to its end
+    (`warm`). At most `max_tickets` are kept: once a ticket has to be
+    dropped, the index no longer holds every ticket (`complete`) and stops
+    being synced, since searches must go to Zendesk from then on.
+    """
+
+    def __init__(self, max_tickets=None):
+        self.max_tickets = max_tickets or get_max_tickets()
+        self.cursor = None
+        self.warm = False
+        self.complete = True
+        self.last_sync = None
+        # id -> (subject, type, status), ordered by last update
+        self._tickets = OrderedDict()
+        self._trigrams = {}
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._tickets)
+
+    def update(self, tickets):
+        with self._lock:
+            for ticket in tickets:
+                ticket_id = ticket['id']
+                self._remove(ticket_id)
+                if ticket.get('status') == 'deleted':
+                    continue
+                subject = ticket.get('subject') or ''
+                self._tickets[ticket_id] = (
+                    subject, ticket.get('type'), ticket.get('status'))
+                for trigram in trigrams(subject.lower()):
+                    self._trigrams.setdefault(trigram, set()).add(ticket_id)
+            if len(self._tickets) > self.max_tickets:
+                self.complete = False
+            while len(self._tickets) > self.max_tickets:
+                self._remove(next(iter(self._tickets)))
+
+    def search(self, query, limit=100):
+        """
+        Tickets whose subject contains `query`, most recently updated first.
+        """
+        query = query.lower()
+        with self._lock:
+            candidates = None
+            for trigram in trigrams(query):
+                ids = self._trigrams.get(trigram, set())
+                candidates = ids if candidates is None else candidates & ids
+                if not candidates:
+                    return []
+
+            results = []
+            for ticket_id in reversed(self._tickets):
+                if candidates is not None and ticket_id not in candidates:
+                    continue
+                subject, ticket_type, status = self._tickets[ticket_id]
+                if query in subject.lower():
+                    results.append({'id': ticket_id, 'subject': subject,
+                                    'type': ticket_type, 'status': status})
+                    if len(results) >= limit:
+                        break
+            return results
+
+    def sync(self, client):
+        """
+        Reads the incremental export from the last cursor up to its end, or
+        until the index turns out to be incomplete, so the initial scan of a
+        large instance is bounded by `max_tickets`.
+        """
+        if not self.complete:
+            return
+        if not self._sync_lock.acquire(False):
+            # Somebody else is already syncing
+            return
+        try:
+            while True:
+                data = client.export_tickets(cursor=self.cursor)
+                self.update(data.get('tickets') or [])
+                self.cursor = data.get('after_cursor') or self.cursor
+                if not self.complete:
+                    logger.warning(
+                        'Ticket index of "{}" is over {} tickets, searches '
+                        'will go to Zendesk'.format(client.zendesk_url,
+                                                    self.max_tickets))
+                    self.clear()
+                    return
+                if data.get('end_of_stream', True):
+                    break
+            if not self.warm:
+                logger.info('Ticket index of "{}" is warm with {} tickets'
+                            .format(client.zendesk_url, len(self)))
+            self.warm = True
+            self.last_sync = time.time()
+        finally:
+            self._sync_lock.release()
+
+    def clear(self):
+        with self._lock:
+            self._tickets.clear()
+            self._trigrams.clear()
+
+    def _remove(self, ticket_id):
+        entry = self._tickets.pop(ticket_id, None)
+        if entry is None:
+            return
+        for trigram in trigrams(entry[0].lower()):
+            ids = self._trigrams.get(trigram)
+            if ids is not None:
+                ids.discard(ticket_id)
+                if not ids:
+                    del self._trigrams[trigram]
+
+
+class IndexRegistry(object):
+    """
+    One `TicketIndex` per Zendesk instance, synced periodically by a
+    background thread.
+    """
+
+    def __init__(self):
+        self._indexes = {}
+        # zendesk_url -> latest client seen, used to sync
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def get(self, client):
+        with self._lock:
+            index = self._indexes.get(client.zendesk_url)
+            if index is None:
+                index = self._indexes[client.zendesk_url] = TicketIndex()
+            self._clients[client.zendesk_url] = client
+            self._ensure_syncing()
+            return index
+
+    def sync_all(self):
+        with self._lock:
+            items = [(self._indexes[url], client)
+                     for url, client in self._clients.items()]
+        for index, client in items:
+            try:
+                index.sync(client)
+            except Exception:
+                logger.exception('Failed to sync ticket index of "{}"'
+                                 .format(client.zendesk_url))
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+            self._clients.clear()
+
+    def _ensure_syncing(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._run, name='sentry-zendesk-index-sync')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self.sync_all()
+            time.sleep(get_sync_interval())
+
+
+indexes = IndexRegistry()
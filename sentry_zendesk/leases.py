@@ -0,0 +1,229 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+import threading
+import time
+from uuid import uuid4
+
+from django.conf import settings
+
+from sentry_zendesk import logger, metrics
+
+
+# Seconds between checks of a worker waiting for the lease holder's result
+POLL_INTERVAL = 0.2
+
+# Deletes or extends a lease only while it still holds the given token, so a
+# holder whose lease expired never frees or keeps the one of its successor
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+EXTEND_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+def get_backend_name():
+    return getattr(settings, 'SENTRY_ZENDESK_LEASE_BACKEND', 'sentry')
+
+
+def get_duration():
+    """
+    Seconds a lease is held at most without being renewed, so a crashed
+    worker doesn't block the others for long. The holder renews it every
+    third of it for as long as it is creating.
+    """
+    return getattr(settings, 'SENTRY_ZENDESK_LEASE_DURATION', 30)
+
+
+def get_max_wait():
+    return getattr(settings, 'SENTRY_ZENDESK_LEASE_MAX_WAIT', 30)
+
+
+class LeaseTimeout(Exception):
+    pass
+
+
+class LocalBackend(object):
+    """
+    Leases shared by the threads of this process.
+    """
+
+    def __init__(self):
+        self._leases = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key, duration):
+        """
+        :return: the token proving ownership of the lease, `None` when it
+            is held by someone else
+        """
+        with self._lock:
+            now = time.time()
+            token, expires = self._leases.get(key, (None, 0))
+            if expires > now:
+                return None
+            token = uuid4().hex
+            self._leases[key] = (token, now + duration)
+            return token
+
+    def extend(self, key, token, duration):
+        with self._lock:
+            if not self._owns(key, token):
+                return False
+            self._leases[key] = (token, time.time() + duration)
+            return True
+
+    def release(self, key, token):
+        with self._lock:
+            if self._owns(key, token):
+                del self._leases[key]
+
+    def _owns(self, key, token):
+        held, expires = self._leases.get(key, (None, 0))
+        return held == token and expires > time.time()
+
+
+class SentryBackend(object):
+    """
+    Leases in Sentry's Redis, shared by all the processes using it. Each
+    lease holds the token of its holder, unlike Sentry's locks which are
+    owned by the whole process.
+    """
+
+    def __init__(self):
+        from sentry.utils.redis import clusters
+        self.cluster = clusters.get('default')
+
+    def acquire(self, key, duration):
+        token = uuid4().hex
+        client = self.cluster.get_local_client_for_key(key)
+        if client.set(key, token, px=int(duration * 1000), nx=True):
+            return token
+        return None
+
+    def extend(self, key, token, duration):
+        client = self.cluster.get_local_client_for_key(key)
+        return bool(client.eval(
+            EXTEND_SCRIPT, 1, key, token, int(duration * 1000)))
+
+    def release(self, key, token):
+        client = self.cluster.get_local_client_for_key(key)
+        client.eval(RELEASE_SCRIPT, 1, key, token)
+
+
+BACKENDS = {
+    'local': LocalBackend,
+    'sentry': SentryBackend,
+}
+
+
+class Renewal(object):
+    """
+    Background thread extending a lease every third of its duration until
+    stopped, so it outlasts whatever its holder does (e.g. a ticket creation
+    waiting for the rate limiter and retrying).
+    """
+
+    def __init__(self, backend, key, token, duration):
+        self.backend = backend
+        self.key = key
+        self.token = token
+        self.duration = duration
+        self._stopped = threading.Event()
+
+    def __enter__(self):
+        thread = threading.Thread(target=self._run,
+                                  name='sentry-zendesk-lease-renewal')
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.wait(self.duration / 3.0):
+            try:
+                extended = self.backend.extend(
+                    self.key, self.token, self.duration)
+            except Exception:
+                logger.exception('Failed to extend the lease of "{}"'.format(
+                    self.key))
+                continue
+            if not extended:
+                logger.warning('Lost the lease of "{}"'.format(self.key))
+                metrics.incr('lease.lost')
+                return
+
+
+class LeaseManager(object):
+    """
+    Short lived, expiring leases making sure only one worker at a time does
+    something (e.g. creating the problem of a group), while the others wait
+    for its result instead of doing it again.
+    """
+
+    def __init__(self, backend=None):
+        self._backend_name = backend
+        self._backends = {}
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self):
+        name = self._backend_name or get_backend_name()
+        with self._lock:
+            if name not in self._backends:
+                self._backends[name] = BACKENDS[name]()
+            return self._backends[name]
+
+    def run_once(self, key, lookup, create, max_wait=None):
+        """
+        Calls `create` holding the lease of `key` (renewed until it returns),
+        unless `lookup` finds its result already. Without the lease, waits
+        for its holder, polling `lookup` until it finds a result or the lease
+        is free again (e.g. the holder failed), in which case it takes over.
+
+        :raise LeaseTimeout: when no result shows up in `max_wait` seconds
+        """
+        if max_wait is None:
+            max_wait = get_max_wait()
+        key = 'sentry_zendesk:lease:{}'.format(key)
+        deadline = time.time() + max_wait
+        backend = self.backend
+        waited = False
+        while True:
+            duration = get_duration()
+            token = backend.acquire(key, duration)
+            if token is not None:
+                try:
+                    # The previous holder may have finished meanwhile
+                    result = lookup()
+                    if result is None:
+                        with Renewal(backend, key, token, duration):
+                            return create()
+                finally:
+                    backend.release(key, token)
+            else:
+                result = lookup()
+            if result is not None:
+                metrics.incr('lease.reused')
+                return result
+
+            if not waited:
+                logger.info('Waiting for the holder of "{}"'.format(key))
+                metrics.incr('lease.waited')
+                waited = True
+            if time.time() >= deadline:
+                metrics.incr('lease.timeout')
+                raise LeaseTimeout(
+                    'Timed out waiting for the holder of "{}"'.format(key))
+            time.sleep(POLL_INTERVAL)
+
+
+leases = LeaseManager()
@@ -0,0 +1,173 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+from collections import defaultdict
+
+from django.db import IntegrityError, router, transaction
+from sentry.models import Group, GroupMeta
+
+from sentry_zendesk import logger
+from sentry_zendesk.caching import links
+from sentry_zendesk.models import TicketLink
+
+
+class LinkStore(object):
+    """
+    Ticket linked to each group.
+
+    Links are kept in `GroupMeta` (under `key`), where Sentry itself reads
+    them, indexed by ticket in `TicketLink` and cached by each process in
+    `links`. Every operation works on many groups at once, with a fixed
+    number of queries regardless of how many groups are given.
+    """
+
+    MISSING = links.MISSING
+
+    def __init__(self, key):
+        self.key = key
+
+    def get_cached(self, group_id):
+        """
+        The cached ticket of the group, or `MISSING` if it isn't cached.
+        """
+        return links.get(group_id)
+
+    def get(self, group_id):
+        return self.get_many([group_id])[group_id]
+
+    def get_many(self, group_ids):
+        """
+        Ticket linked to each of the given groups (`None` for the ones
+        without a link), loading the ones not cached with a single query.
+        """
+        linked = {}
+        missing = []
+        for group_id in group_ids:
+            ticket_id = links.get(group_id)
+            if ticket_id is links.MISSING:
+                missing.append(group_id)
+            else:
+                linked[group_id] = ticket_id
+        if missing:
+            linked.update(self.load_many(missing))
+        return linked
+
+    def load_many(self, group_ids):
+        """
+        Like `get_many`, but always reading the links from the database.
+        """
+        loaded = dict.fromkeys(group_ids)
+        loaded.update(GroupMeta.objects.filter(
+            group__in=list(group_ids), key=self.key,
+        ).values_list('group_id', 'value'))
+        links.set_many(loaded)
+        return loaded
+
+    def set(self, project_id, group_id, ticket_id):
+        self.set_many(project_id, {group_id: ticket_id})
+
+    def set_many(self, project_id, ticket_ids, overwrite=True):
+        """
+        Links the groups of a project to tickets (group id -> ticket id,
+        `None` to unlink it).
+
+        :param overwrite: whether groups already linked get the new ticket,
+            including the ones linked concurrently
+        :return: the links which were written
+        """
+        ticket_ids = dict(
+            (group_id, None if ticket_id is None else unicode(ticket_id))
+            for group_id, ticket_id in ticket_ids.items())
+        existing = dict(GroupMeta.objects.filter(
+            group__in=list(ticket_ids), key=self.key,
+        ).values_list('group_id', 'value'))
+        if not overwrite:
+            ticket_ids = dict(
+                (group_id, ticket_id)
+                for group_id, ticket_id in ticket_ids.items()
+                if group_id not in existing)
+        changed = dict(
+            (group_id, ticket_id)
+            for group_id, ticket_id in ticket_ids.items()
+            if existing.get(group_id) != ticket_id)
+
+        if changed:
+            using = router.db_for_write(GroupMeta)
+            with transaction.atomic(using=using):
+                conflicts = self._write(changed, existing, overwrite)
+                for group_id in conflicts:
+                    del changed[group_id]
+                    del ticket_ids[group_id]
+                TicketLink.objects.set_links(project_id, changed)
+            # Concurrent links are already indexed by whoever wrote them
+            links.set_many(conflicts)
+        links.set_many(ticket_ids)
+        return ticket_ids
+
+    def _write(self, changed, existing, overwrite=True):
+        """
+        :return: the links written concurrently which were kept (group id ->
+            ticket id), when not overwriting
+        """
+        if len(changed) == 1 and overwrite:
+            # GroupMeta's own setters also keep the values Sentry cached for
+            # the current request in sync
+            [(group_id, ticket_id)] = changed.items()
+            if ticket_id is None:
+                GroupMeta.objects.unset_value(Group(id=group_id), self.key)
+            else:
+                GroupMeta.objects.set_value(
+                    Group(id=group_id), self.key, ticket_id)
+            return {}
+
+        # Groups which are given the same ticket are updated together
+        updates = defaultdict(list)
+        deleted = []
+        created = []
+        for group_id, ticket_id in changed.items():
+            if ticket_id is None:
+                if group_id in existing:
+                    deleted.append(group_id)
+            elif group_id in existing:
+                updates[ticket_id].append(group_id)
+            else:
+                created.append(GroupMeta(
+                    group_id=group_id, key=self.key, value=ticket_id))
+
+        if deleted:
+            GroupMeta.objects.filter(
+                group__in=deleted, key=self.key).delete()
+        for ticket_id, group_ids in updates.items():
+            GroupMeta.objects.filter(
+                group__in=group_ids, key=self.key).update(value=ticket_id)
+        conflicts = {}
+        if created:
+            try:
+                with transaction.atomic(
+                        using=router.db_for_write(GroupMeta)):
+                    GroupMeta.objects.bulk_create(created)
+            except IntegrityError:
+                # Some were linked meanwhile
+                logger.info('Concurrent links, writing them one by one')
+                for meta in created:
+                    if overwrite:
+                        GroupMeta.objects.create_or_update(
+                            group_id=meta.group_id, key=self.key,
+                            values={'value': meta.value})
+                        continue
+                    current, _ = GroupMeta.objects.get_or_create(
+                        group_id=meta.group_id, key=self.key,
+                        defaults={'value': meta.value})
+                    if current.value != meta.value:
+                        conflicts[meta.group_id] = current.value
+        return conflicts
+
+    def refresh(self, project_id, group_id):
+        """
+        Reindexes the link of a group after it was changed by Sentry itself.
+        """
+        links.delete(group_id)
+        ticket_id = self.load_many([group_id])[group_id]
+        TicketLink.objects.set_links(project_id, {group_id: ticket_id})
+
+    def forget(self, group_id):
+        links.delete(group_id)
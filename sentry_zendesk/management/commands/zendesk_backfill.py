@@ -0,0 +1,59 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+from django.core.management.base import BaseCommand, CommandError, make_option
+
+
+class Command(BaseCommand):
+    help = ('Creates Zendesk problems for the unresolved issues of a project '
+            'which are not linked to a ticket yet')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--project', dest='project',
+                    help='project ID or team-slug/project-slug'),
+        make_option('--chunk-size', dest='chunk_size', type='int',
+                    default=100,
+                    help='issues created by each bulk request (max: 100)'),
+        make_option('--concurrency', dest='concurrency', type='int',
+                    default=4, help='bulk requests sent at the same time'),
+        make_option('--rate-limit', dest='rate_limit', type='int',
+                    help='requests per minute sent to Zendesk (default: the '
+                         'rate limit of the project)'),
+        make_option('--restart', dest='restart', action='store_true',
+                    default=False,
+                    help='ignore the checkpoint of a previous run'),
+    )
+
+    def handle(self, **options):
+        from sentry.models import Project
+        from sentry_zendesk.backfill import Backfill
+        from sentry_zendesk.plugin import ZendeskPlugin
+
+        if not options['project']:
+            raise CommandError('A project must be given with --project')
+        if options['project'].isdigit():
+            project = Project.objects.get(id=options['project'])
+        elif '/' in options['project']:
+            t_slug, p_slug = options['project'].split('/', 1)
+            project = Project.objects.get(slug=p_slug, team__slug=t_slug)
+        else:
+            raise CommandError('Project must be specified as '
+                               'team-slug/project-slug or a project id')
+
+        plugin = ZendeskPlugin()
+        if not plugin.is_configured(None, project):
+            raise CommandError('Zendesk is not configured for the project')
+
+        backfill = Backfill(
+            plugin, project,
+            chunk_size=options['chunk_size'],
+            concurrency=options['concurrency'],
+            rate_limit=options['rate_limit'],
+            stdout=self.stdout,
+        )
+        if options['restart']:
+            backfill.reset()
+        created, failed, skipped = backfill.run()
+        self.stdout.write('Created {} problems, {} failed, {} issues were '
+                          'already linked'.format(created, failed, skipped))
+        if failed:
+            raise CommandError('Run again to retry the failed issues')
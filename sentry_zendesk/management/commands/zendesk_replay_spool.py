@@ -0,0 +1,20 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = ('Creates the tickets spooled while Zendesk was unavailable, which '
+            'is otherwise done in background by the Sentry workers')
+
+    def handle(self, **options):
+        from sentry_zendesk.client import is_transient_error
+        from sentry_zendesk.plugin import ZendeskPlugin
+        from sentry_zendesk.spool import spool
+
+        if not spool.enabled:
+            raise CommandError('SENTRY_ZENDESK_SPOOL_DIR is not set')
+        replayed = spool.replay(ZendeskPlugin()._replay_spooled_ticket,
+                                is_transient_error)
+        self.stdout.write('Replayed {} tickets, {} segments left'.format(
+            replayed, len(spool.segments())))
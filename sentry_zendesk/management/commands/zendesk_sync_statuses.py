@@ -0,0 +1,13 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = ('Resolves and reopens the issues linked to the Zendesk tickets '
+            'changed since the last sync, for every project with the status '
+            'sync enabled')
+
+    def handle(self, **options):
+        from sentry_zendesk.sync import sync_all_statuses
+        sync_all_statuses()
@@ -0,0 +1,111 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+import re
+import time
+from contextlib import contextmanager
+
+from six.moves.urllib.parse import urlparse
+
+
+PREFIX = 'sentry_zendesk.'
+
+
+class SentrySink(object):
+    """
+    Publishes metrics through Sentry's metrics backend.
+    """
+
+    def incr(self, key, amount, tags):
+        from sentry.utils import metrics
+        metrics.incr(key, amount=amount, tags=tags)
+
+    def timing(self, key, value, tags):
+        from sentry.utils import metrics
+        metrics.timing(key, value, tags=tags)
+
+
+class MemorySink(object):
+    """
+    Keeps metrics in memory, mostly to check them on tests.
+    """
+
+    def __init__(self):
+        self.counters = []
+        self.timings = []
+
+    def incr(self, key, amount, tags):
+        self.counters.append((key, amount, tags))
+
+    def timing(self, key, value, tags):
+        self.timings.append((key, value, tags))
+
+    def count(self, key, **tags):
+        return sum(amount for k, amount, t in self.counters
+                   if k == key and _matches(t, tags))
+
+    def timed(self, key, **tags):
+        return [value for k, value, t in self.timings
+                if k == key and _matches(t, tags)]
+
+
+def _matches(tags, expected):
+    return all(tags.get(k) == v for k, v in expected.items())
+
+
+sink = SentrySink()
+
+
+def set_sink(new_sink):
+    global sink
+    old_sink, sink = sink, new_sink
+    return old_sink
+
+
+@contextmanager
+def capture():
+    """
+    Sends metrics to a `MemorySink` while inside the block.
+    """
+    memory = MemorySink()
+    old_sink = set_sink(memory)
+    try:
+        yield memory
+    finally:
+        set_sink(old_sink)
+
+
+def incr(key, amount=1, **tags):
+    sink.incr(PREFIX + key, amount, tags)
+
+
+def timing(key, value, **tags):
+    sink.timing(PREFIX + key, value, tags)
+
+
+@contextmanager
+def timer(key, **tags):
+    """
+    Times the block, tagging it with `result` (success or failure). Tags can
+    be added inside the block to the yielded dict.
+    """
+    start = time.time()
+    try:
+        yield tags
+    except Exception:
+        tags['result'] = 'failure'
+        raise
+    else:
+        tags.setdefault('result', 'success')
+    finally:
+        timing(key, time.time() - start, **tags)
+
+
+_id_re = re.compile(r'/[^/]*\d[^/]*(?=\.json$)')
+
+
+def endpoint(url):
+    """
+    Path of a Zendesk URL without ids, so requests to the same endpoint are
+    grouped together (e.g. `/api/v2/job_statuses/{id}.json`).
+    """
+    return _id_re.sub('/{id}', urlparse(url).path)
@@ -0,0 +1,86 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+from django.db import models
+from sentry.db.models import (
+    BaseManager, FlexibleForeignKey, Model, sane_repr,
+)
+
+
+class TicketLinkManager(BaseManager):
+
+    def get_group_ids(self, project_id, ticket_ids):
+        """
+        Ids of the groups linked to each of the given tickets of a project
+        (ticket id -> list of group ids).
+        """
+        group_ids = {}
+        for ticket_id, group_id in self.filter(
+                project_id=project_id,
+                ticket_id__in=[unicode(t) for t in ticket_ids],
+        ).values_list('ticket_id', 'group_id'):
+            group_ids.setdefault(ticket_id, []).append(group_id)
+        return group_ids
+
+    def get_links(self, project_id, ticket_ids):
+        """
+        Groups linked to each of the given tickets of a project, along with
+        the last status of the ticket seen by the plugin (ticket id -> list
+        of `(group id, status)`).
+        """
+        links = {}
+        for ticket_id, group_id, ticket_status in self.filter(
+                project_id=project_id,
+                ticket_id__in=[unicode(t) for t in ticket_ids],
+        ).values_list('ticket_id', 'group_id', 'ticket_status'):
+            links.setdefault(ticket_id, []).append((group_id, ticket_status))
+        return links
+
+    def set_statuses(self, project_id, ticket_ids):
+        """
+        Records the last status of tickets (status -> list of ticket ids),
+        with one update for each status.
+        """
+        for ticket_status, status_ticket_ids in ticket_ids.items():
+            self.filter(
+                project_id=project_id,
+                ticket_id__in=[unicode(t) for t in status_ticket_ids],
+            ).update(ticket_status=ticket_status)
+
+    def set_links(self, project_id, ticket_ids):
+        """
+        Indexes the tickets linked to the given groups (group id -> ticket
+        id, `None` to drop its link).
+        """
+        self.filter(group_id__in=list(ticket_ids)).delete()
+        self.bulk_create([
+            TicketLink(project_id=project_id, group_id=group_id,
+                       ticket_id=unicode(ticket_id))
+            for group_id, ticket_id in ticket_ids.items()
+            if ticket_id is not None
+        ])
+
+
+class TicketLink(Model):
+    """
+    Index of the groups linked to each ticket, to find them when Zendesk
+    reports a change of the ticket. The links themselves are kept in
+    `GroupMeta`, which can't be queried by ticket.
+
+    The last status Zendesk reported for the ticket is kept too, so groups
+    are only reopened when their ticket is.
+    """
+    __core__ = False
+
+    project = FlexibleForeignKey('sentry.Project')
+    group = FlexibleForeignKey('sentry.Group', unique=True)
+    ticket_id = models.CharField(max_length=64)
+    ticket_status = models.CharField(max_length=16, null=True)
+
+    objects = TicketLinkManager()
+
+    class Meta:
+        app_label = 'sentry_zendesk'
+        db_table = 'sentry_zendesk_ticketlink'
+        index_together = (('project', 'ticket_id'),)
+
+    __repr__ = sane_repr('project_id', 'group_id', 'ticket_id')
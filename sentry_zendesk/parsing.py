@@ -0,0 +1,145 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+# Only ijson's C backends parse faster than decoding the whole document, its
+# default pure Python one is many times slower
+try:
+    from ijson.backends import yajl2_c as ijson
+except ImportError:  # pragma: no cover
+    try:
+        from ijson.backends import yajl2_cffi as ijson
+    except ImportError:
+        ijson = None
+
+
+SCALAR_EVENTS = ('null', 'boolean', 'number', 'string')
+CHUNK_SIZE = 16 * 1024
+
+
+def project(response, fields=(), items=None, on_read=None):
+    """
+    Reads only the given parts of a JSON response.
+
+    :param fields: dotted paths of scalar values, e.g. `'ticket.id'`
+    :param items: optional `(path, item_fields)`, reading the list at `path`
+        keeping only the scalar `item_fields` of each of its objects, e.g.
+        `('results', ['id', 'subject'])`
+    :return: dict with the value of each of `fields` (`None` when missing)
+        and, if `items` is given, the list of projected objects under its
+        path.
+    :param on_read: optional callable, called with the number of (decoded)
+        bytes of the body once it was read, before the response is closed
+
+    When `ijson` is installed along with YAJL, the body is parsed
+    incrementally by its C backend, without building the whole document,
+    and parsing stops as soon as everything asked for was found. Otherwise
+    the body is fully decoded and projected afterwards. Either way the whole
+    body is read, so the connection goes back to the pool instead of being
+    dropped.
+    """
+    read = [0]
+    try:
+        if ijson is None:
+            document = response.json()
+            read[0] = len(response.content)
+            return _project_document(document, fields, items)
+        chunks = _count(response.iter_content(CHUNK_SIZE), read)
+        try:
+            return _project_stream(
+                ijson.parse(ChunksReader(chunks)), fields, items)
+        finally:
+            drain(chunks)
+    finally:
+        try:
+            if on_read is not None:
+                on_read(read[0])
+        finally:
+            response.close()
+
+
+def _count(chunks, read):
+    for chunk in chunks:
+        read[0] += len(chunk)
+        yield chunk
+
+
+def drain(chunks):
+    """
+    Reads whatever is left of a streamed body.
+    """
+    try:
+        for _ in chunks:
+            pass
+    except Exception:
+        # The connection is dropped when the response is closed anyway
+        pass
+
+
+class ChunksReader(object):
+    """
+    File-like object reading from an iterator of byte chunks.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._buffer = b''
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += next(self._chunks)
+            except StopIteration:
+                break
+        if size < 0:
+            data, self._buffer = self._buffer, b''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def _project_stream(events, fields, items):
+    result = dict.fromkeys(fields)
+    pending = set(fields)
+    if items is not None:
+        items_path, item_fields = items
+        item_prefix = items_path + '.item'
+        item_field_prefixes = dict(
+            (item_prefix + '.' + field, field) for field in item_fields)
+        result[items_path] = []
+        current = None
+
+    for prefix, event, value in events:
+        if prefix in pending and event in SCALAR_EVENTS:
+            result[prefix] = value
+            pending.discard(prefix)
+            if not pending and items is None:
+                break
+        elif items is not None:
+            if prefix == item_prefix:
+                if event == 'start_map':
+                    current = dict.fromkeys(item_fields)
+                elif event == 'end_map':
+                    result[items_path].append(current)
+                    current = None
+            elif (current is not None and event in SCALAR_EVENTS and
+                    prefix in item_field_prefixes):
+                current[item_field_prefixes[prefix]] = value
+    return result
+
+
+def get_path(document, path):
+    for key in path.split('.'):
+        if not isinstance(document, dict):
+            return None
+        document = document.get(key)
+    return document
+
+
+def _project_document(document, fields, items):
+    result = dict((field, get_path(document, field)) for field in fields)
+    if items is not None:
+        items_path, item_fields = items
+        result[items_path] = [
+            dict((field, item.get(field)) for field in item_fields)
+            for item in get_path(document, items_path) or []
+        ]
+    return result
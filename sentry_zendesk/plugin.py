@@ -3,16 +3,55 @@ from __future__ import absolute_import, print_function, unicode_literals
 
 from django.conf.urls import url
 from rest_framework.response import Response
-from sentry.models import GroupMeta
+from sentry.models import Event, Group
+from sentry.exceptions import PluginError
 from sentry.plugins.bases.issue2 import IssuePlugin2, IssueGroupActionEndpoint
 from sentry.utils.http import absolute_uri
 from sentry_plugins.utils import get_secret_field_config
 
-from sentry_zendesk import logger
+from sentry_zendesk import logger, metrics
 
 from . import VERSION
 
 
+def validate_positive_integer(value, **kwargs):
+    if value in (None, ''):
+        return None
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise PluginError('Must be a number')
+    if value <= 0:
+        raise PluginError('Must be greater than zero')
+    return value
+
+
+TEMPLATE_OPTIONS = ('subject_template', 'comment_template', 'ticket_tags',
+                    'ticket_priority', 'custom_fields')
+
+
+def validate_template(value, **kwargs):
+    from sentry_zendesk.templates import Template
+
+    if value:
+        Template(value)
+    return value or None
+
+
+def validate_tags(value, **kwargs):
+    from sentry_zendesk.templates import TicketTemplates
+
+    TicketTemplates.compile(tags=value)
+    return value or None
+
+
+def validate_custom_fields(value, **kwargs):
+    from sentry_zendesk.templates import parse_custom_fields
+
+    parse_custom_fields(value)
+    return value or None
+
+
 class ZendeskPlugin(IssuePlugin2):
     title = 'Zendesk'
     slug = 'sentry_zendesk'
@@ -44,6 +83,14 @@ class ZendeskPlugin(IssuePlugin2):
         )
         return _patterns
 
+    def get_url_module(self):
+        # Zendesk can't authenticate to Sentry's API, so the webhook is a
+        # public URL checking the signature of the requests by itself
+        return 'sentry_zendesk.urls'
+
+    def get_webhook_path(self, project):
+        return '/plugins/{}/projects/{}/webhook/'.format(self.slug, project.id)
+
     def is_configured(self, request, project, **kwargs):
         """
         Used by sentry to know if this plugin hooks should be executed.
@@ -51,7 +98,7 @@ class ZendeskPlugin(IssuePlugin2):
         disabled.
         """
 
-        if not self.get_option('zendesk_url', project):
+        if not self.get_project_config(project).zendesk_url:
             return False
         return True
 
@@ -59,13 +106,27 @@ class ZendeskPlugin(IssuePlugin2):
         """
         Called by the web process when user wants to configure the plugin.
         """
+        from sentry_zendesk.templates import (
+            DEFAULT_COMMENT, DEFAULT_SUBJECT, FIELDS, PRIORITIES)
+
         project = kwargs['project']
+        template_fields = ', '.join('{%s}' % field for field in FIELDS)
         pw = self.get_option('password', project)
         secret_field = get_secret_field_config(pw, '')
         secret_field.update({
             'name': 'password',
             'label': 'Password'
         })
+        webhook_field = get_secret_field_config(
+            self.get_option('webhook_secret', project),
+            'Signing secret of a Zendesk webhook sending ticket changes to '
+            '{}, to resolve and reopen the linked issues.'.format(
+                absolute_uri(self.get_webhook_path(project))),
+            required=False)
+        webhook_field.update({
+            'name': 'webhook_secret',
+            'label': 'Webhook signing secret',
+        })
 
         return [{
             'name': 'zendesk_url',
@@ -97,17 +158,146 @@ class ZendeskPlugin(IssuePlugin2):
             'required': False,
             'help': 'Automatically create a Zendesk ticket of type incident ' \
                     'for EVERY event after the first one, linking it to the ' \
-                    'previously created problem.'
+                    'previously created problem, unless limited by the ' \
+                    'options below.'
+        }, {
+            'name': 'comment_on_events',
+            'label': 'Comment events on the linked ticket',
+            'default': self.get_option('comment_on_events', project) or False,
+            'type': 'bool',
+            'required': False,
+            'help': 'Add a comment to the linked ticket for every event '
+                    'after the first one. Comments of events arriving close '
+                    'together are merged.'
+        }, {
+            'name': 'rate_limit',
+            'label': 'Rate limit',
+            'default': self.get_option('rate_limit', project),
+            'type': 'number',
+            'required': False,
+            'validators': [validate_positive_integer],
+            'help': 'Maximum number of requests per minute sent to Zendesk. '
+                    'It is shared by every project using the same Zendesk '
+                    'instance, which uses the lowest rate configured among '
+                    'the ones which used it in the last 5 minutes. Leave '
+                    'blank to use the server default.'
+        }, {
+            'name': 'incident_limit',
+            'label': 'Maximum incidents per issue',
+            'default': self.get_option('incident_limit', project),
+            'type': 'number',
+            'required': False,
+            'validators': [validate_positive_integer],
+            'help': 'Maximum number of incidents automatically created for '
+                    'an issue within the incident window. Leave blank for no '
+                    'limit.'
+        }, {
+            'name': 'incident_window',
+            'label': 'Incident window',
+            'default': self.get_option('incident_window', project),
+            'type': 'number',
+            'required': False,
+            'validators': [validate_positive_integer],
+            'help': 'Seconds the maximum incidents per issue applies to '
+                    '(default: 3600).'
+        }, {
+            'name': 'incident_every',
+            'label': 'Create an incident every N events',
+            'default': self.get_option('incident_every', project),
+            'type': 'number',
+            'required': False,
+            'validators': [validate_positive_integer],
+            'help': 'Only create an incident for one out of every N events '
+                    'of an issue. Leave blank to consider every event.'
+        }, {
+            'name': 'incident_sampled_only',
+            'label': 'Only create incidents for stored events',
+            'default': self.get_option('incident_sampled_only', project) or False,  # noqa
+            'type': 'bool',
+            'required': False,
+            'help': 'Ignore the events Sentry samples out (and so does not '
+                    'store) when creating incidents. Skipped events are '
+                    'counted on the comment of the next incident.'
+        }, webhook_field, {
+            'name': 'sync_ticket_status',
+            'label': 'Sync ticket status periodically',
+            'default': self.get_option('sync_ticket_status', project) or False,  # noqa
+            'type': 'bool',
+            'required': False,
+            'help': 'Resolve and reopen the linked issues by periodically '
+                    'reading the tickets changed in Zendesk, where a webhook '
+                    'is not possible.'
+        }, {
+            'name': 'subject_template',
+            'label': 'Ticket subject',
+            'default': self.get_option('subject_template', project),
+            'type': 'text',
+            'required': False,
+            'placeholder': DEFAULT_SUBJECT,
+            'validators': [validate_template],
+            'help': 'Subject of the created tickets. It can use ' +
+                    template_fields + '.'
+        }, {
+            'name': 'comment_template',
+            'label': 'Ticket comment',
+            'default': self.get_option('comment_template', project),
+            'type': 'textarea',
+            'required': False,
+            'placeholder': DEFAULT_COMMENT,
+            'validators': [validate_template],
+            'help': 'First comment of the created tickets, using the same '
+                    'fields as the subject.'
+        }, {
+            'name': 'ticket_tags',
+            'label': 'Ticket tags',
+            'default': self.get_option('ticket_tags', project),
+            'type': 'text',
+            'required': False,
+            'placeholder': 'e.g. "sentry {project}"',
+            'validators': [validate_tags],
+            'help': 'Tags of the created tickets, separated by spaces or '
+                    'commas, using the same fields as the subject.'
+        }, {
+            'name': 'ticket_priority',
+            'label': 'Ticket priority',
+            'default': self.get_option('ticket_priority', project) or '',
+            'type': 'select',
+            'choices': [('', 'Default')] + [
+                (priority, priority.capitalize()) for priority in PRIORITIES],
+            'required': False,
+        }, {
+            'name': 'custom_fields',
+            'label': 'Ticket custom fields',
+            'default': self.get_option('custom_fields', project),
+            'type': 'textarea',
+            'required': False,
+            'placeholder': 'e.g. "360001234567: {short_id}"',
+            'validators': [validate_custom_fields],
+            'help': 'Custom fields of the created tickets, one '
+                    '"<field id>: <value>" per line, using the same fields '
+                    'as the subject.'
         }]
 
     def post_process(self, group, event, is_new, is_sample, **kwargs):
         """
         Called by the worker process whenever a new event arrives.
         """
+        from sentry_zendesk.client import is_transient_error
+        from sentry_zendesk.spool import replayer
+
+        # Tickets spooled before a restart are replayed too
+        if replayer.spool.enabled:
+            replayer.start(self._replay_spooled_ticket, is_transient_error)
+        with metrics.timer('post_process', project=group.project_id,
+                           is_new=is_new):
+            self._post_process(group, event, is_new, is_sample)
+
+    def _post_process(self, group, event, is_new, is_sample):
         logger.info('event: {}, is_new: {}'.format(event, is_new))
 
+        config = self.get_project_config(group.project)
         if is_new:
-            if not self.get_option('auto_create_problems', group.project):
+            if not config.auto_create_problems:
                 return
             logger.info('New problem')
             problem_id = self._get_linked_ticket(group)
@@ -116,11 +306,8 @@ class ZendeskPlugin(IssuePlugin2):
                 return
 
             logger.info('Creating new problem')
-            ticket_id = self._create_ticket(
-                group, event, ticket_type='problem')
-            GroupMeta.objects.set_value(
-                group, '%s:tid' % self.get_conf_key(), ticket_id)
-        elif self.get_option('auto_create_incidents', group.project):
+            self._dispatch(group, event, ticket_type='problem')
+        elif config.auto_create_incidents or config.comment_on_events:
             problem_id = self._get_linked_ticket(group)
             if not problem_id:
                 logger.info(
@@ -128,28 +315,235 @@ class ZendeskPlugin(IssuePlugin2):
                 )
                 return
 
+            if config.comment_on_events:
+                self._add_comment(
+                    group, problem_id, self._build_event_comment(group, event))
+            if not config.auto_create_incidents:
+                return
+
+            from sentry_zendesk.throttling import throttle
+            skipped = throttle.check(config, group.id, is_sample)
+            if skipped is None:
+                logger.info('Skipping incident of throttled issue')
+                return
+
             logger.info(
                 'Creating new incident linked to problem "{}"'
                 .format(problem_id))
-            self._create_ticket(
-                group, event, ticket_type='incident', problem_id=problem_id)
+            self._dispatch(
+                group, event, ticket_type='incident', problem_id=problem_id,
+                skipped=skipped)
+
+    def _dispatch(self, group, event, ticket_type, problem_id=None,
+                  skipped=0):
+        """
+        Creates the ticket right away, or hands it to the background pool
+        when it is enabled, so Zendesk latency doesn't stall the worker.
+        """
+        from sentry_zendesk.dispatch import WorkItem, dispatcher
+
+        if not dispatcher.enabled:
+            return self._process_ticket(
+                group, event, ticket_type, problem_id, skipped)
+        dispatcher.submit(
+            self._process_work_item,
+            WorkItem(group_id=group.id, event_id=event.id,
+                     ticket_type=ticket_type, problem_id=problem_id,
+                     skipped=skipped))
+
+    def _process_work_item(self, item):
+        group = Group.objects.get(id=item.group_id)
+        event = None
+        if item.event_id is not None:
+            event = Event.objects.filter(id=item.event_id).first()
+        if event is None:
+            # Sampled events are not saved, so the ticket is built from the
+            # group alone, as for existing issues
+            event = group
+        else:
+            Event.objects.bind_nodes([event], 'data')
+            event.group = group
+        self._process_ticket(group, event, item.ticket_type, item.problem_id,
+                             item.skipped)
+
+    def _process_ticket(self, group, event, ticket_type, problem_id=None,
+                        skipped=0):
+        if ticket_type == 'problem':
+            return self._create_problem(group, event)
+
+        from sentry_zendesk.batching import incidents
+        if incidents.enabled:
+            incidents.add(
+                self.get_client(group.project),
+                self._build_ticket(
+                    group, event, ticket_type=ticket_type,
+                    problem_id=problem_id, skipped=skipped),
+                project_id=group.project_id, group_id=group.id)
+            return None
+        return self._create_ticket(
+            group, event, ticket_type=ticket_type, problem_id=problem_id,
+            skipped=skipped)
+
+    def _create_problem(self, group, event):
+        """
+        Creates and links the problem of the group, unless another worker is
+        already creating it, in which case its ticket is reused.
+        """
+        from sentry_zendesk.leases import LeaseTimeout, leases
+
+        def create():
+            ticket_id = self._create_ticket(
+                group, event, ticket_type='problem')
+            if ticket_id is not None:
+                self._set_linked_ticket(group, ticket_id)
+            return ticket_id
+
+        try:
+            return leases.run_once(
+                'problem:{}'.format(group.id),
+                lambda: self.link_store.load_many([group.id])[group.id],
+                create)
+        except LeaseTimeout:
+            logger.warning('Gave up creating the problem of group {}, which '
+                           'is still being created'.format(group.id))
+            return None
+
+    @property
+    def link_store(self):
+        from sentry_zendesk.linkstore import LinkStore
+        return LinkStore('%s:tid' % self.get_conf_key())
 
     def _get_linked_ticket(self, group):
-        # XXX(dcramer): Sentry doesn't expect GroupMeta referenced here so we
-        # need to populate the cache
-        GroupMeta.objects.populate_cache([group])
-        problem_id = GroupMeta.objects.get_value(
-            group, '%s:tid' % self.get_conf_key(), None)
+        from sentry_zendesk.singleflight import canonical_key, flights
+
+        store = self.link_store
+        with metrics.timer('get_linked_ticket') as tags:
+            problem_id = store.get_cached(group.id)
+            tags['cache'] = 'miss' if problem_id is store.MISSING else 'hit'
+            metrics.incr('link_cache.' + tags['cache'])
+            if problem_id is store.MISSING:
+                # Events of the same group usually arrive together
+                problem_id = flights.do(
+                    canonical_key('linked-ticket', group.id),
+                    self._load_linked_ticket, group)
         return problem_id
 
-    def _create_ticket(self, group, event, ticket_type, problem_id=None):
-        client = self.get_client(group.project)
-        title = self.get_group_title(None, group, event)
-        comment = '[{0}]({0})'.format(absolute_uri(group.get_absolute_url()))
-        return client.create_ticket(title=title,
-                                    ticket_type=ticket_type,
-                                    problem_id=problem_id,
-                                    comment=comment)
+    def _load_linked_ticket(self, group):
+        return self.link_store.load_many([group.id])[group.id]
+
+    def get_linked_tickets(self, groups):
+        """
+        Ticket linked to each of the given groups (by group id), loading the
+        ones not cached with a single query. Used to prewarm the cache of
+        many groups at once.
+        """
+        return self.link_store.get_many([group.id for group in groups])
+
+    def set_linked_tickets(self, project, ticket_ids):
+        """
+        Links many groups (by group id) of a project to tickets at once.
+        Groups which got linked meanwhile keep their ticket.
+        """
+        written = self.link_store.set_many(
+            project.id, ticket_ids, overwrite=False)
+        if len(written) < len(ticket_ids):
+            logger.warning('Groups {} were already linked'.format(
+                sorted(set(ticket_ids) - set(written))))
+        return written
+
+    def _set_linked_ticket(self, group, ticket_id):
+        self.link_store.set(group.project_id, group.id, ticket_id)
+
+    def _create_ticket(self, group, event, ticket_type, problem_id=None,
+                       skipped=0):
+        """
+        Creates the ticket, or spools it to be created later when Zendesk
+        is unavailable (returning `None`).
+        """
+        from sentry_zendesk.client import is_transient_error, unpack_ticket
+        from sentry_zendesk.spool import spool
+
+        with metrics.timer('create_ticket', ticket_type=ticket_type,
+                           project=group.project_id):
+            client = self.get_client(group.project)
+            ticket = self._build_ticket(
+                group, event, ticket_type, problem_id, skipped)
+            try:
+                return client.create_ticket(**unpack_ticket(ticket))
+            except Exception as e:
+                if not (spool.enabled and is_transient_error(e)):
+                    raise
+                logger.warning('Spooling {} of group {}: {}'.format(
+                    ticket_type, group.id, e))
+                spool.append({
+                    'project_id': group.project_id,
+                    'group_id': group.id,
+                    'ticket': ticket,
+                })
+                return None
+
+    def _replay_spooled_ticket(self, record):
+        """
+        Creates a ticket which was spooled while Zendesk was unavailable,
+        linking spooled problems to their groups (unless they got linked
+        meanwhile).
+        """
+        from sentry.models import Project
+        from sentry_zendesk.client import unpack_ticket
+        from sentry_zendesk.leases import leases
+
+        ticket = record['ticket']
+        try:
+            project = Project.objects.get_from_cache(id=record['project_id'])
+        except Project.DoesNotExist:
+            logger.info('Dropping {} of deleted project {}'.format(
+                ticket['type'], record['project_id']))
+            return
+        client = self.get_client(project)
+
+        def create():
+            ticket_id = client.create_ticket(**unpack_ticket(ticket))
+            if ticket['type'] == 'problem':
+                self.link_store.set(project.id, record['group_id'], ticket_id)
+            return ticket_id
+
+        if ticket['type'] != 'problem':
+            return create()
+        group_id = record['group_id']
+        return leases.run_once(
+            'problem:{}'.format(group_id),
+            lambda: self.link_store.load_many([group_id])[group_id],
+            create)
+
+    def _build_ticket(self, group, event, ticket_type, problem_id=None,
+                      skipped=0):
+        from sentry_zendesk.client import build_ticket
+        from sentry_zendesk.templates import templates
+
+        config = self.get_project_config(group.project)
+        fields = config.templates.render(
+            templates.get_context(self, group, event))
+        if skipped:
+            fields['comment'] += ('\n\n{} events of this issue were skipped '
+                                  'since the previous incident.'
+                                  .format(skipped))
+        return build_ticket(fields.pop('subject'), fields.pop('comment'),
+                            ticket_type, problem_id, **fields)
+
+    def _build_event_comment(self, group, event):
+        from sentry_zendesk.templates import templates
+
+        context = templates.get_context(self, group, event)
+        return 'New event at {:%Y-%m-%d %H:%M:%S} UTC: [{}]({})'.format(
+            event.datetime, context['title'], context['event_url'])
+
+    def _add_comment(self, group, ticket_id, comment):
+        """
+        Comments are buffered, so the ones for the same ticket (e.g. of many
+        events) become a single update.
+        """
+        from sentry_zendesk.comments import comments
+        comments.add(self.get_client(group.project), ticket_id, comment)
 
     def get_link_existing_issue_fields(self, request, group, event, **kwargs):
         """
@@ -176,7 +570,7 @@ class ZendeskPlugin(IssuePlugin2):
         """
         Called by the web process to show a link of the external issue (ticket)
         """
-        instance = self.get_option('zendesk_url', group.project)
+        instance = self.get_project_config(group.project).zendesk_url
         return "%s/tickets/%s" % (instance, issue_id)
 
     def view_autocomplete(self, request, group, **kwargs):
@@ -184,25 +578,80 @@ class ZendeskPlugin(IssuePlugin2):
         Called by the web process when user wants to link sentry issue to an
         existing Zendesk ticket.
         """
-        query = request.GET.get('autocomplete_query')
+        query = request.GET.get('autocomplete_query', '')
         field = request.GET.get('autocomplete_field')
-        client = self.get_client(group.project)
 
-        data = client.search_tickets(query)
-        issues = [{
-            'text': '(%s) %s' % (i['id'], i['subject']),
-            'id': unicode(i['id'])
-        } for i in data.get('results', [])]
+        with metrics.timer('autocomplete', project=group.project_id):
+            issues = [{
+                'text': '(%s) %s' % (i['id'], i['subject']),
+                'id': unicode(i['id'])
+            } for i in self._search_tickets(group.project, query)]
 
         return Response({field: issues})
 
+    def _search_tickets(self, project, query):
+        from sentry_zendesk.caching import searches
+        from sentry_zendesk.index import indexes, is_index_enabled
+
+        if is_index_enabled():
+            index = indexes.get(self.get_client(project))
+            if index.warm and index.complete:
+                metrics.incr('search.index')
+                return index.search(query)
+
+        results = searches.get(project.id, query)
+        metrics.incr('search_cache.' + ('miss' if results is None else 'hit'))
+        if results is None:
+            client = self.get_client(project)
+            data = client.search_tickets(query, fields=['id', 'subject'])
+            results = data['results']
+            searches.set(project.id, query, results,
+                         complete=not data.get('next_page'))
+        return results
+
     def get_client(self, project):
-        from sentry_zendesk.client import ZendeskClient
+        from sentry_zendesk.client import get_client
+
+        config = self.get_project_config(project)
+        return get_client(config.zendesk_url, config.username, config.password,
+                          rate_limit=config.rate_limit)
+
+    def get_project_config(self, project):
+        """
+        Snapshot of the plugin options of the project, so hot paths don't
+        look up options one by one.
+        """
+        from sentry_zendesk.config import configs
+        return configs.get(self, project)
+
+    def set_option(self, key, value, project=None, user=None):
+        super(ZendeskPlugin, self).set_option(key, value, project, user)
+        self._drop_project_config(project)
+        if key in TEMPLATE_OPTIONS and project is not None:
+            # Compiled right away, instead of by the first event
+            self.get_project_config(project).templates
+
+    def unset_option(self, key, project=None, user=None):
+        super(ZendeskPlugin, self).unset_option(key, project, user)
+        self._drop_project_config(project)
 
-        url = self.get_option('zendesk_url', project)
-        username = self.get_option('username', project)
-        password = self.get_option('password', project)
-        return ZendeskClient(url, username, password)
+    def set_state(self, key, value, project):
+        """
+        Saves progress (e.g. a sync cursor) as a plugin option. It isn't
+        part of the configuration, so the cached one is kept.
+        """
+        super(ZendeskPlugin, self).set_option(key, value, project)
+
+    def unset_state(self, key, project):
+        super(ZendeskPlugin, self).unset_option(key, project)
+
+    def _drop_project_config(self, project):
+        from sentry_zendesk.config import configs
+
+        if project is None:
+            configs.clear()
+        else:
+            configs.delete(project.id)
 
     def create_issue(self, request, group, form_data, **kwargs):
         """
@@ -211,11 +660,33 @@ class ZendeskPlugin(IssuePlugin2):
         """
         raise NotImplementedError('This feature is not implemented yet')
 
+    def view_link(self, request, group, **kwargs):
+        try:
+            response = super(ZendeskPlugin, self).view_link(
+                request, group, **kwargs)
+        finally:
+            self.link_store.forget(group.id)
+        if request.method == 'POST':
+            self.link_store.refresh(group.project_id, group.id)
+        return response
+
+    def view_unlink(self, request, group, **kwargs):
+        try:
+            response = super(ZendeskPlugin, self).view_unlink(
+                request, group, **kwargs)
+        finally:
+            self.link_store.forget(group.id)
+        if request.method == 'POST':
+            self.link_store.refresh(group.project_id, group.id)
+        return response
+
     def link_issue(self, request, group, form_data, **kwargs):
         """
         Called by the web process to link to an existing Zendesk ticket
         """
-        # TODO: Add comment to Zendesk ticket with sentry url
+        comment = form_data.get('comment')
+        if comment:
+            self._add_comment(group, form_data['issue_id'], comment)
         return {
             'title': form_data['issue_id']
         }
@@ -0,0 +1,230 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+import threading
+import time
+
+from django.conf import settings
+from sentry_plugins.exceptions import ApiError
+
+from sentry_zendesk import logger, metrics
+
+
+HIGH = 'high'
+LOW = 'low'
+
+# Fraction of the budget low priority requests (e.g. autocomplete) can't use,
+# so ticket creation still goes through when the budget is almost exhausted
+LOW_PRIORITY_RESERVE = 0.2
+# Seconds a configured rate applies after a project last used it, so
+# raising or clearing the rate of a project takes effect
+CONFIGURED_RATE_TTL = 300
+
+
+def get_default_rate():
+    """
+    Requests per minute allowed for each Zendesk instance, unless the
+    project configures another one or Zendesk reports a lower one.
+    """
+    return getattr(settings, 'SENTRY_ZENDESK_RATE_LIMIT', 200)
+
+
+def get_max_wait():
+    return getattr(settings, 'SENTRY_ZENDESK_RATE_LIMIT_MAX_WAIT', 10)
+
+
+def get_backend_name():
+    return getattr(settings, 'SENTRY_ZENDESK_RATE_LIMIT_BACKEND', 'local')
+
+
+class RateLimitExceeded(ApiError):
+    code = 429
+
+
+class LocalBackend(object):
+    """
+    Token bucket shared by the threads of this process.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self._tokens = None
+        self._updated = time.time()
+        self._blocked_until = 0
+        self._lock = threading.Lock()
+
+    def take(self, rate, reserve):
+        """
+        Takes a token if more than `reserve` tokens are left, returning how
+        many seconds to wait before trying again otherwise (0 on success).
+        """
+        with self._lock:
+            now = time.time()
+            if now < self._blocked_until:
+                return self._blocked_until - now
+            if self._tokens is None:
+                self._tokens = float(rate)
+            self._tokens = min(
+                float(rate), self._tokens + (now - self._updated) * rate / 60.)
+            self._updated = now
+            if self._tokens - 1 >= reserve:
+                self._tokens -= 1
+                return 0
+            return (reserve + 1 - self._tokens) * 60. / rate
+
+    def block(self, seconds):
+        with self._lock:
+            self._blocked_until = max(self._blocked_until,
+                                      time.time() + seconds)
+            # Zendesk's budget is renewed once Retry-After has passed
+            self._tokens = None
+
+
+class RedisBackend(object):
+    """
+    Fixed window counter in Sentry's Redis, shared by all the processes
+    talking to the same Zendesk instance.
+    """
+
+    def __init__(self, key):
+        from sentry.utils.redis import clusters
+        self.key = 'sentry-zendesk:ratelimit:{}'.format(key)
+        self.cluster = clusters.get('default')
+
+    def take(self, rate, reserve):
+        now = time.time()
+        with self.cluster.map() as client:
+            blocked_until = client.get('{}:blocked'.format(self.key))
+        blocked_until = float(blocked_until.value or 0)
+        if now < blocked_until:
+            return blocked_until - now
+
+        window = int(now // 60)
+        window_key = '{}:{}'.format(self.key, window)
+        with self.cluster.map() as client:
+            count = client.incr(window_key)
+            client.expire(window_key, 120)
+        if count.value + reserve <= rate:
+            return 0
+        return (window + 1) * 60 - now
+
+    def block(self, seconds):
+        with self.cluster.map() as client:
+            client.setex('{}:blocked'.format(self.key), int(seconds) + 1,
+                         time.time() + seconds)
+
+
+BACKENDS = {
+    'local': LocalBackend,
+    'redis': RedisBackend,
+}
+
+
+class RateLimiter(object):
+    """
+    Request budget of a Zendesk instance.
+
+    The rate is the smallest of the ones configured by the projects which
+    used the instance in the last `CONFIGURED_RATE_TTL` seconds (projects
+    sharing the instance may configure different rates) and the one
+    reported by Zendesk on the `X-Rate-Limit` header, and a 429 blocks
+    everybody until its `Retry-After`.
+    """
+
+    def __init__(self, key, rate=None, backend=None):
+        # configured rate -> when a project last used it
+        self._configured = {}
+        self._lock = threading.Lock()
+        self.learned_rate = None
+        self.throttled = 0
+        self.backend = BACKENDS[backend or get_backend_name()](key)
+        self.configure(rate)
+
+    @property
+    def configured_rate(self):
+        expired = time.time() - CONFIGURED_RATE_TTL
+        with self._lock:
+            for rate, used in list(self._configured.items()):
+                if used < expired:
+                    del self._configured[rate]
+            return min(self._configured) if self._configured else None
+
+    @property
+    def rate(self):
+        rates = [self.configured_rate or get_default_rate()]
+        if self.learned_rate:
+            rates.append(self.learned_rate)
+        return min(rates)
+
+    def configure(self, rate):
+        """
+        Records the rate configured by a project using the instance, which
+        applies for `CONFIGURED_RATE_TTL` seconds. The smallest one is used,
+        so the budget doesn't depend on which project used the instance
+        last.
+        """
+        if rate:
+            with self._lock:
+                self._configured[rate] = time.time()
+
+    def acquire(self, priority=HIGH, max_wait=None):
+        if max_wait is None:
+            max_wait = get_max_wait()
+        deadline = time.time() + max_wait
+        rate = self.rate
+        reserve = rate * LOW_PRIORITY_RESERVE if priority == LOW else 0
+        while True:
+            wait = self.backend.take(rate, reserve)
+            if not wait:
+                return
+            self.throttled += 1
+            metrics.incr('ratelimit.throttled', priority=priority)
+            if time.time() + wait > deadline:
+                raise RateLimitExceeded(
+                    'Zendesk rate limit of {} requests per minute exceeded'
+                    .format(rate))
+            time.sleep(wait)
+
+    def update(self, response):
+        """
+        Learns from the rate limit headers of a Zendesk response.
+        """
+        limit = response.headers.get('X-Rate-Limit')
+        if limit and limit.isdigit() and int(limit) != self.learned_rate:
+            self.learned_rate = int(limit)
+            logger.info('Zendesk reported a rate limit of {} per minute'
+                        .format(limit))
+        if response.status_code == 429:
+            retry_after = response.headers.get('Retry-After', '60')
+            try:
+                retry_after = float(retry_after)
+            except ValueError:
+                retry_after = 60
+            logger.warning('Zendesk rate limit exceeded, waiting {} seconds'
+                           .format(retry_after))
+            metrics.incr('ratelimit.exceeded')
+            self.backend.block(retry_after)
+            return retry_after
+
+
+class RateLimiterRegistry(object):
+
+    def __init__(self):
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def get(self, zendesk_url, rate=None):
+        with self._lock:
+            limiter = self._limiters.get(zendesk_url)
+            if limiter is None:
+                limiter = self._limiters[zendesk_url] = RateLimiter(
+                    zendesk_url, rate)
+            else:
+                limiter.configure(rate)
+            return limiter
+
+    def clear(self):
+        with self._lock:
+            self._limiters.clear()
+
+
+limiters = RateLimiterRegistry()
@@ -0,0 +1,72 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+import sys
+import threading
+
+import six
+from sentry.utils import json
+
+from sentry_zendesk import metrics
+
+
+def canonical_key(*parts):
+    """
+    Key identifying a request, the same for equal payloads regardless of
+    the order of their keys.
+    """
+    return json.dumps(parts, sort_keys=True)
+
+
+class Call(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Coalesces concurrent calls with the same key: only the first one runs,
+    the others wait for it and share its result (or exception).
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                metrics.incr('singleflight.coalesced')
+                leader = False
+            else:
+                call = self._calls[key] = Call()
+                leader = True
+
+        if not leader:
+            call.done.wait()
+        else:
+            try:
+                call.result = fn(*args, **kwargs)
+            except Exception:
+                call.error = sys.exc_info()
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+
+        if call.error is not None:
+            six.reraise(*call.error)
+        return call.result
+
+    def get_stats(self):
+        return {'calls': self.calls, 'coalesced': self.coalesced}
+
+
+flights = SingleFlight()
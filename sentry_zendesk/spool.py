@@ -0,0 +1,278 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+import errno
+import fcntl
+import os
+import struct
+import threading
+import time
+import zlib
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils.encoding import force_bytes
+from sentry.utils import json
+
+from sentry_zendesk import logger, metrics
+
+
+# Each record is its length and CRC32 followed by its JSON
+HEADER = struct.Struct(str('>II'))
+SEGMENT_SUFFIX = '.seg'
+POSITION_SUFFIX = '.pos'
+
+
+def get_directory():
+    """
+    Directory keeping the ticket creations which failed while Zendesk was
+    unavailable, to be replayed later. `None` disables the spool.
+    """
+    return getattr(settings, 'SENTRY_ZENDESK_SPOOL_DIR', None)
+
+
+def get_segment_size():
+    return getattr(settings, 'SENTRY_ZENDESK_SPOOL_SEGMENT_SIZE', 1024 * 1024)
+
+
+def get_replay_interval():
+    return getattr(settings, 'SENTRY_ZENDESK_SPOOL_REPLAY_INTERVAL', 30)
+
+
+def encode_record(record):
+    data = force_bytes(json.dumps(record))
+    return HEADER.pack(len(data), zlib.crc32(data) & 0xffffffff) + data
+
+
+def read_records(f, offset=0):
+    """
+    Reads the records of a segment from `offset` on, along with the offset
+    right after each of them. Stops at a torn or corrupted record (e.g.
+    written while the process died), since nothing after it can be trusted.
+    """
+    f.seek(offset)
+    while True:
+        header = f.read(HEADER.size)
+        if not header:
+            return
+        if len(header) == HEADER.size:
+            size, checksum = HEADER.unpack(header)
+            data = f.read(size)
+            if (len(data) == size and
+                    zlib.crc32(data) & 0xffffffff == checksum):
+                offset += HEADER.size + size
+                yield json.loads(data.decode('utf8')), offset
+                continue
+        logger.error('Corrupted record at {}:{}, dropping the rest of the '
+                     'segment'.format(f.name, offset))
+        metrics.incr('spool.corrupted')
+        return
+
+
+def _try_lock(f):
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError as e:
+        if e.errno not in (errno.EAGAIN, errno.EACCES):
+            raise
+        return False
+    return True
+
+
+class Spool(object):
+    """
+    Append-only queue of records on disk, which survives restarts.
+
+    Records are appended to segment files of at most `segment_size` bytes
+    and replayed in order, segment by segment, one record at a time, so
+    memory use doesn't grow with the number of records. Segments being
+    written or replayed are locked, so many processes can share the same
+    directory: each one writes its own segments and replays whichever
+    segments are not locked.
+    """
+
+    def __init__(self, directory=None, segment_size=None):
+        self._directory = directory
+        self._segment_size = segment_size
+        self._segment = None
+        self._segment_bytes = 0
+        self._sequence = 0
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def directory(self):
+        if self._directory is not None:
+            return self._directory
+        return get_directory()
+
+    @property
+    def segment_size(self):
+        if self._segment_size is not None:
+            return self._segment_size
+        return get_segment_size()
+
+    @property
+    def enabled(self):
+        return bool(self.directory)
+
+    def append(self, record):
+        data = encode_record(record)
+        with self._lock:
+            segment = self._ensure_segment()
+            segment.write(data)
+            segment.flush()
+            os.fsync(segment.fileno())
+            self._segment_bytes += len(data)
+            if self._segment_bytes >= self.segment_size:
+                self._seal()
+        metrics.incr('spool.appended')
+
+    def seal(self):
+        """
+        Closes the segment being written, so it can be replayed.
+        """
+        with self._lock:
+            self._seal()
+
+    def segments(self):
+        try:
+            names = os.listdir(self.directory)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return []
+        return [os.path.join(self.directory, name)
+                for name in sorted(names) if name.endswith(SEGMENT_SUFFIX)]
+
+    def replay(self, handler, is_retryable):
+        """
+        Calls `handler` with each record, in order, removing the ones it
+        handled. Records failing with a retryable error stop the replay,
+        being retried first the next time; other failures drop the record.
+
+        :return: number of records handled
+        """
+        if not self.enabled:
+            return 0
+        self.seal()
+        handled = 0
+        for path in self.segments():
+            try:
+                f = open(path, 'rb')
+            except IOError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                continue
+            with f:
+                # Being written or replayed by someone else, or already gone
+                if not _try_lock(f) or os.fstat(f.fileno()).st_nlink == 0:
+                    continue
+                for record, offset in read_records(f, self._position(path)):
+                    try:
+                        handler(record)
+                    except Exception as e:
+                        if is_retryable(e):
+                            logger.info('Stopped replaying the spool: {}'
+                                        .format(e))
+                            return handled
+                        logger.exception('Dropping spooled record {}'
+                                         .format(record))
+                        metrics.incr('spool.dropped')
+                    else:
+                        metrics.incr('spool.replayed')
+                    handled += 1
+                    self._set_position(path, offset)
+                os.remove(path)
+                self._remove_position(path)
+        return handled
+
+    def _ensure_segment(self):
+        # A forked process must not write to its parent's segment
+        if self._pid != os.getpid():
+            self._segment = None
+            self._pid = os.getpid()
+        if self._segment is None:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            self._sequence += 1
+            name = '{:017.6f}-{}-{:06d}{}'.format(
+                time.time(), os.getpid(), self._sequence, SEGMENT_SUFFIX)
+            self._segment = open(os.path.join(self.directory, name), 'ab')
+            _try_lock(self._segment)
+            self._segment_bytes = 0
+        return self._segment
+
+    def _seal(self):
+        if self._segment is not None and self._pid == os.getpid():
+            self._segment.close()
+        self._segment = None
+
+    def _position(self, path):
+        try:
+            with open(path + POSITION_SUFFIX, 'rb') as f:
+                return int(f.read() or 0)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return 0
+
+    def _set_position(self, path, offset):
+        # Renaming is atomic, so the position is never half written
+        tmp_path = path + POSITION_SUFFIX + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(force_bytes(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, path + POSITION_SUFFIX)
+
+    def _remove_position(self, path):
+        try:
+            os.remove(path + POSITION_SUFFIX)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+
+class Replayer(object):
+    """
+    Background thread replaying the spool every `interval` seconds.
+    """
+
+    def __init__(self, spool, interval=None):
+        self.spool = spool
+        self._interval = interval
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def interval(self):
+        if self._interval is not None:
+            return self._interval
+        return get_replay_interval()
+
+    def start(self, handler, is_retryable):
+        # Threads don't survive a fork
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                thread = threading.Thread(
+                    target=self._run, args=(handler, is_retryable),
+                    name='sentry-zendesk-spool-replayer')
+                thread.daemon = True
+                thread.start()
+                self._pid = os.getpid()
+
+    def _run(self, handler, is_retryable):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.spool.replay(handler, is_retryable)
+            except Exception:
+                logger.exception('Failed to replay the spool')
+            finally:
+                close_old_connections()
+
+
+spool = Spool()
+replayer = Replayer(spool)
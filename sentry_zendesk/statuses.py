@@ -0,0 +1,84 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+from django.utils import timezone
+from sentry.models import Activity, Group, GroupResolution, GroupStatus
+
+from sentry_zendesk import metrics
+
+
+# Zendesk ticket statuses, lower case
+SOLVED_STATUSES = ('solved', 'closed')
+OPEN_STATUSES = ('new', 'open', 'pending', 'hold')
+
+
+def apply_ticket_statuses(project_id, statuses):
+    """
+    Resolves the groups of a project linked to tickets which were just
+    solved and reopens the ones linked to tickets which were solved and are
+    open again, with one update for each. Groups whose ticket keeps being
+    open or solved (e.g. updated, or closed once solved) are left alone, so
+    the ones changed in Sentry meanwhile keep their status.
+
+    :param statuses: Zendesk status by ticket id
+    :return: ids of the groups which were changed
+    """
+    from sentry_zendesk.models import TicketLink
+
+    links = TicketLink.objects.get_links(project_id, statuses)
+    to_resolve = []
+    to_reopen = []
+    # status -> ids of the tickets which changed to it
+    changed = {}
+    for ticket_id, status in statuses.items():
+        ticket_id = unicode(ticket_id)
+        status = (status or '').lower()
+        ticket_links = links.get(ticket_id, [])
+        if status in SOLVED_STATUSES:
+            to_resolve.extend(
+                group_id for group_id, last_status in ticket_links
+                if last_status not in SOLVED_STATUSES)
+        elif status in OPEN_STATUSES:
+            to_reopen.extend(group_id for group_id, last_status in ticket_links
+                             if last_status in SOLVED_STATUSES)
+        if (status in SOLVED_STATUSES + OPEN_STATUSES and
+                any(last_status != status for _, last_status in ticket_links)):
+            changed.setdefault(status, []).append(ticket_id)
+    TicketLink.objects.set_statuses(project_id, changed)
+    return (resolve_groups(project_id, to_resolve) +
+            reopen_groups(project_id, to_reopen))
+
+
+def resolve_groups(project_id, group_ids):
+    # A single update, as Sentry's bulk resolution does, so no model signal
+    # or notification is sent for each group
+    if not group_ids:
+        return []
+    group_ids = list(Group.objects.filter(
+        project_id=project_id, id__in=group_ids, status=GroupStatus.UNRESOLVED,
+    ).values_list('id', flat=True))
+    Group.objects.filter(id__in=group_ids).update(
+        status=GroupStatus.RESOLVED, resolved_at=timezone.now())
+    GroupResolution.objects.filter(group__in=group_ids).delete()
+    _add_activities(project_id, group_ids, Activity.SET_RESOLVED)
+    metrics.incr('statuses.resolved', len(group_ids))
+    return group_ids
+
+
+def reopen_groups(project_id, group_ids):
+    if not group_ids:
+        return []
+    group_ids = list(Group.objects.filter(
+        project_id=project_id, id__in=group_ids, status=GroupStatus.RESOLVED,
+    ).values_list('id', flat=True))
+    Group.objects.filter(id__in=group_ids).update(
+        status=GroupStatus.UNRESOLVED, active_at=timezone.now())
+    _add_activities(project_id, group_ids, Activity.SET_UNRESOLVED)
+    metrics.incr('statuses.reopened', len(group_ids))
+    return group_ids
+
+
+def _add_activities(project_id, group_ids, activity_type):
+    Activity.objects.bulk_create([
+        Activity(project_id=project_id, group_id=group_id, type=activity_type)
+        for group_id in group_ids
+    ])
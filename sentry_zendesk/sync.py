@@ -0,0 +1,109 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+import time
+
+from django.conf import settings
+from sentry.models import Project, ProjectOption
+
+from sentry_zendesk import logger, metrics
+from sentry_zendesk.statuses import apply_ticket_statuses
+
+
+CURSOR_OPTION = 'status_sync_cursor'
+
+
+def get_lookback():
+    """
+    Seconds of ticket changes read by the first sync of a project, which has
+    no cursor yet.
+    """
+    return getattr(settings, 'SENTRY_ZENDESK_STATUS_SYNC_LOOKBACK', 86400)
+
+
+def get_lock_duration():
+    return getattr(settings, 'SENTRY_ZENDESK_STATUS_SYNC_LOCK_DURATION', 300)
+
+
+class StatusSync(object):
+    """
+    Applies the status of the tickets changed since the last sync of a
+    project to the groups linked to them, reading Zendesk's incremental
+    ticket export. Each run only reads the tickets changed since the cursor
+    saved (as a plugin option) after each page, so it survives restarts.
+    """
+
+    def __init__(self, plugin, project):
+        self.plugin = plugin
+        self.project = project
+
+    def get_cursor(self):
+        return self.plugin.get_option(CURSOR_OPTION, self.project)
+
+    def set_cursor(self, cursor):
+        self.plugin.set_state(CURSOR_OPTION, cursor, self.project)
+
+    def run(self):
+        """
+        :return: number of tickets read and ids of the groups changed
+        """
+        from sentry.app import locks
+
+        lock = locks.get('sentry_zendesk:status_sync:{}'.format(
+            self.project.id), duration=get_lock_duration())
+        with lock.acquire():
+            return self._sync()
+
+    def _sync(self):
+        client = self.plugin.get_client(self.project)
+        cursor = self.get_cursor()
+        start_time = int(time.time() - get_lookback())
+        read = 0
+        changed = []
+        while True:
+            data = client.export_tickets(cursor=cursor, start_time=start_time,
+                                         fields=['id', 'status'])
+            tickets = data['tickets']
+            read += len(tickets)
+            # Only the last status of each ticket matters
+            changed += apply_ticket_statuses(self.project.id, dict(
+                (ticket['id'], ticket['status']) for ticket in tickets))
+            if data['after_cursor'] and data['after_cursor'] != cursor:
+                cursor = data['after_cursor']
+                self.set_cursor(cursor)
+            if data['end_of_stream'] is not False:
+                break
+        metrics.incr('status_sync.tickets', read)
+        logger.info('Synced status of {} tickets of project {}, changing {} '
+                    'groups'.format(read, self.project.id, len(changed)))
+        return read, changed
+
+
+def get_synced_projects(plugin):
+    """
+    Projects with the status sync enabled.
+    """
+    project_ids = [
+        option.project_id for option in ProjectOption.objects.filter(
+            key='%s:sync_ticket_status' % plugin.get_conf_key())
+        if option.value
+    ]
+    return [project for project in
+            Project.objects.filter(id__in=project_ids)
+            if plugin.is_enabled(project) and
+            plugin.is_configured(None, project)]
+
+
+def sync_all_statuses(plugin=None):
+    from sentry.utils.locking import UnableToAcquireLock
+    from sentry_zendesk.plugin import ZendeskPlugin
+
+    plugin = plugin or ZendeskPlugin()
+    for project in get_synced_projects(plugin):
+        try:
+            StatusSync(plugin, project).run()
+        except UnableToAcquireLock:
+            logger.info('Status of project {} is already being synced'
+                        .format(project.id))
+        except Exception:
+            logger.exception('Failed to sync status of project {}'.format(
+                project.id))
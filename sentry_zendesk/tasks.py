@@ -0,0 +1,15 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+from sentry.tasks.base import instrumented_task
+
+
+@instrumented_task(name='sentry_zendesk.tasks.sync_ticket_statuses')
+def sync_ticket_statuses(**kwargs):
+    from sentry_zendesk.sync import sync_all_statuses
+    sync_all_statuses()
+
+
+@instrumented_task(name='sentry_zendesk.tasks.apply_ticket_statuses')
+def apply_ticket_statuses(project_id, statuses, **kwargs):
+    from sentry_zendesk.statuses import apply_ticket_statuses
+    apply_ticket_statuses(project_id, statuses)
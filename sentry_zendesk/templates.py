@@ -0,0 +1,179 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+import re
+from collections import namedtuple
+from string import Formatter
+
+from django.conf import settings
+from sentry.exceptions import PluginError
+from sentry.models import Event
+from sentry.utils.http import absolute_uri
+
+from sentry_zendesk.caching import LRUCache
+
+
+DEFAULT_SUBJECT = '{title}'
+DEFAULT_COMMENT = '[{url}]({url})'
+PRIORITIES = ('low', 'normal', 'high', 'urgent')
+
+# Values a template can use, which are the same for every event of a group
+GROUP_FIELDS = ('title', 'url', 'culprit', 'level', 'project', 'short_id',
+                'group_id')
+EVENT_FIELDS = ('event_id', 'event_url')
+FIELDS = GROUP_FIELDS + EVENT_FIELDS
+
+_tag_separator_re = re.compile(r'[\s,]+')
+_tag_invalid_re = re.compile(r'[^\w/:-]+', re.UNICODE)
+
+
+def get_group_cache_ttl():
+    return getattr(settings, 'SENTRY_ZENDESK_TEMPLATE_CACHE_TTL', 300)
+
+
+def get_group_cache_size():
+    return getattr(settings, 'SENTRY_ZENDESK_TEMPLATE_CACHE_SIZE', 10000)
+
+
+class Template(object):
+    """
+    Text with `{field}` placeholders, parsed once so rendering it is a plain
+    join. Braces are escaped by doubling them.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.parts = []
+        try:
+            parsed = list(Formatter().parse(source))
+        except ValueError as e:
+            raise PluginError('Invalid template "{}": {}'.format(source, e))
+        for literal, field, format_spec, conversion in parsed:
+            if field is not None:
+                if field not in FIELDS or format_spec or conversion:
+                    raise PluginError(
+                        'Unknown field "{{{}}}", use one of {}'.format(
+                            field, ', '.join('{%s}' % f for f in FIELDS)))
+            self.parts.append((literal, field))
+
+    def render(self, context):
+        return ''.join(
+            literal + (context[field] if field is not None else '')
+            for literal, field in self.parts)
+
+
+def parse_custom_fields(source):
+    """
+    Custom field templates from `<field id>: <template>` lines.
+    """
+    custom_fields = []
+    for line in (source or '').splitlines():
+        if not line.strip():
+            continue
+        field_id, sep, template = line.partition(':')
+        if not sep or not field_id.strip().isdigit():
+            raise PluginError(
+                'Invalid custom field "{}", expected '
+                '"<field id>: <template>"'.format(line))
+        custom_fields.append(
+            (int(field_id), Template(template.strip())))
+    return custom_fields
+
+
+class TicketTemplates(namedtuple(
+        'TicketTemplates',
+        ['subject', 'comment', 'tags', 'priority', 'custom_fields'])):
+    """
+    Compiled templates of the tickets created for a project.
+    """
+
+    @classmethod
+    def compile(cls, subject=None, comment=None, tags=None, priority=None,
+                custom_fields=None):
+        if priority and priority not in PRIORITIES:
+            raise PluginError('Invalid priority "{}"'.format(priority))
+        return cls(
+            subject=Template(subject or DEFAULT_SUBJECT),
+            comment=Template(comment or DEFAULT_COMMENT),
+            tags=[Template(tag)
+                  for tag in _tag_separator_re.split(tags or '') if tag],
+            priority=priority or None,
+            custom_fields=parse_custom_fields(custom_fields),
+        )
+
+    def render(self, context):
+        """
+        Fields of the ticket (besides its type and problem), as sent to
+        Zendesk.
+        """
+        fields = {
+            'subject': self.subject.render(context),
+            'comment': self.comment.render(context),
+        }
+        tags = [_tag_invalid_re.sub('_', tag.render(context)).strip('_')
+                for tag in self.tags]
+        if any(tags):
+            fields['tags'] = [tag for tag in tags if tag]
+        if self.priority:
+            fields['priority'] = self.priority
+        if self.custom_fields:
+            fields['custom_fields'] = [
+                {'id': field_id, 'value': template.render(context)}
+                for field_id, template in self.custom_fields]
+        return fields
+
+
+class TemplateCache(object):
+    """
+    Compiled templates by their source, so each configuration is compiled
+    only once (when it is saved), and the values of each group used to
+    render them, so rendering the tickets of a busy group is a plain
+    substitution.
+    """
+
+    def __init__(self):
+        self._compiled = LRUCache(1000)
+        self._groups = LRUCache(get_group_cache_size, get_group_cache_ttl)
+
+    def compile(self, subject=None, comment=None, tags=None, priority=None,
+                custom_fields=None):
+        key = (subject, comment, tags, priority, custom_fields)
+        templates = self._compiled.get(key)
+        if templates is None:
+            templates = TicketTemplates.compile(*key)
+            self._compiled.set(key, templates)
+        return templates
+
+    def get_context(self, plugin, group, event):
+        """
+        Values available to the templates, computing the ones of the group
+        only for its first event.
+        """
+        context = self._groups.get(group.id)
+        if context is None:
+            context = {
+                'title': plugin.get_group_title(None, group, event),
+                'url': absolute_uri(group.get_absolute_url()),
+                'culprit': group.culprit or '',
+                'level': group.get_level_display(),
+                'project': group.project.slug,
+                'short_id': group.qualified_short_id or '',
+                'group_id': unicode(group.id),
+            }
+            self._groups.set(group.id, context)
+        context = dict(context)
+        # Problems created for existing issues are built from the group alone
+        if isinstance(event, Event):
+            context['event_id'] = event.event_id or ''
+            context['event_url'] = '{}events/{}/'.format(
+                context['url'], event.id)
+        else:
+            context['event_id'] = ''
+            context['event_url'] = context['url']
+        return context
+
+    def clear(self):
+        self._compiled.clear()
+        self._groups.clear()
+
+
+templates = TemplateCache()
@@ -0,0 +1,58 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+from contextlib import contextmanager
+
+
+def reset_state():
+    """
+    Drops the state kept by each process (caches, pools, buffers...), so
+    tests and benchmarks don't leak it into each other.
+    """
+    from sentry_zendesk.batching import incidents
+    from sentry_zendesk.caching import links, searches
+    from sentry_zendesk.circuitbreaker import breakers
+    from sentry_zendesk.comments import comments
+    from sentry_zendesk.client import clients
+    from sentry_zendesk.config import configs
+    from sentry_zendesk.index import indexes
+    from sentry_zendesk.ratelimit import limiters
+    from sentry_zendesk.templates import templates
+    from sentry_zendesk.throttling import throttle
+
+    clients.clear()
+    searches.clear()
+    links.clear()
+    indexes.clear()
+    limiters.clear()
+    breakers.clear()
+    configs.clear()
+    throttle.clear()
+    comments.clear()
+    incidents.clear()
+    templates.clear()
+
+
+@contextmanager
+def shared_connections():
+    """
+    Makes every thread use the database connections of the calling one, so
+    background threads see the data of the running test (e.g. in sqlite's
+    in-memory database, which is private to each connection).
+    """
+    from django.db import connections
+
+    class Shared(object):
+        pass
+
+    shared = Shared()
+    for alias in connections:
+        connection = connections[alias]
+        connection.allow_thread_sharing = True
+        setattr(shared, alias, connection)
+    own, connections._connections = connections._connections, shared
+    try:
+        yield
+    finally:
+        connections._connections = own
+        for alias in connections:
+            connections[alias].allow_thread_sharing = False
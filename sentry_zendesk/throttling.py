@@ -0,0 +1,95 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+import threading
+import time
+
+from django.conf import settings
+
+from sentry_zendesk import metrics
+from sentry_zendesk.caching import LRUCache
+
+
+DEFAULT_WINDOW = 3600
+
+
+def get_throttle_size():
+    return getattr(settings, 'SENTRY_ZENDESK_THROTTLE_SIZE', 10000)
+
+
+class IncidentThrottle(object):
+    """
+    Decides which events of a group become incidents, according to the
+    policies configured on its project:
+
+    - `incident_sampled_only`: only events Sentry keeps, skipping the ones
+      it samples out (`is_sample`), which are not saved
+    - `incident_every`: one every K events
+    - `incident_limit`: at most N incidents per `incident_window` seconds
+
+    Skipped events are counted, and the count is handed over along with the
+    next incident. The state of each group is a short list in an LRU cache,
+    kept by each process.
+    """
+
+    # Indexes of the group state
+    WINDOW_START, CREATED, SEEN, SKIPPED = range(4)
+
+    def __init__(self, max_size=None):
+        self._states = LRUCache(
+            max_size if max_size is not None else get_throttle_size)
+        self._lock = threading.Lock()
+
+    def check(self, config, group_id, is_sample):
+        """
+        Records an event of the group.
+
+        :return: `None` when the event must be skipped, otherwise the number
+            of events skipped since the previous incident.
+        """
+        if not is_throttled(config):
+            return 0
+
+        with self._lock:
+            return self._check(config, group_id, is_sample)
+
+    def _check(self, config, group_id, is_sample):
+        now = time.time()
+        state = self._states.get(group_id)
+        if state is None:
+            state = [now, 0, 0, 0]
+            self._states.set(group_id, state)
+        state[self.SEEN] += 1
+
+        window = config.incident_window or DEFAULT_WINDOW
+        if now - state[self.WINDOW_START] >= window:
+            state[self.WINDOW_START] = now
+            state[self.CREATED] = 0
+
+        if config.incident_sampled_only and is_sample:
+            reason = 'sampled'
+        elif (config.incident_every and
+                (state[self.SEEN] - 1) % config.incident_every):
+            reason = 'every'
+        elif (config.incident_limit and
+                state[self.CREATED] >= config.incident_limit):
+            reason = 'limit'
+        else:
+            skipped = state[self.SKIPPED]
+            state[self.CREATED] += 1
+            state[self.SKIPPED] = 0
+            return skipped
+
+        state[self.SKIPPED] += 1
+        metrics.incr('incident.skipped', reason=reason)
+        return None
+
+    def clear(self):
+        self._states.clear()
+
+
+def is_throttled(config):
+    return bool(config.incident_sampled_only or config.incident_every or
+                config.incident_limit)
+
+
+throttle = IncidentThrottle()
@@ -0,0 +1,13 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+from django.conf.urls import patterns, url
+
+from sentry_zendesk.plugin import ZendeskPlugin
+from sentry_zendesk.webhooks import WebhookView
+
+
+urlpatterns = patterns(
+    '',
+    url(r'^projects/(?P<project_id>\d+)/webhook/$',
+        WebhookView.as_view(plugin=ZendeskPlugin())),
+)
@@ -0,0 +1,113 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+import base64
+import hashlib
+import hmac
+import time
+from calendar import timegm
+
+from dateutil.parser import parse as parse_date
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
+from django.views.generic import View
+from sentry.models import Project
+from sentry.utils import json
+
+from sentry_zendesk import logger, metrics
+
+
+SIGNATURE_HEADER = 'HTTP_X_ZENDESK_WEBHOOK_SIGNATURE'
+TIMESTAMP_HEADER = 'HTTP_X_ZENDESK_WEBHOOK_SIGNATURE_TIMESTAMP'
+
+
+def get_max_age():
+    """
+    Seconds a signed webhook request stays valid, so captured requests can't
+    be replayed later. Zero accepts requests of any age.
+    """
+    return getattr(settings, 'SENTRY_ZENDESK_WEBHOOK_MAX_AGE', 300)
+
+
+def sign(secret, timestamp, body):
+    """
+    Signature Zendesk sends along with webhook requests: the base64 encoded
+    HMAC-SHA256 of the timestamp followed by the body.
+    """
+    digest = hmac.new(secret.encode('utf8'), timestamp.encode('utf8') + body,
+                      hashlib.sha256).digest()
+    return base64.b64encode(digest).decode('ascii')
+
+
+def is_valid_signature(secret, timestamp, body, signature):
+    if not (secret and timestamp and signature):
+        return False
+    if not constant_time_compare(sign(secret, timestamp, body), signature):
+        return False
+    if get_max_age():
+        try:
+            signed_at = timegm(parse_date(timestamp).utctimetuple())
+        except (ValueError, OverflowError):
+            return False
+        if abs(time.time() - signed_at) > get_max_age():
+            return False
+    return True
+
+
+def parse_statuses(body):
+    """
+    Status of each ticket in a webhook payload, which is a single object
+    (or a list of them) with `ticket_id` and `status`.
+    """
+    payload = json.loads(body)
+    if isinstance(payload, dict):
+        payload = [payload]
+    return dict((unicode(item['ticket_id']), unicode(item['status']))
+                for item in payload)
+
+
+class WebhookView(View):
+    """
+    Receives the ticket changes Zendesk sends through a webhook, resolving
+    and reopening the groups linked to the tickets.
+    """
+
+    plugin = None
+
+    @method_decorator(csrf_exempt)
+    def dispatch(self, request, *args, **kwargs):
+        if request.method != 'POST':
+            return HttpResponse(status=405)
+        return super(WebhookView, self).dispatch(request, *args, **kwargs)
+
+    def post(self, request, project_id):
+        from sentry_zendesk.tasks import apply_ticket_statuses
+
+        try:
+            project = Project.objects.get_from_cache(id=project_id)
+        except Project.DoesNotExist:
+            return HttpResponse(status=404)
+
+        secret = self.plugin.get_project_config(project).webhook_secret
+        body = request.body
+        if not is_valid_signature(secret,
+                                  request.META.get(TIMESTAMP_HEADER),
+                                  body,
+                                  request.META.get(SIGNATURE_HEADER)):
+            logger.warning('Invalid webhook signature for project {}'
+                           .format(project_id))
+            metrics.incr('webhook.invalid_signature')
+            return HttpResponse(status=401)
+
+        try:
+            ticket_statuses = parse_statuses(body)
+        except (ValueError, KeyError, TypeError):
+            return HttpResponse(status=400)
+
+        metrics.incr('webhook.received', len(ticket_statuses))
+        # Queued, so changes survive a restart of the web process
+        apply_ticket_statuses.delay(
+            project_id=project.id, statuses=ticket_statuses)
+        return HttpResponse(status=202)
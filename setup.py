@@ -12,6 +12,8 @@ with open('HISTORY.rst') as history_file:
 tests_require = [
     'exam',
     'flake8>=2.0,<2.1',
+    'ijson',
+    'mock',
     'responses',
     'sentry>=8.11.0',
     'sentry-plugins>=8.11.0',
@@ -32,9 +34,18 @@ setup(
     use_scm_version={'write_to': 'sentry_zendesk/_version.py'},
     setup_requires=['setuptools_scm'],
     license='Apache',
-    packages=['sentry_zendesk'],
+    packages=[
+        'sentry_zendesk',
+        'sentry_zendesk.management',
+        'sentry_zendesk.management.commands',
+        'sentry_zendesk.migrations',
+    ],
     zip_safe=False,
     install_requires=install_requires,
+    extras_require={
+        # Parses Zendesk responses incrementally
+        'streaming': ['ijson'],
+    },
     entry_points={
         'sentry.apps': [
             'zendesk = sentry_zendesk',
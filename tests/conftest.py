@@ -2,6 +2,8 @@ from __future__ import absolute_import, print_function, unicode_literals
 
 import os
 
+import pytest
+
 from django.conf import settings
 
 
@@ -18,3 +20,10 @@ def pytest_configure(config):
     from sentry.plugins import plugins
     from sentry_zendesk.plugin import ZendeskPlugin
     plugins.register(ZendeskPlugin)
+
+
+@pytest.fixture(autouse=True)
+def reset_zendesk_state():
+    from sentry_zendesk.testutils import reset_state
+    yield
+    reset_state()
@@ -0,0 +1,201 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+import itertools
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from exam import fixture
+from sentry.models import GroupMeta, GroupStatus
+from sentry.testutils import TestCase
+from sentry.utils import json
+import mock
+import pytest
+import responses
+
+from sentry_zendesk import backfill as backfill_module
+from sentry_zendesk.backfill import Backfill, retry_throttled
+from sentry_zendesk.client import ZendeskClient
+from sentry_zendesk.ratelimit import RateLimitExceeded
+from sentry_zendesk.plugin import ZendeskPlugin
+from sentry_zendesk.testutils import shared_connections
+
+
+class BackfillTest(TestCase):
+
+    @fixture
+    def plugin(self):
+        return ZendeskPlugin()
+
+    def setUp(self):
+        super(BackfillTest, self).setUp()
+        self.plugin.set_option(
+            'zendesk_url', 'https://foocompany.zendesk.com', self.project)
+        self.plugin.set_option('username', 'Bob', self.project)
+        self.plugin.set_option('password', 'bob123', self.project)
+        self.ticket_ids = itertools.count(100)
+        self.failing_requests = set()
+        self.failing_jobs = set()
+        self.requests = itertools.count()
+        self._old_poll_interval = ZendeskClient.JOB_POLL_INTERVAL
+        ZendeskClient.JOB_POLL_INTERVAL = 0
+        # Jobs are saved by the threads creating their tickets
+        sharing = shared_connections()
+        sharing.__enter__()
+        self.addCleanup(sharing.__exit__, None, None, None)
+
+    def tearDown(self):
+        ZendeskClient.JOB_POLL_INTERVAL = self._old_poll_interval
+        super(BackfillTest, self).tearDown()
+
+    def _mock_zendesk(self):
+        jobs = {}
+
+        def create_many(request):
+            if next(self.requests) in self.failing_requests:
+                return 500, {}, 'Error creating tickets'
+            tickets = json.loads(request.body)['tickets']
+            job_id = 'job{}'.format(len(jobs))
+            jobs[job_id] = [{'index': i, 'id': next(self.ticket_ids)}
+                            for i in range(len(tickets))]
+            return 200, {}, json.dumps(
+                {'job_status': {'id': job_id, 'status': 'queued'}})
+
+        def job_status(request):
+            job_id = request.url.rsplit('/', 1)[1].split('.')[0]
+            if job_id in self.failing_jobs:
+                return 500, {}, 'Error reading job'
+            return 200, {}, json.dumps({'job_status': {
+                'id': job_id, 'status': 'completed',
+                'results': jobs[job_id]}})
+
+        responses.add_callback(
+            responses.POST,
+            'https://foocompany.zendesk.com/api/v2/tickets/create_many.json',
+            callback=create_many, content_type='application/json')
+        for i in range(10):
+            responses.add_callback(
+                responses.GET,
+                'https://foocompany.zendesk.com/api/v2/job_statuses/'
+                'job{}.json'.format(i),
+                callback=job_status, content_type='application/json')
+
+    def _linked(self):
+        return dict(GroupMeta.objects.filter(
+            key='sentry_zendesk:tid').values_list('group_id', 'value'))
+
+    @responses.activate
+    def test_creates_problems_for_unlinked_unresolved_groups(self):
+        self._mock_zendesk()
+        groups = [self.create_group(message='Group {}'.format(i))
+                  for i in range(5)]
+        linked = groups[1]
+        GroupMeta.objects.set_value(linked, 'sentry_zendesk:tid', '12345')
+        resolved = self.create_group(
+            message='Resolved', status=GroupStatus.RESOLVED)
+
+        backfill = Backfill(self.plugin, self.project, chunk_size=2,
+                            concurrency=2)
+        assert backfill.run() == (4, 0, 1)
+
+        links = self._linked()
+        assert links.pop(linked.id) == '12345'
+        assert resolved.id not in links
+        assert sorted(links.values()) == ['100', '101', '102', '103']
+        assert backfill.get_checkpoint() == resolved.id - 1
+        sent = [json.loads(call.request.body)['tickets'] for call in
+                responses.calls if call.request.method == 'POST']
+        assert [len(tickets) for tickets in sent] == [1, 2, 1]
+        assert sent[0][0] == {
+            'type': 'problem',
+            'subject': groups[0].error(),
+            'comment': '[{0}]({0})'.format(
+                groups[0].get_absolute_url()),
+        }
+
+        # Nothing is left to do
+        assert Backfill(self.plugin, self.project).run() == (0, 0, 0)
+
+    @responses.activate
+    def test_resumes_from_first_failed_chunk(self):
+        self._mock_zendesk()
+        groups = [self.create_group(message='Group {}'.format(i))
+                  for i in range(3)]
+        self.failing_requests.add(1)
+
+        backfill = Backfill(self.plugin, self.project, chunk_size=1,
+                            concurrency=1)
+        assert backfill.run() == (2, 1, 0)
+        assert set(self._linked()) == {groups[0].id, groups[2].id}
+        assert backfill.get_checkpoint() == groups[0].id
+
+        backfill = Backfill(self.plugin, self.project, chunk_size=1)
+        assert backfill.run() == (1, 0, 1)
+        assert set(self._linked()) == set(group.id for group in groups)
+        assert backfill.get_checkpoint() == groups[2].id
+
+    @responses.activate
+    def test_resumes_polling_jobs_of_interrupted_run(self):
+        self._mock_zendesk()
+        groups = [self.create_group(message='Group {}'.format(i))
+                  for i in range(2)]
+        self.failing_jobs.add('job0')
+
+        backfill = Backfill(self.plugin, self.project, chunk_size=2)
+        with self.settings(SENTRY_ZENDESK_RETRIES=0):
+            assert backfill.run() == (0, 2, 0)
+        assert self._linked() == {}
+        assert backfill.get_jobs() == {
+            'job0': [group.id for group in groups]}
+
+        self.failing_jobs.clear()
+        backfill = Backfill(self.plugin, self.project, chunk_size=2)
+        assert backfill.run() == (2, 0, 2)
+        assert self._linked() == {groups[0].id: '100', groups[1].id: '101'}
+        assert backfill.get_jobs() == {}
+        # The tickets were created only once
+        assert len([call for call in responses.calls
+                    if call.request.method == 'POST']) == 1
+
+    @responses.activate
+    def test_jobs_are_saved_once_created(self):
+        self._mock_zendesk()
+        groups = [self.create_group(message='Group {}'.format(i))
+                  for i in range(2)]
+
+        # Interrupted while waiting for the first job
+        backfill = Backfill(self.plugin, self.project, chunk_size=1,
+                            concurrency=2)
+        with mock.patch.object(Backfill, '_finish',
+                               side_effect=KeyboardInterrupt):
+            with pytest.raises(KeyboardInterrupt):
+                backfill.run()
+        jobs = backfill.get_jobs()
+        assert sorted(jobs) == ['job0', 'job1']
+        assert sorted(jobs.values()) == [[groups[0].id], [groups[1].id]]
+
+        backfill = Backfill(self.plugin, self.project, chunk_size=1)
+        assert backfill.run() == (2, 0, 2)
+        assert sorted(self._linked().values()) == ['100', '101']
+        assert len([call for call in responses.calls
+                    if call.request.method == 'POST']) == 2
+
+    def test_retry_throttled_gives_up(self):
+        fn = mock.Mock(side_effect=RateLimitExceeded('Throttled'))
+
+        with mock.patch.object(backfill_module, 'THROTTLED_TIMEOUT', 0):
+            with pytest.raises(RateLimitExceeded):
+                retry_throttled(fn)
+        assert fn.call_count == 1
+
+    @responses.activate
+    def test_command(self):
+        self._mock_zendesk()
+        group = self.create_group(message='Hello world')
+
+        call_command('zendesk_backfill', project=unicode(self.project.id))
+        assert self._linked() == {group.id: '100'}
+
+    def test_command_requires_configured_project(self):
+        project = self.create_project(name='Other')
+        with pytest.raises(CommandError):
+            call_command('zendesk_backfill', project=unicode(project.id))
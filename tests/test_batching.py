@@ -0,0 +1,173 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+import threading
+
+from sentry.testutils import TestCase
+from sentry.utils import json
+import mock
+import responses
+
+from sentry_zendesk.batching import TicketBatcher
+from sentry_zendesk.client import ZendeskClient, build_ticket
+from sentry_zendesk.spool import spool
+
+
+class TicketBatcherTest(TestCase):
+
+    def setUp(self):
+        super(TicketBatcherTest, self).setUp()
+        self.client = ZendeskClient(
+            'https://foocompany.zendesk.com', 'Bob', 'bob123')
+
+    def _ticket(self, title):
+        return build_ticket(title, 'comment', 'incident', problem_id='12345')
+
+    def _mock_job(self, results):
+        responses.add(
+            responses.POST,
+            'https://foocompany.zendesk.com/api/v2/tickets/create_many.json',
+            json={'job_status': {'id': 'abc', 'status': 'queued'}},
+            content_type='application/json',
+        )
+        responses.add(
+            responses.GET,
+            'https://foocompany.zendesk.com/api/v2/job_statuses/abc.json',
+            json={'job_status': {'id': 'abc', 'status': 'completed',
+                                 'results': results}},
+            content_type='application/json',
+        )
+
+    @responses.activate
+    def test_flush_creates_tickets_in_bulk(self):
+        self._mock_job([{'index': 0, 'id': 1}, {'index': 1, 'id': 2}])
+        batcher = TicketBatcher(window=60, size=10)
+        batcher.add(self.client, self._ticket('first'))
+        batcher.add(self.client, self._ticket('second'))
+        assert len(responses.calls) == 0
+        assert batcher.pending_count() == 2
+
+        batcher.flush()
+        assert batcher.pending_count() == 0
+        sent_data = json.loads(responses.calls[0].request.body)
+        assert [t['subject'] for t in sent_data['tickets']] == [
+            'first', 'second']
+        assert responses.calls[1].request.url == (
+            'https://foocompany.zendesk.com/api/v2/job_statuses/abc.json')
+        assert len(responses.calls) == 2
+
+    @responses.activate
+    def test_tickets_failed_by_the_job_are_created_one_by_one(self):
+        self._mock_job([{'index': 0, 'id': 1},
+                        {'index': 1, 'status': 'Failed',
+                         'error': 'InvalidValue'}])
+        responses.add(
+            responses.POST,
+            'https://foocompany.zendesk.com/api/v2/tickets.json',
+            json={'ticket': {'id': 3}},
+            content_type='application/json',
+        )
+        batcher = TicketBatcher(window=60, size=10)
+        batcher.add(self.client, self._ticket('first'))
+        batcher.add(self.client, self._ticket('second'))
+
+        batcher.flush()
+        assert len(responses.calls) == 3
+        assert json.loads(responses.calls[2].request.body) == {
+            'ticket': self._ticket('second')}
+
+    @responses.activate
+    def test_batch_is_sent_in_background_when_size_is_reached(self):
+        responses.add(
+            responses.POST,
+            'https://foocompany.zendesk.com/api/v2/tickets/create_many.json',
+            body='Bad tickets',
+            status=422,
+        )
+        responses.add(
+            responses.POST,
+            'https://foocompany.zendesk.com/api/v2/tickets.json',
+            json={'ticket': {'id': 1}},
+            content_type='application/json',
+        )
+        batcher = TicketBatcher(window=60, size=2)
+        batcher.add(self.client, self._ticket('first'))
+        batcher.add(self.client, self._ticket('second'))
+        assert batcher.pending_count() == 0
+
+        batcher.flush()
+        # Falls back to one request per ticket when the bulk request fails
+        assert [call.request.url for call in responses.calls] == [
+            'https://foocompany.zendesk.com/api/v2/tickets/create_many.json',
+            'https://foocompany.zendesk.com/api/v2/tickets.json',
+            'https://foocompany.zendesk.com/api/v2/tickets.json',
+        ]
+
+    @responses.activate
+    def test_full_batches_share_a_single_sender_thread(self):
+        senders = set()
+
+        def create_many(request):
+            senders.add(threading.current_thread().name)
+            return 422, {}, 'Bad tickets'
+
+        responses.add_callback(
+            responses.POST,
+            'https://foocompany.zendesk.com/api/v2/tickets/create_many.json',
+            callback=create_many,
+        )
+        responses.add(
+            responses.POST,
+            'https://foocompany.zendesk.com/api/v2/tickets.json',
+            json={'ticket': {'id': 1}},
+            content_type='application/json',
+        )
+        batcher = TicketBatcher(window=60, size=2)
+        for i in range(8):
+            batcher.add(self.client, self._ticket('ticket {}'.format(i)))
+
+        batcher.flush()
+        assert len(responses.calls) == 12
+        assert senders == {'sentry-zendesk-batch-sender-0'}
+
+    @responses.activate
+    def test_tickets_are_spooled_when_zendesk_is_unavailable(self):
+        responses.add(
+            responses.POST,
+            'https://foocompany.zendesk.com/api/v2/tickets/create_many.json',
+            body='Unavailable',
+            status=503,
+        )
+        spooled = []
+        batcher = TicketBatcher(window=60, size=10)
+        batcher.add(self.client, self._ticket('first'),
+                    project_id=self.project.id, group_id=1)
+        batcher.add(self.client, self._ticket('second'),
+                    project_id=self.project.id, group_id=2)
+
+        with mock.patch.object(spool, 'append', spooled.append), \
+                self.settings(SENTRY_ZENDESK_SPOOL_DIR='/tmp/spool'):
+            batcher.flush()
+
+        assert len(responses.calls) == 1
+        assert spooled == [
+            {'project_id': self.project.id, 'group_id': 1,
+             'ticket': self._ticket('first')},
+            {'project_id': self.project.id, 'group_id': 2,
+             'ticket': self._ticket('second')},
+        ]
+
+    @responses.activate
+    def test_single_pending_ticket_uses_single_ticket_endpoint(self):
+        responses.add(
+            responses.POST,
+            'https://foocompany.zendesk.com/api/v2/tickets.json',
+            json={'ticket': {'id': 1}},
+            content_type='application/json',
+        )
+        batcher = TicketBatcher(window=60, size=10)
+        batcher.add(self.client, self._ticket('first'))
+        batcher.flush()
+
+        assert len(responses.calls) == 1
+        assert json.loads(responses.calls[0].request.body) == {
+            'ticket': self._ticket('first')}
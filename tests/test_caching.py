@@ -0,0 +1,72 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+from sentry.testutils import TestCase
+import mock
+
+from sentry_zendesk.caching import LRUCache, SearchCache
+
+
+class LRUCacheTest(TestCase):
+
+    def test_discards_least_recently_used(self):
+        cache = LRUCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        assert cache.get('a') == 1
+        cache.set('c', 3)
+
+        assert 'a' in cache
+        assert 'b' not in cache
+        assert 'c' in cache
+
+    def test_expires_entries(self):
+        cache = LRUCache(max_size=2, ttl=-1)
+        cache.set('a', 1)
+        assert cache.get('a') is None
+
+
+class SearchCacheTest(TestCase):
+
+    results = [
+        {'id': 1, 'subject': 'Cannot run foo'},
+        {'id': 2, 'subject': 'Problem running bar with foobar'},
+    ]
+
+    def test_reuses_complete_result_of_shorter_prefix(self):
+        cache = SearchCache(max_size=10, ttl=60)
+        cache.set(1, 'fo', self.results, complete=True)
+
+        assert cache.get(1, 'foob') == [self.results[1]]
+        assert cache.get(1, 'foo') == self.results
+        # Other projects may point to other Zendesk instances
+        assert cache.get(2, 'foo') is None
+
+    def test_derived_results_expire_with_their_prefix(self):
+        cache = SearchCache(max_size=10, ttl=60)
+        with mock.patch('time.time', return_value=1000.):
+            cache.set(1, 'f', self.results, complete=True)
+        with mock.patch('time.time', return_value=1050.):
+            assert cache.get(1, 'fo') == self.results
+        with mock.patch('time.time', return_value=1055.):
+            assert cache.get(1, 'foo') == self.results
+
+        with mock.patch('time.time', return_value=1061.):
+            assert cache.get(1, 'foo') is None
+            assert cache.get(1, 'fo') is None
+
+    def test_dont_reuse_incomplete_result(self):
+        cache = SearchCache(max_size=10, ttl=60)
+        cache.set(1, 'fo', self.results, complete=False)
+
+        assert cache.get(1, 'fo') == self.results
+        assert cache.get(1, 'foo') is None
+
+    def test_reads_settings_when_used(self):
+        cache = SearchCache()
+
+        with self.settings(SENTRY_ZENDESK_SEARCH_CACHE_SIZE=1):
+            cache.set(1, 'foo', [], complete=True)
+            cache.set(1, 'bar', [], complete=True)
+
+        assert cache.get(1, 'foo') is None
+        assert cache.get(1, 'bar') == []
@@ -0,0 +1,85 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+from sentry.testutils import TestCase
+from sentry_plugins.exceptions import ApiError
+import pytest
+import responses
+
+from sentry_zendesk.circuitbreaker import CircuitBreaker, CircuitOpenError
+from sentry_zendesk.client import ZendeskClient
+
+
+class CircuitBreakerTest(TestCase):
+
+    def test_open_after_consecutive_failures(self):
+        breaker = CircuitBreaker('foo', failure_threshold=2, reset_timeout=60)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        assert breaker.state == 'closed'
+        breaker.record_failure()
+
+        assert breaker.state == 'open'
+        assert breaker.trips == 1
+        with pytest.raises(CircuitOpenError):
+            breaker.before_request()
+
+    def test_half_open_lets_single_trial_through(self):
+        breaker = CircuitBreaker('foo', failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+
+        assert breaker.allow_request()
+        assert breaker.state == 'half-open'
+        assert not breaker.allow_request()
+
+        breaker.record_failure()
+        assert breaker.state == 'open'
+        assert breaker.trips == 2
+
+        assert breaker.allow_request()
+        breaker.record_success()
+        assert breaker.get_stats()['state'] == 'closed'
+        assert breaker.allow_request()
+
+    @responses.activate
+    def test_retry_reads_on_transient_errors(self):
+        calls = []
+
+        def search(request):
+            calls.append(request)
+            if len(calls) < 3:
+                return (503, {}, 'Unavailable')
+            return (200, {}, '{"results": []}')
+
+        responses.add_callback(
+            responses.GET, 'https://foocompany.zendesk.com/api/v2/search.json',
+            callback=search,
+            content_type='application/json',
+        )
+        client = ZendeskClient('https://foocompany.zendesk.com', 'Bob', 'b')
+
+        with self.settings(SENTRY_ZENDESK_RETRY_BACKOFF=0.01):
+            assert client.search_tickets('foo') == {'results': []}
+        assert len(calls) == 3
+        assert client.breaker.failures == 0
+
+    @responses.activate
+    def test_fail_fast_when_circuit_is_open(self):
+        responses.add(
+            responses.POST,
+            'https://foocompany.zendesk.com/api/v2/tickets.json',
+            body='Error creating ticket',
+            status=500,
+        )
+        client = ZendeskClient('https://foocompany.zendesk.com', 'Bob', 'b')
+
+        with self.settings(SENTRY_ZENDESK_BREAKER_THRESHOLD=2):
+            for i in range(2):
+                with pytest.raises(ApiError):
+                    client.create_ticket('foo', 'bar', 'problem', None)
+            with pytest.raises(CircuitOpenError):
+                client.create_ticket('foo', 'bar', 'problem', None)
+
+        # Writes are never retried
+        assert len(responses.calls) == 2
+        assert client.breaker.state == 'open'
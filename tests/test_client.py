@@ -0,0 +1,224 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+import gzip
+import io
+
+from sentry.testutils import TestCase
+from sentry.utils import json
+import responses
+
+from sentry_zendesk import metrics
+from sentry_zendesk.client import ClientRegistry, get_client
+
+
+class ZendeskClientTest(TestCase):
+
+    def test_registry_shares_client_per_instance(self):
+        client = get_client('https://foocompany.zendesk.com/', 'Bob', 'bob1')
+        assert get_client(
+            'https://foocompany.zendesk.com', 'Bob', 'bob1') is client
+        assert get_client(
+            'https://barcompany.zendesk.com', 'Bob', 'bob1') is not client
+
+    def test_registry_keeps_a_client_per_credentials(self):
+        registry = ClientRegistry()
+        old_client = registry.get('https://foocompany.zendesk.com', 'Bob', 'a')
+        new_client = registry.get('https://foocompany.zendesk.com', 'Bob', 'b')
+
+        assert new_client is not old_client
+        assert new_client.password == 'b'
+        # Projects sharing the user with other passwords don't close each
+        # other's client, which may be in use
+        assert registry.get(
+            'https://foocompany.zendesk.com', 'Bob', 'a') is old_client
+        assert len(registry) == 2
+
+        old_client.last_used -= 3600
+        with self.settings(SENTRY_ZENDESK_POOL_IDLE_TIMEOUT=60):
+            registry.get('https://foocompany.zendesk.com', 'Bob', 'b')
+        assert len(registry) == 1
+
+    def test_registry_retires_idle_clients(self):
+        registry = ClientRegistry()
+        client = registry.get('https://foocompany.zendesk.com', 'Bob', 'bob1')
+        client.last_used -= 3600
+
+        with self.settings(SENTRY_ZENDESK_POOL_IDLE_TIMEOUT=60):
+            other = registry.get('https://barcompany.zendesk.com', 'Bob', 'x')
+
+        assert len(registry) == 1
+        assert registry.get(
+            'https://barcompany.zendesk.com', 'Bob', 'x') is other
+
+    @responses.activate
+    def test_session_is_reused_between_requests(self):
+        responses.add(
+            responses.GET, 'https://foocompany.zendesk.com/api/v2/search.json',
+            json={'results': []},
+            content_type='application/json',
+        )
+        with self.settings(SENTRY_ZENDESK_POOL_SIZE=3):
+            client = get_client('https://foocompany.zendesk.com', 'Bob', 'b')
+        client.search_tickets('foo')
+        session = client.session
+        client.search_tickets('bar')
+
+        assert client.session is session
+        assert session.get_adapter(client.zendesk_url)._pool_maxsize == 3
+        assert len(responses.calls) == 2
+
+    def _add_search_pages(self, pages, url):
+        calls = []
+
+        def search(request):
+            calls.append(request.url)
+            page = pages[(len(calls) - 1) % len(pages)]
+            return (200, {}, json.dumps(page))
+
+        responses.add_callback(
+            responses.GET, url,
+            callback=search,
+            content_type='application/json',
+        )
+        return calls
+
+    @responses.activate
+    def test_iter_tickets_fetches_pages_on_demand(self):
+        next_page = 'https://foocompany.zendesk.com/api/v2/search.json?page=2'
+        calls = self._add_search_pages([
+            {'results': [{'id': 1, 'subject': 'foo'},
+                         {'id': 2, 'subject': 'foo bar'}],
+             'next_page': next_page},
+            {'results': [{'id': 3, 'subject': 'foo baz'}],
+             'next_page': None},
+        ], 'https://foocompany.zendesk.com/api/v2/search.json')
+        client = get_client('https://foocompany.zendesk.com', 'Bob', 'b')
+
+        tickets = client.iter_tickets('foo', fields=['id'])
+        assert next(tickets) == {'id': 1}
+        assert len(calls) == 1
+        assert list(tickets) == [{'id': 2}, {'id': 3}]
+        assert calls[1] == next_page
+
+        # Pages beyond the limit are never fetched
+        assert [t['id'] for t in client.iter_tickets(
+            'foo', limit=2, prefetch=True)] == [1, 2]
+        assert len(calls) == 3
+
+    @responses.activate
+    def test_iter_tickets_with_cursor_and_prefetch(self):
+        next_page = ('https://foocompany.zendesk.com/api/v2/search/export.json'
+                     '?page[after]=abc')
+        calls = self._add_search_pages([
+            {'results': [{'id': 1}],
+             'links': {'next': next_page}, 'meta': {'has_more': True}},
+            {'results': [{'id': 2}],
+             'links': {'next': next_page}, 'meta': {'has_more': False}},
+        ], 'https://foocompany.zendesk.com/api/v2/search/export.json')
+        client = get_client('https://foocompany.zendesk.com', 'Bob', 'b')
+
+        tickets = client.iter_tickets('foo', cursor=True, prefetch=True)
+        assert next(tickets) == {'id': 1}
+        assert list(tickets) == [{'id': 2}]
+        assert 'filter%5Btype%5D=ticket' in calls[0]
+        assert len(calls) == 2
+
+    def _gzip(self, data):
+        buf = io.BytesIO()
+        with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+            f.write(data)
+        return buf.getvalue()
+
+    @responses.activate
+    def test_compressed_response_is_decoded_and_counted(self):
+        body = json.dumps({'ticket': {'id': 4178, 'subject': 'x' * 2000},
+                           'audit': {'events': ['y' * 5000]}})
+        compressed = self._gzip(body.encode('utf8'))
+        responses.add(
+            responses.POST,
+            'https://foocompany.zendesk.com/api/v2/tickets.json',
+            body=compressed, content_type='application/json',
+            adding_headers={'Content-Encoding': 'gzip'},
+        )
+        client = get_client('https://foocompany.zendesk.com', 'Bob', 'bob1')
+
+        with metrics.capture() as sink:
+            ticket_id = client.create_ticket('Foo', 'Bar', 'problem', None)
+
+        assert ticket_id == '4178'
+        request = responses.calls[0].request
+        assert 'gzip' in request.headers['Accept-Encoding']
+        tags = {'endpoint': '/api/v2/tickets.json', 'method': 'post'}
+        assert sink.count('sentry_zendesk.response.bytes', **tags) == len(body)
+        assert sink.count('sentry_zendesk.response.wire_bytes',
+                          **tags) == len(compressed)
+
+    @responses.activate
+    def test_read_response_is_counted(self):
+        body = json.dumps({'results': [{'id': 1, 'subject': 'x' * 2000}]})
+        compressed = self._gzip(body.encode('utf8'))
+        responses.add(
+            responses.GET,
+            'https://foocompany.zendesk.com/api/v2/search.json',
+            body=compressed, content_type='application/json',
+            adding_headers={'Content-Encoding': 'gzip'},
+        )
+        client = get_client('https://foocompany.zendesk.com', 'Bob', 'bob1')
+
+        with metrics.capture() as sink:
+            data = client.search_tickets('Foo')
+
+        assert data['results'][0]['id'] == 1
+        tags = {'endpoint': '/api/v2/search.json', 'method': 'get'}
+        assert sink.count('sentry_zendesk.response.bytes', **tags) == len(body)
+        assert sink.count('sentry_zendesk.response.wire_bytes',
+                          **tags) == len(compressed)
+
+    @responses.activate
+    def test_large_request_bodies_are_compressed(self):
+        responses.add(
+            responses.PUT,
+            'https://foocompany.zendesk.com/api/v2/tickets/update_many.json',
+            json={'job_status': {'id': '8b72'}},
+        )
+        responses.add(
+            responses.PUT,
+            'https://foocompany.zendesk.com/api/v2/tickets/1.json',
+            json={'ticket': {'id': 1}},
+        )
+        client = get_client('https://foocompany.zendesk.com', 'Bob', 'bob1')
+        comments = {'1': 'short', '2': 'long ' * 1000}
+
+        with self.settings(SENTRY_ZENDESK_COMPRESS_MIN_SIZE=1024):
+            with metrics.capture() as sink:
+                client.add_comments(comments)
+                client.add_comment('1', 'short')
+
+        bulk, single = [call.request for call in responses.calls]
+        assert bulk.headers['Content-Encoding'] == 'gzip'
+        body = gzip.GzipFile(fileobj=io.BytesIO(bulk.body)).read()
+        assert json.loads(body.decode('utf8'))['tickets'][1] == {
+            'id': 2, 'comment': {'body': comments['2']}}
+        assert sink.count('sentry_zendesk.request.bytes',
+                          method='put') == len(body) + len(single.body)
+        assert sink.count('sentry_zendesk.request.wire_bytes',
+                          method='put') == len(bulk.body) + len(single.body)
+        # Below the minimum size it isn't worth compressing
+        assert 'Content-Encoding' not in single.headers
+        assert json.loads(single.body.decode('utf8')) == {
+            'ticket': {'comment': {'body': 'short'}}}
+
+    @responses.activate
+    def test_request_bodies_are_not_compressed_by_default(self):
+        responses.add(
+            responses.PUT,
+            'https://foocompany.zendesk.com/api/v2/tickets/1.json',
+            json={'ticket': {'id': 1}},
+        )
+        client = get_client('https://foocompany.zendesk.com', 'Bob', 'bob1')
+
+        client.add_comment('1', 'long ' * 1000)
+
+        request = responses.calls[0].request
+        assert 'Content-Encoding' not in request.headers
+        assert request.headers['Content-Type'] == 'application/json'
@@ -0,0 +1,142 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+from sentry.testutils import TestCase
+from sentry.utils import json
+import mock
+import responses
+
+from sentry_zendesk.client import ZendeskClient
+from sentry_zendesk.comments import CommentBuffer, merge_comments
+
+
+class CommentBufferTest(TestCase):
+
+    def setUp(self):
+        super(CommentBufferTest, self).setUp()
+        self.client = ZendeskClient(
+            'https://foocompany.zendesk.com', 'Bob', 'bob123')
+
+    def _mock_job(self, job_status):
+        responses.add(
+            responses.GET,
+            'https://foocompany.zendesk.com/api/v2/job_statuses/abc.json',
+            json={'job_status': job_status},
+            content_type='application/json',
+        )
+
+    def test_merge_comments(self):
+        assert merge_comments(['a', 'b']) == 'a\n\nb'
+        merged = merge_comments([unicode(i) for i in range(25)])
+        assert merged.endswith('\n\n19\n\n(and 5 more)')
+
+    @responses.activate
+    def test_comments_of_same_ticket_are_merged(self):
+        responses.add(
+            responses.PUT,
+            'https://foocompany.zendesk.com/api/v2/tickets/123.json',
+            json={'ticket': {'id': 123}},
+            content_type='application/json',
+        )
+        buffer = CommentBuffer(interval=60)
+        buffer.add(self.client, 123, 'first')
+        buffer.add(self.client, '123', 'second')
+        assert buffer.pending_count() == 2
+        assert len(responses.calls) == 0
+
+        buffer.flush()
+        assert buffer.pending_count() == 0
+        assert len(responses.calls) == 1
+        assert json.loads(responses.calls[0].request.body) == {
+            'ticket': {'comment': {'body': 'first\n\nsecond'}}}
+
+    @responses.activate
+    def test_comments_of_many_tickets_are_sent_in_bulk(self):
+        responses.add(
+            responses.PUT,
+            'https://foocompany.zendesk.com/api/v2/tickets/update_many.json',
+            json={'job_status': {'id': 'abc', 'status': 'queued'}},
+            content_type='application/json',
+        )
+        self._mock_job({'id': 'abc', 'status': 'completed', 'results': [
+            {'id': 1, 'success': True}, {'id': 2, 'success': True}]})
+        buffer = CommentBuffer(interval=60)
+        buffer.add(self.client, 2, 'first')
+        buffer.add(self.client, 1, 'second')
+        buffer.add(self.client, 2, 'third')
+        buffer.flush_client(self.client)
+
+        # The job is checked once it's done
+        assert len(responses.calls) == 2
+        assert json.loads(responses.calls[0].request.body) == {'tickets': [
+            {'id': 1, 'comment': {'body': 'second'}},
+            {'id': 2, 'comment': {'body': 'first\n\nthird'}},
+        ]}
+
+    @responses.activate
+    def test_failures_of_bulk_job_are_logged(self):
+        responses.add(
+            responses.PUT,
+            'https://foocompany.zendesk.com/api/v2/tickets/update_many.json',
+            json={'job_status': {'id': 'abc', 'status': 'queued'}},
+            content_type='application/json',
+        )
+        self._mock_job({'id': 'abc', 'status': 'completed', 'results': [
+            {'id': 1, 'success': True},
+            {'id': 2, 'success': False, 'errors': 'Ticket is closed'}]})
+        buffer = CommentBuffer(interval=60)
+        buffer.add(self.client, 1, 'first')
+        buffer.add(self.client, 2, 'second')
+
+        with mock.patch('sentry_zendesk.comments.logger') as logger:
+            buffer.flush()
+        assert logger.error.call_count == 1
+        assert '[2]' in logger.error.call_args[0][0]
+        assert buffer.pending_count() == 0
+
+    @responses.activate
+    def test_comments_are_sent_again_while_zendesk_is_unavailable(self):
+        responses.add(
+            responses.PUT,
+            'https://foocompany.zendesk.com/api/v2/tickets/123.json',
+            body='Unavailable', status=503,
+        )
+        buffer = CommentBuffer(interval=60)
+        buffer.add(self.client, 123, 'first')
+        buffer.flush()
+        assert len(responses.calls) == 1
+
+        # Failed comments go first
+        buffer.add(self.client, 123, 'second')
+        assert buffer.pending_count() == 2
+        buffer.flush()
+        assert len(responses.calls) == 2
+        assert json.loads(responses.calls[1].request.body) == {
+            'ticket': {'comment': {'body': 'first\n\nsecond'}}}
+
+        # And are dropped after a few attempts
+        buffer.flush()
+        assert buffer.pending_count() == 0
+
+    @responses.activate
+    def test_zero_interval_sends_right_away(self):
+        responses.add(
+            responses.PUT,
+            'https://foocompany.zendesk.com/api/v2/tickets/123.json',
+            json={'ticket': {'id': 123}},
+            content_type='application/json',
+        )
+        CommentBuffer(interval=0).add(self.client, 123, 'hello')
+        assert len(responses.calls) == 1
+
+    @responses.activate
+    def test_failures_are_logged(self):
+        responses.add(
+            responses.PUT,
+            'https://foocompany.zendesk.com/api/v2/tickets/123.json',
+            body='Error', status=422,
+        )
+        buffer = CommentBuffer(interval=60)
+        buffer.add(self.client, 123, 'hello')
+        # Should not raise
+        buffer.flush()
+        assert buffer.pending_count() == 0
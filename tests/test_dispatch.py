@@ -0,0 +1,70 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+import threading
+
+from sentry.testutils import TestCase
+
+from sentry_zendesk.dispatch import Dispatcher
+
+
+class DispatcherTest(TestCase):
+
+    def _blocked_dispatcher(self, overflow):
+        """
+        Dispatcher whose single worker is stuck, with a queue of one item
+        which is already taken.
+        """
+        release = threading.Event()
+        started = threading.Event()
+
+        def block(item):
+            started.set()
+            release.wait()
+
+        dispatcher = Dispatcher(workers=1, queue_size=1, overflow=overflow)
+        dispatcher.submit(block, 'first')
+        started.wait()
+        dispatcher.submit(block, 'second')
+        self.addCleanup(release.set)
+        return dispatcher
+
+    def test_runs_work_in_background(self):
+        processed = []
+        threads = set()
+
+        def process(i):
+            threads.add(threading.current_thread().name)
+            processed.append(i)
+
+        dispatcher = Dispatcher(workers=2, queue_size=10, overflow='block')
+        for i in range(5):
+            dispatcher.submit(process, i)
+        dispatcher.join()
+
+        assert sorted(processed) == list(range(5))
+        assert threading.current_thread().name not in threads
+
+    def test_drop_when_queue_is_full(self):
+        processed = []
+        dispatcher = self._blocked_dispatcher('drop')
+        dispatcher.submit(processed.append, 'third')
+
+        assert processed == []
+        assert dispatcher.dropped == 1
+
+    def test_spill_runs_inline_when_queue_is_full(self):
+        processed = []
+        dispatcher = self._blocked_dispatcher('spill')
+        dispatcher.submit(processed.append, 'third')
+
+        assert processed == ['third']
+        assert dispatcher.spilled == 1
+
+    def test_block_drops_after_timeout(self):
+        processed = []
+        dispatcher = self._blocked_dispatcher('block')
+        with self.settings(SENTRY_ZENDESK_DISPATCH_BLOCK_TIMEOUT=0.01):
+            dispatcher.submit(processed.append, 'third')
+
+        assert processed == []
+        assert dispatcher.dropped == 1
@@ -0,0 +1,86 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+import threading
+import time
+
+from sentry.testutils import TestCase
+from sentry.utils import json
+from sentry_plugins.exceptions import ApiError
+import pytest
+import responses
+
+from sentry_zendesk.client import ZendeskClient
+from sentry_zendesk.fanout import ConcurrentClient
+
+
+class ConcurrentClientTest(TestCase):
+
+    def setUp(self):
+        super(ConcurrentClientTest, self).setUp()
+        self.client = ZendeskClient(
+            'https://foocompany.zendesk.com', 'Bob', 'bob123', pool_size=3)
+
+    def test_concurrency_defaults_to_pool_size(self):
+        assert ConcurrentClient(self.client).concurrency == 3
+        assert ConcurrentClient(self.client, 5).concurrency == 5
+
+    @responses.activate
+    def test_create_tickets_concurrently(self):
+        def create(request):
+            subject = json.loads(request.body)['ticket']['subject']
+            return 201, {}, json.dumps({'ticket': {'id': int(subject)}})
+
+        responses.add_callback(
+            responses.POST,
+            'https://foocompany.zendesk.com/api/v2/tickets.json',
+            callback=create, content_type='application/json')
+
+        with ConcurrentClient(self.client) as concurrent:
+            pending = concurrent.create_ticket(
+                title='1', comment='', ticket_type='problem', problem_id=None)
+            assert pending.get() == '1'
+            ticket_ids = concurrent.map('create_ticket', [
+                (unicode(i), '', 'problem', None) for i in range(2, 7)])
+        assert ticket_ids == ['2', '3', '4', '5', '6']
+        assert len(responses.calls) == 6
+
+    def test_limits_concurrency(self):
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        def work(i):
+            with lock:
+                running.append(i)
+                peak.append(len(running))
+            time.sleep(0.01)
+            with lock:
+                running.remove(i)
+            return i
+
+        with ConcurrentClient(self.client, concurrency=2) as concurrent:
+            results = concurrent.gather(
+                [concurrent.submit(work, i) for i in range(6)])
+        assert results == list(range(6))
+        assert max(peak) == 2
+
+    @responses.activate
+    def test_gather_errors(self):
+        responses.add(
+            responses.GET,
+            'https://foocompany.zendesk.com/api/v2/search.json',
+            body='Error', status=400)
+
+        with ConcurrentClient(self.client) as concurrent:
+            with pytest.raises(ApiError):
+                concurrent.gather([concurrent.search_tickets('foo')])
+            results = concurrent.map(
+                'search_tickets', [{'query': 'bar'}], return_exceptions=True)
+        assert isinstance(results[0], ApiError)
+
+    def test_closed(self):
+        concurrent = ConcurrentClient(self.client)
+        concurrent.submit(int).get()
+        concurrent.close()
+        with pytest.raises(ValueError):
+            concurrent.submit(int)
@@ -0,0 +1,95 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+from sentry.testutils import TestCase
+from sentry.utils import json
+import responses
+
+from sentry_zendesk.client import ZendeskClient
+from sentry_zendesk.index import TicketIndex
+
+
+def ticket(id, subject, status='open'):
+    return {'id': id, 'subject': subject, 'type': 'problem', 'status': status}
+
+
+class TicketIndexTest(TestCase):
+
+    def test_search_by_prefix_and_substring(self):
+        index = TicketIndex()
+        index.update([ticket(1, 'Cannot run foo'),
+                      ticket(2, 'Problem running bar with foo')])
+
+        assert [t['id'] for t in index.search('run')] == [2, 1]
+        assert [t['id'] for t in index.search('RUNNING')] == [2]
+        assert [t['id'] for t in index.search('ning bar')] == [2]
+        assert [t['id'] for t in index.search('ca')] == [1]
+        assert index.search('baz') == []
+
+    def test_update_and_delete_tickets(self):
+        index = TicketIndex()
+        index.update([ticket(1, 'Cannot run foo'), ticket(2, 'Bar')])
+        index.update([ticket(1, 'Cannot run baz'),
+                      ticket(2, 'Bar', status='deleted')])
+
+        assert index.search('foo') == []
+        assert index.search('bar') == []
+        assert index.search('baz') == [ticket(1, 'Cannot run baz')]
+        assert len(index) == 1
+
+    def test_drop_least_recently_updated_over_budget(self):
+        index = TicketIndex(max_tickets=2)
+        index.update([ticket(1, 'foo 1'), ticket(2, 'foo 2')])
+        index.update([ticket(1, 'foo 1'), ticket(3, 'foo 3')])
+
+        assert [t['id'] for t in index.search('foo')] == [3, 1]
+        assert not index.complete
+
+    @responses.activate
+    def test_sync_from_incremental_export(self):
+        pages = iter([
+            {'tickets': [ticket(1, 'foo')], 'after_cursor': 'a',
+             'end_of_stream': False},
+            {'tickets': [ticket(2, 'bar')], 'after_cursor': 'b',
+             'end_of_stream': True},
+            {'tickets': [ticket(1, 'baz')], 'after_cursor': 'c',
+             'end_of_stream': True},
+        ])
+        responses.add_callback(
+            responses.GET,
+            'https://foocompany.zendesk.com/api/v2/incremental/tickets/'
+            'cursor.json',
+            callback=lambda request: (200, {}, json.dumps(next(pages))),
+            content_type='application/json',
+        )
+        client = ZendeskClient('https://foocompany.zendesk.com', 'Bob', 'b')
+        index = TicketIndex()
+        assert not index.warm
+
+        index.sync(client)
+        assert index.warm
+        assert index.cursor == 'b'
+        assert 'start_time=0' in responses.calls[0].request.url
+        assert 'cursor=a' in responses.calls[1].request.url
+
+        index.sync(client)
+        assert 'cursor=b' in responses.calls[2].request.url
+        assert [t['subject'] for t in index.search('ba')] == ['baz', 'bar']
+
+    @responses.activate
+    def test_sync_stops_once_over_budget(self):
+        responses.add(
+            responses.GET,
+            'https://foocompany.zendesk.com/api/v2/incremental/tickets/'
+            'cursor.json',
+            json={'tickets': [ticket(1, 'foo'), ticket(2, 'bar')],
+                  'after_cursor': 'a', 'end_of_stream': False},
+            content_type='application/json',
+        )
+        client = ZendeskClient('https://foocompany.zendesk.com', 'Bob', 'b')
+        index = TicketIndex(max_tickets=1)
+
+        index.sync(client)
+        index.sync(client)
+        assert len(responses.calls) == 1
+        assert not index.warm
+        assert len(index) == 0
@@ -0,0 +1,119 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+import threading
+import time
+
+from sentry.testutils import TestCase
+import mock
+import pytest
+
+from sentry_zendesk.leases import LeaseManager, LeaseTimeout
+
+
+class LeaseManagerTest(TestCase):
+
+    def test_concurrent_workers_create_once(self):
+        leases = LeaseManager('local')
+        created = []
+        release = threading.Event()
+
+        def create():
+            release.wait()
+            created.append('1234')
+            return '1234'
+
+        def lookup():
+            return created[0] if created else None
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(
+                leases.run_once('problem:1', lookup, create)))
+            for i in range(4)
+        ]
+        with mock.patch('sentry_zendesk.leases.POLL_INTERVAL', 0.01):
+            for thread in threads:
+                thread.start()
+            release.set()
+            for thread in threads:
+                thread.join()
+
+        assert created == ['1234']
+        assert results == ['1234'] * 4
+
+    def test_existing_result_is_reused(self):
+        leases = LeaseManager('local')
+        create = mock.Mock()
+
+        assert leases.run_once('problem:1', lambda: '1234', create) == '1234'
+        assert not create.called
+
+    def test_takes_over_when_holder_fails(self):
+        leases = LeaseManager('local')
+
+        def fail():
+            raise ValueError('boom')
+
+        with pytest.raises(ValueError):
+            leases.run_once('problem:1', lambda: None, fail)
+        assert leases.run_once('problem:1', lambda: None, lambda: '1') == '1'
+
+    def test_gives_up_waiting_for_holder(self):
+        leases = LeaseManager('local')
+        assert leases.backend.acquire('sentry_zendesk:lease:problem:1', 30)
+        create = mock.Mock()
+
+        with pytest.raises(LeaseTimeout):
+            leases.run_once('problem:1', lambda: None, create, max_wait=0)
+        assert not create.called
+        # Other keys are not affected
+        assert leases.run_once('problem:2', lambda: None, lambda: '2') == '2'
+
+    def test_lease_is_renewed_while_creating(self):
+        leases = LeaseManager('local')
+        key = 'sentry_zendesk:lease:problem:1'
+
+        def create():
+            # Outlasts the lease several times over
+            time.sleep(0.8)
+            assert leases.backend.acquire(key, 0.1) is None
+            return '1234'
+
+        with self.settings(SENTRY_ZENDESK_LEASE_DURATION=0.2):
+            assert leases.run_once('problem:1', lambda: None, create) == '1234'
+        assert leases.backend.acquire(key, 30)
+
+    def _check_backend(self, backend):
+        key = 'sentry_zendesk:lease:test'
+
+        token = backend.acquire(key, 5)
+        assert token
+        try:
+            assert backend.acquire(key, 5) is None
+            assert backend.extend(key, token, 5)
+            assert not backend.extend(key, 'other', 5)
+            # Only the holder can release it
+            backend.release(key, 'other')
+            assert backend.acquire(key, 5) is None
+        finally:
+            backend.release(key, token)
+
+        # An expired lease taken over is not released by its former holder
+        expired = backend.acquire(key, 0.01)
+        time.sleep(0.05)
+        token = backend.acquire(key, 5)
+        assert token
+        assert not backend.extend(key, expired, 5)
+        backend.release(key, expired)
+        assert backend.acquire(key, 5) is None
+        backend.release(key, token)
+        assert backend.acquire(key, 5)
+
+    def test_local_backend_leases_are_owned(self):
+        self._check_backend(LeaseManager('local').backend)
+
+    def test_sentry_backend_leases_are_owned(self):
+        backend = LeaseManager('sentry').backend
+        self.addCleanup(backend.cluster.get_local_client_for_key(
+            'sentry_zendesk:lease:test').delete, 'sentry_zendesk:lease:test')
+        self._check_backend(backend)
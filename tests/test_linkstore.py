@@ -0,0 +1,102 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+from exam import fixture
+from sentry.models import GroupMeta
+from sentry.testutils import TestCase
+import mock
+
+from sentry_zendesk.caching import links
+from sentry_zendesk.linkstore import LinkStore
+from sentry_zendesk.models import TicketLink
+
+
+class LinkStoreTest(TestCase):
+
+    @fixture
+    def store(self):
+        return LinkStore('sentry_zendesk:tid')
+
+    def _stored(self):
+        return dict(GroupMeta.objects.filter(
+            key='sentry_zendesk:tid').values_list('group_id', 'value'))
+
+    def _indexed(self):
+        return dict(TicketLink.objects.values_list('group_id', 'ticket_id'))
+
+    def test_get_many_loads_missing_groups_with_a_single_query(self):
+        groups = [self.create_group(message='Hello %d' % i,
+                                    culprit='foo.bar%d' % i)
+                  for i in range(5)]
+        GroupMeta.objects.set_value(groups[0], 'sentry_zendesk:tid', '100')
+        links.set(groups[1].id, '101')
+
+        with self.assertNumQueries(1):
+            linked = self.store.get_many([group.id for group in groups])
+        assert linked == {
+            groups[0].id: '100', groups[1].id: '101', groups[2].id: None,
+            groups[3].id: None, groups[4].id: None}
+        with self.assertNumQueries(0):
+            assert self.store.get(groups[4].id) is None
+
+    def test_set_many_creates_updates_and_unlinks(self):
+        groups = [self.create_group(message='Hello %d' % i,
+                                    culprit='foo.bar%d' % i)
+                  for i in range(4)]
+        self.store.set_many(self.project.id, {
+            groups[0].id: 100, groups[1].id: 101, groups[2].id: 102})
+
+        self.store.set_many(self.project.id, {
+            groups[0].id: 200, groups[1].id: None, groups[2].id: 102,
+            groups[3].id: 200})
+
+        expected = {groups[0].id: '200', groups[2].id: '102',
+                    groups[3].id: '200'}
+        assert self._stored() == expected
+        assert self._indexed() == expected
+        links.clear()
+        assert self.store.get_many([group.id for group in groups]) == dict(
+            expected, **{groups[1].id: None})
+
+    def test_set_many_keeps_existing_links_without_overwrite(self):
+        linked = self.create_group(message='Hello', culprit='foo.bar')
+        not_linked = self.create_group(message='World', culprit='foo.baz')
+        self.store.set(self.project.id, linked.id, '100')
+
+        written = self.store.set_many(
+            self.project.id, {linked.id: '200', not_linked.id: '201'},
+            overwrite=False)
+
+        assert written == {not_linked.id: '201'}
+        assert self._stored() == {linked.id: '100', not_linked.id: '201'}
+        assert self.store.get(linked.id) == '100'
+
+    def test_set_many_keeps_concurrent_links_without_overwrite(self):
+        linked = self.create_group(message='Hello', culprit='foo.bar')
+        not_linked = self.create_group(message='World', culprit='foo.baz')
+
+        def link_meanwhile(*args, **kwargs):
+            # Linked by someone else after the existing links were read
+            GroupMeta.objects.create(
+                group=linked, key='sentry_zendesk:tid', value='100')
+            TicketLink.objects.create(
+                project=self.project, group=linked, ticket_id='100')
+            return GroupMeta.objects.none()
+
+        with mock.patch.object(GroupMeta.objects, 'filter',
+                               side_effect=link_meanwhile):
+            written = self.store.set_many(
+                self.project.id, {linked.id: '200', not_linked.id: '201'},
+                overwrite=False)
+
+        assert written == {not_linked.id: '201'}
+        assert self._stored() == {linked.id: '100', not_linked.id: '201'}
+        assert self._indexed() == {linked.id: '100', not_linked.id: '201'}
+        assert self.store.get(linked.id) == '100'
+
+    def test_set_many_skips_unchanged_links(self):
+        group = self.create_group(message='Hello', culprit='foo.bar')
+        self.store.set(self.project.id, group.id, '100')
+
+        # Only reads the existing links
+        with self.assertNumQueries(1):
+            self.store.set_many(self.project.id, {group.id: 100})
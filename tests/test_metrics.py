@@ -0,0 +1,34 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+from sentry.testutils import TestCase
+import pytest
+
+from sentry_zendesk import metrics
+
+
+class MetricsTest(TestCase):
+
+    def test_capture_timer_and_counters(self):
+        with metrics.capture() as sink:
+            with metrics.timer('foo', project=1) as tags:
+                tags['status'] = 200
+            with pytest.raises(ValueError):
+                with metrics.timer('foo', project=1):
+                    raise ValueError()
+            metrics.incr('bar', ticket_type='problem')
+            metrics.incr('bar', amount=2, ticket_type='incident')
+
+        assert len(sink.timed('sentry_zendesk.foo', result='success',
+                              status=200)) == 1
+        assert len(sink.timed('sentry_zendesk.foo', result='failure')) == 1
+        assert sink.count('sentry_zendesk.bar') == 3
+        assert sink.count('sentry_zendesk.bar', ticket_type='incident') == 2
+        assert metrics.sink is not sink
+
+    def test_endpoint_without_ids(self):
+        assert metrics.endpoint(
+            'https://foocompany.zendesk.com/api/v2/job_statuses/8b72.json'
+        ) == '/api/v2/job_statuses/{id}.json'
+        assert metrics.endpoint(
+            'https://foocompany.zendesk.com/api/v2/search.json?page=2'
+        ) == '/api/v2/search.json'
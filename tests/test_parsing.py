@@ -0,0 +1,82 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+from sentry.testutils import TestCase
+from sentry.utils import json
+import mock
+import requests
+import responses
+
+from sentry_zendesk import parsing
+from sentry_zendesk.parsing import project
+
+
+search_body = json.dumps({
+    'results': [
+        {'id': 1, 'subject': 'foo', 'via': {'source': {'subject': 'x'}},
+         'tags': ['a']},
+        {'id': 2, 'subject': None},
+    ],
+    'next_page': 'https://foocompany.zendesk.com/api/v2/search.json?page=2',
+    'count': 102,
+})
+
+
+class ProjectTest(TestCase):
+
+    def _project(self, body, *args, **kwargs):
+        """
+        Projects the body both streaming (with ijson) and by decoding the
+        whole document (without it), checking both give the same result.
+        """
+        responses.add(
+            responses.GET, 'https://foocompany.zendesk.com/foo.json',
+            body=body,
+            content_type='application/json',
+        )
+        streamed = project(
+            requests.get('https://foocompany.zendesk.com/foo.json',
+                         stream=True), *args, **kwargs)
+        with mock.patch.object(parsing, 'ijson', None):
+            decoded = project(
+                requests.get('https://foocompany.zendesk.com/foo.json',
+                             stream=True), *args, **kwargs)
+        assert streamed == decoded
+        return streamed
+
+    @responses.activate
+    def test_project_items_and_fields(self):
+        assert self._project(search_body, ['next_page', 'count', 'missing'],
+                             items=('results', ['id', 'subject'])) == {
+            'results': [{'id': 1, 'subject': 'foo'},
+                        {'id': 2, 'subject': None}],
+            'next_page':
+                'https://foocompany.zendesk.com/api/v2/search.json?page=2',
+            'count': 102,
+            'missing': None,
+        }
+
+    @responses.activate
+    def test_project_nested_field(self):
+        body = json.dumps(
+            {'ticket': {'id': 5, 'via': {'id': 6}}, 'audit': {'id': 7}})
+
+        assert self._project(body, ['ticket.id']) == {'ticket.id': 5}
+
+    @responses.activate
+    def test_read_whole_body_after_stopping_early(self):
+        # Bigger than what the parser reads at once
+        body = json.dumps({'ticket': {'id': 5}, 'via': ['x' * 10] * 20000})
+        responses.add(
+            responses.GET, 'https://foocompany.zendesk.com/foo.json',
+            body=body,
+            content_type='application/json',
+            stream=True,
+        )
+        response = requests.get('https://foocompany.zendesk.com/foo.json',
+                                stream=True)
+        read = []
+        close = response.close
+        response.close = lambda: (read.append(response.raw.tell()), close())
+
+        assert project(response, ['ticket.id']) == {'ticket.id': 5}
+        assert read == [len(body)]
@@ -1,5 +1,7 @@
 from __future__ import absolute_import, print_function, unicode_literals
 
+import shutil
+import tempfile
 from urllib import urlencode
 
 from django.test import RequestFactory
@@ -7,6 +9,7 @@ from exam import fixture
 from sentry.testutils import TestCase
 from sentry.utils import json
 from sentry_plugins.exceptions import ApiError
+import mock
 import pytest
 import responses
 
@@ -43,6 +46,25 @@ class ZendeskPluginTest(TestCase):
             'zendesk_url', 'https://foocompany.zendesk.com', self.project)
         assert self.plugin.is_configured(None, self.project) is True
 
+    def test_project_config_is_cached_until_saved(self):
+        from sentry.models import ProjectOption
+
+        self._configure_plugin()
+        config = self.plugin.get_project_config(self.project)
+        assert config.zendesk_url == 'https://foocompany.zendesk.com'
+        assert config.username == 'Bob'
+        assert config.auto_create_problems is None
+
+        with mock.patch.object(ProjectOption.objects, 'get_all_values') as m:
+            assert self.plugin.get_project_config(self.project) is config
+            self.plugin.is_configured(None, self.project)
+            self.plugin.get_client(self.project)
+        assert not m.called
+
+        self.plugin.set_option('auto_create_problems', True, self.project)
+        assert self.plugin.get_project_config(
+            self.project).auto_create_problems is True
+
     @responses.activate
     def test_dont_create_problem_after_event_when_option_is_disabled(self):
         self._configure_plugin()
@@ -118,6 +140,137 @@ class ZendeskPluginTest(TestCase):
         assert self._get_linked_ticket_id(group) == unicode(
             create_problem_response['ticket']['id'])
 
+    @responses.activate
+    def test_create_problem_reuses_ticket_of_concurrent_worker(self):
+        from sentry_zendesk.leases import leases
+
+        self._configure_plugin()
+        self.plugin.set_option('auto_create_problems', True, self.project)
+        group = self.create_group(message='Hello world', culprit='foo.bar')
+        key = 'sentry_zendesk:lease:problem:{}'.format(group.id)
+        token = leases.backend.acquire(key, 30)
+        assert token
+
+        def other_worker_finishes(seconds):
+            self.plugin._set_linked_ticket(group, '999')
+            leases.backend.release(key, token)
+
+        with mock.patch('sentry_zendesk.leases.time.sleep',
+                        side_effect=other_worker_finishes):
+            self._process_new_event(group)
+
+        assert len(responses.calls) == 0
+        assert self._get_linked_ticket_id(group) == '999'
+
+    @responses.activate
+    def test_create_problem_gives_up_while_other_worker_creates_it(self):
+        from sentry_zendesk.leases import leases
+
+        self._configure_plugin()
+        self.plugin.set_option('auto_create_problems', True, self.project)
+        group = self.create_group(message='Hello world', culprit='foo.bar')
+        key = 'sentry_zendesk:lease:problem:{}'.format(group.id)
+        token = leases.backend.acquire(key, 30)
+        assert token
+
+        try:
+            with self.settings(SENTRY_ZENDESK_LEASE_MAX_WAIT=0):
+                self._process_new_event(group)
+        finally:
+            leases.backend.release(key, token)
+
+        assert len(responses.calls) == 0
+        assert self.plugin._get_linked_ticket(group) is None
+
+    @responses.activate
+    def test_problem_is_spooled_and_replayed_when_zendesk_is_down(self):
+        from sentry_zendesk.client import is_transient_error
+        from sentry_zendesk.spool import spool
+
+        self._configure_plugin()
+        self.plugin.set_option('auto_create_problems', True, self.project)
+        group = self.create_group(message='Hello world', culprit='foo.bar')
+        responses.add(
+            responses.POST,
+            'https://foocompany.zendesk.com/api/v2/tickets.json',
+            status=503,
+        )
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        with self.settings(SENTRY_ZENDESK_SPOOL_DIR=directory), \
+                mock.patch('sentry_zendesk.spool.replayer.start') as start:
+            self.plugin.post_process(
+                group, event=self.event, is_new=True, is_sample=False)
+            assert start.called
+            assert self.plugin._get_linked_ticket(group) is None
+
+            responses.reset()
+            responses.add(
+                responses.POST,
+                'https://foocompany.zendesk.com/api/v2/tickets.json',
+                json=create_problem_response,
+            )
+            assert spool.replay(self.plugin._replay_spooled_ticket,
+                                is_transient_error) == 1
+
+        sent_data = json.loads(responses.calls[0].request.body)
+        assert sent_data['ticket']['type'] == 'problem'
+        assert self._get_linked_ticket_id(group) == unicode(
+            create_problem_response['ticket']['id'])
+
+    @responses.activate
+    def test_create_problem_with_templates(self):
+        self._configure_plugin()
+        self.plugin.set_option('auto_create_problems', True, self.project)
+        self.plugin.set_option('subject_template', '[{project}] {title}',
+                               self.project)
+        self.plugin.set_option('ticket_tags', 'sentry {level}', self.project)
+        self.plugin.set_option('ticket_priority', 'urgent', self.project)
+        self.plugin.set_option('custom_fields', '123: {culprit}',
+                               self.project)
+        group = self.create_group(message='Hello world', culprit='foo.bar')
+
+        self._process_new_event(group)
+
+        sent_data = json.loads(responses.calls[0].request.body)
+        assert sent_data['ticket'] == {
+            'comment': '[http://testserver/baz/bar/issues/1/](http://testserver/baz/bar/issues/1/)',  # noqa
+            'type': 'problem',
+            'subject': '[bar] ' + self.event.error(),
+            'tags': ['sentry', 'error'],
+            'priority': 'urgent',
+            'custom_fields': [{'id': 123, 'value': 'foo.bar'}],
+        }
+
+    def test_invalid_template_is_refused(self):
+        from sentry.exceptions import PluginError
+        from sentry_zendesk.plugin import validate_template
+
+        with pytest.raises(PluginError):
+            validate_template('{foo}')
+        assert validate_template('') is None
+
+    @responses.activate
+    def test_metrics_of_ticket_creation(self):
+        from sentry_zendesk import metrics
+
+        self._configure_plugin()
+        self.plugin.set_option('auto_create_problems', True, self.project)
+        group = self.create_group(message='Hello world', culprit='foo.bar')
+
+        with metrics.capture() as sink:
+            self._process_new_event(group)
+
+        assert len(sink.timed('sentry_zendesk.post_process',
+                              project=self.project.id)) == 1
+        assert len(sink.timed('sentry_zendesk.create_ticket',
+                              ticket_type='problem')) == 1
+        assert len(sink.timed('sentry_zendesk.request',
+                              endpoint='/api/v2/tickets.json',
+                              status=200)) == 1
+        assert sink.count('sentry_zendesk.link_cache.miss') == 1
+
     def _process_new_event(self, group):
         responses.add(
             responses.POST,
@@ -201,6 +354,59 @@ class ZendeskPluginTest(TestCase):
         # sentry issue
         assert self._get_linked_ticket_id(group) == '12345'
 
+    @responses.activate
+    def test_throttled_incidents_count_skipped_events(self):
+        from sentry.models.groupmeta import GroupMeta
+
+        self._configure_plugin()
+        self.plugin.set_option('auto_create_incidents', True, self.project)
+        self.plugin.set_option('incident_every', 3, self.project)
+        group = self.create_group(message='Hello world', culprit='foo.bar')
+        GroupMeta.objects.set_value(group,
+                                    '%s:tid' % self.plugin.get_conf_key(),
+                                    '12345')
+
+        for i in range(4):
+            self._process_repeated_event(group)
+
+        assert len(responses.calls) == 2
+        comments = [json.loads(call.request.body)['ticket']['comment']
+                    for call in responses.calls]
+        assert 'skipped' not in comments[0]
+        assert comments[1].endswith(
+            '2 events of this issue were skipped since the previous '
+            'incident.')
+
+    @responses.activate
+    def test_sampled_out_events_dont_create_incidents(self):
+        from sentry.models.groupmeta import GroupMeta
+
+        self._configure_plugin()
+        self.plugin.set_option('auto_create_incidents', True, self.project)
+        self.plugin.set_option('incident_sampled_only', True, self.project)
+        group = self.create_group(message='Hello world', culprit='foo.bar')
+        GroupMeta.objects.set_value(group,
+                                    '%s:tid' % self.plugin.get_conf_key(),
+                                    '12345')
+        responses.add(
+            responses.POST,
+            'https://foocompany.zendesk.com/api/v2/tickets.json',
+            json=create_incident_response,
+            content_type='application/json',
+        )
+
+        self.plugin.post_process(
+            group, event=self.event, is_new=False, is_sample=True)
+        assert len(responses.calls) == 0
+
+        self.plugin.post_process(
+            group, event=self.event, is_new=False, is_sample=False)
+        assert len(responses.calls) == 1
+        assert json.loads(responses.calls[0].request.body)['ticket'][
+            'comment'].endswith(
+                '1 events of this issue were skipped since the previous '
+                'incident.')
+
     @responses.activate
     def test_create_incident_after_event_raises_on_http_error(self):
         from sentry.models.groupmeta import GroupMeta
@@ -249,6 +455,128 @@ class ZendeskPluginTest(TestCase):
         assert self._get_linked_ticket_id(group) == unicode(
             create_problem_response['ticket']['id'])
 
+    @responses.activate
+    def test_create_problem_in_background_when_dispatch_is_enabled(self):
+        from sentry_zendesk.dispatch import WorkItem, dispatcher
+
+        self._configure_plugin()
+        self.plugin.set_option('auto_create_problems', True, self.project)
+        group = self.create_group(message='Hello world', culprit='foo.bar')
+        event = self.create_event(group=group)
+
+        submitted = []
+
+        def submit(handler, item):
+            submitted.append(item)
+
+        with self.settings(SENTRY_ZENDESK_DISPATCH_WORKERS=1), \
+                mock.patch.object(dispatcher, 'submit', submit):
+            self.plugin.post_process(
+                group, event=event, is_new=True, is_sample=False)
+
+        # Only the work item is queued, Zendesk isn't reached
+        assert len(responses.calls) == 0
+        assert submitted == [WorkItem(group_id=group.id, event_id=event.id,
+                                      ticket_type='problem', problem_id=None,
+                                      skipped=0)]
+
+        responses.add(
+            responses.POST,
+            'https://foocompany.zendesk.com/api/v2/tickets.json',
+            json=create_problem_response,
+            content_type='application/json',
+        )
+        self.plugin._process_work_item(submitted[0])
+
+        assert len(responses.calls) == 1
+        assert self._get_linked_ticket_id(group) == unicode(
+            create_problem_response['ticket']['id'])
+
+    @responses.activate
+    def test_work_item_of_unsaved_event_is_built_from_group(self):
+        from sentry_zendesk.dispatch import WorkItem
+
+        self._configure_plugin()
+        group = self.create_group(message='Hello world', culprit='foo.bar')
+        responses.add(
+            responses.POST,
+            'https://foocompany.zendesk.com/api/v2/tickets.json',
+            json=create_problem_response,
+            content_type='application/json',
+        )
+
+        # Sampled events are never saved
+        self.plugin._process_work_item(WorkItem(
+            group_id=group.id, event_id=None, ticket_type='problem',
+            problem_id=None, skipped=0))
+
+        assert len(responses.calls) == 1
+        assert self._get_linked_ticket_id(group) == unicode(
+            create_problem_response['ticket']['id'])
+
+    @responses.activate
+    def test_batch_incidents_when_window_is_configured(self):
+        from sentry.models.groupmeta import GroupMeta
+        from sentry_zendesk.batching import incidents
+
+        self._configure_plugin()
+        self.plugin.set_option('auto_create_incidents', True, self.project)
+        group = self.create_group(message='Hello world', culprit='foo.bar')
+        GroupMeta.objects.set_value(group,
+                                    '%s:tid' % self.plugin.get_conf_key(),
+                                    '12345')
+
+        with self.settings(SENTRY_ZENDESK_INCIDENT_BATCH_WINDOW=60):
+            self.plugin.post_process(
+                group, event=self.event, is_new=False, is_sample=False)
+            assert len(responses.calls) == 0
+            assert incidents.pending_count() == 1
+
+            responses.add(
+                responses.POST,
+                'https://foocompany.zendesk.com/api/v2/tickets.json',
+                json=create_incident_response,
+                content_type='application/json',
+            )
+            incidents.flush()
+
+        # A lone pending incident is created through the single ticket path
+        assert len(responses.calls) == 1
+        assert incidents.pending_count() == 0
+
+    @responses.activate
+    def test_linked_ticket_is_cached_between_events(self):
+        from sentry.models.groupmeta import GroupMeta
+
+        self._configure_plugin()
+        self.plugin.set_option('auto_create_problems', True, self.project)
+        self.plugin.set_option('auto_create_incidents', True, self.project)
+        group = self.create_group(message='Hello world', culprit='foo.bar')
+
+        self._process_new_event(group)
+        with mock.patch.object(GroupMeta.objects, 'populate_cache') as m:
+            self._process_repeated_event(group)
+            self._process_repeated_event(group)
+
+        assert not m.called
+        assert len(responses.calls) == 3
+
+    def test_get_linked_tickets_of_many_groups(self):
+        from sentry.models.groupmeta import GroupMeta
+
+        linked = self.create_group(message='Hello world', culprit='foo.bar')
+        not_linked = self.create_group(message='Hello', culprit='foo.baz')
+        GroupMeta.objects.set_value(linked,
+                                    '%s:tid' % self.plugin.get_conf_key(),
+                                    '12345')
+
+        assert self.plugin.get_linked_tickets([linked, not_linked]) == {
+            linked.id: '12345', not_linked.id: None}
+        # Both, including the group without a ticket, are cached now
+        with self.assertNumQueries(0):
+            assert self.plugin._get_linked_ticket(linked) == '12345'
+            assert self.plugin._get_linked_ticket(not_linked) is None
+
     @responses.activate
     def test_search_when_autocompleting(self):
         self._configure_plugin()
@@ -276,6 +604,145 @@ class ZendeskPluginTest(TestCase):
         assert urlencode({'query': 'type:ticket subject:foo*'}
                          ) in responses.calls[0].request.url
 
+    @responses.activate
+    def test_autocomplete_without_query(self):
+        self._configure_plugin()
+        group = self.create_group(message='Hello world', culprit='foo.bar')
+
+        responses.add(
+            responses.GET, 'https://foocompany.zendesk.com/api/v2/search.json',
+            json=search_response,
+            content_type='application/json',
+        )
+        request = self.request.get(
+            '/', data={'autocomplete_field': 'issue_id'})
+
+        assert len(self.plugin.view_autocomplete(
+            request, group).data['issue_id']) == 2
+
+    @responses.activate
+    def test_autocomplete_reuses_cached_searches(self):
+        self._configure_plugin()
+        group = self.create_group(message='Hello world', culprit='foo.bar')
+
+        responses.add(
+            responses.GET, 'https://foocompany.zendesk.com/api/v2/search.json',
+            json=search_response,
+            content_type='application/json',
+        )
+
+        def autocomplete(query):
+            request = self.request.get(
+                '/',
+                data={'autocomplete_query': query,
+                      'autocomplete_field': 'issue_id'}
+            )
+            return self.plugin.view_autocomplete(request, group).data
+
+        autocomplete('p')
+        assert autocomplete('p') == autocomplete('p')
+        # Longer queries are answered from the complete result of 'p'
+        assert autocomplete('pro') == {
+            'issue_id': [
+                {'id': '5289', 'text': '(5289) Problem running bar with foo'}
+            ]}
+        assert len(responses.calls) == 1
+
+    @responses.activate
+    def test_autocomplete_from_ticket_index(self):
+        from sentry_zendesk.index import indexes
+
+        self._configure_plugin()
+        group = self.create_group(message='Hello world', culprit='foo.bar')
+
+        responses.add(
+            responses.GET, 'https://foocompany.zendesk.com/api/v2/search.json',
+            json=search_response,
+            content_type='application/json',
+        )
+        request = self.request.get(
+            '/',
+            data={'autocomplete_query': 'running',
+                  'autocomplete_field': 'issue_id'}
+        )
+
+        with self.settings(SENTRY_ZENDESK_TICKET_INDEX=True), \
+                mock.patch.object(indexes, '_ensure_syncing'):
+            # Index is cold, so Zendesk is searched
+            assert len(self.plugin.view_autocomplete(
+                request, group).data['issue_id']) == 2
+            assert len(responses.calls) == 1
+
+            index = indexes.get(self.plugin.get_client(self.project))
+            index.update([problem_ticket, incident_ticket])
+            index.warm = True
+
+            assert self.plugin.view_autocomplete(request, group).data == {
+                'issue_id': [
+                    {'id': '5289',
+                     'text': '(5289) Problem running bar with foo'}
+                ]}
+            assert len(responses.calls) == 1
+
+    @responses.activate
+    def test_link_issue_comments_on_ticket(self):
+        from sentry_zendesk.comments import comments
+
+        self._configure_plugin()
+        group = self.create_group(message='Hello world', culprit='foo.bar')
+        responses.add(
+            responses.PUT,
+            'https://foocompany.zendesk.com/api/v2/tickets/12345.json',
+            json={'ticket': {'id': 12345}},
+            content_type='application/json',
+        )
+
+        assert self.plugin.link_issue(None, group, {
+            'issue_id': '12345', 'comment': 'http://testserver/issue/'},
+        ) == {'title': '12345'}
+        self.plugin.link_issue(None, group, {'issue_id': '12345',
+                                             'comment': ''})
+        # Comments are buffered
+        assert len(responses.calls) == 0
+        comments.flush()
+
+        assert len(responses.calls) == 1
+        assert json.loads(responses.calls[0].request.body) == {
+            'ticket': {'comment': {'body': 'http://testserver/issue/'}}}
+
+    @responses.activate
+    def test_comment_recurring_events_on_linked_ticket(self):
+        from sentry.models.groupmeta import GroupMeta
+        from sentry_zendesk.comments import comments
+
+        self._configure_plugin()
+        self.plugin.set_option('comment_on_events', True, self.project)
+        group = self.create_group(message='Hello world', culprit='foo.bar')
+        GroupMeta.objects.set_value(group,
+                                    '%s:tid' % self.plugin.get_conf_key(),
+                                    '12345')
+        responses.add(
+            responses.PUT,
+            'https://foocompany.zendesk.com/api/v2/tickets/12345.json',
+            json={'ticket': {'id': 12345}},
+            content_type='application/json',
+        )
+
+        for i in range(2):
+            self.plugin.post_process(
+                group, event=self.event, is_new=False, is_sample=False)
+        comments.flush()
+
+        # No incidents, and both events in a single update
+        assert len(responses.calls) == 1
+        body = json.loads(
+            responses.calls[0].request.body)['ticket']['comment']['body']
+        summary = 'New event at {:%Y-%m-%d %H:%M:%S} UTC: [{}]({})'.format(
+            self.event.datetime, self.event.error(),
+            'http://testserver/baz/bar/issues/1/events/{}/'.format(
+                self.event.id))
+        assert body == summary + '\n\n' + summary
+
     @responses.activate
     def test_search_when_autocompleting_raises_on_http_error(self):
         self._configure_plugin()
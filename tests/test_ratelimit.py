@@ -0,0 +1,97 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+from sentry.testutils import TestCase
+import mock
+import pytest
+import responses
+
+from sentry_zendesk.client import ZendeskClient, get_client
+from sentry_zendesk.ratelimit import (
+    HIGH, LOW, RateLimiter, RateLimitExceeded, RedisBackend)
+
+
+class RateLimiterTest(TestCase):
+
+    def test_low_priority_keeps_reserve_for_high_priority(self):
+        limiter = RateLimiter('https://foocompany.zendesk.com', rate=10)
+        for i in range(8):
+            limiter.acquire(LOW, max_wait=0)
+        with pytest.raises(RateLimitExceeded):
+            limiter.acquire(LOW, max_wait=0)
+
+        limiter.acquire(HIGH, max_wait=0)
+        limiter.acquire(HIGH, max_wait=0)
+        with pytest.raises(RateLimitExceeded):
+            limiter.acquire(HIGH, max_wait=0)
+        assert limiter.throttled == 2
+
+    @responses.activate
+    def test_learn_rate_and_retry_after_from_zendesk(self):
+        calls = []
+
+        def search(request):
+            calls.append(request)
+            if len(calls) == 1:
+                return (429, {'Retry-After': '0', 'X-Rate-Limit': '50'}, '')
+            return (200, {'X-Rate-Limit': '50'}, '{"results": []}')
+
+        responses.add_callback(
+            responses.GET, 'https://foocompany.zendesk.com/api/v2/search.json',
+            callback=search,
+            content_type='application/json',
+        )
+        client = ZendeskClient(
+            'https://foocompany.zendesk.com', 'Bob', 'bob123')
+
+        assert client.search_tickets('foo') == {'results': []}
+        # The refused request is sent again after Retry-After
+        assert len(calls) == 2
+        assert client.limiter.rate == 50
+
+    def test_lowest_configured_rate_is_used(self):
+        get_client('https://foocompany.zendesk.com', 'Bob', 'bob123', 100)
+        client = get_client(
+            'https://foocompany.zendesk.com', 'Bob', 'bob123', 50)
+        assert client.limiter.rate == 50
+
+        # The order of the projects using the instance doesn't matter
+        get_client('https://foocompany.zendesk.com', 'Bob', 'bob123', 100)
+        assert client.limiter.rate == 50
+
+    def test_configured_rate_can_be_raised(self):
+        with mock.patch('time.time', return_value=1000.):
+            client = get_client(
+                'https://foocompany.zendesk.com', 'Bob', 'bob123', 50)
+        with mock.patch('time.time', return_value=1200.):
+            get_client('https://foocompany.zendesk.com', 'Bob', 'bob123', 100)
+            assert client.limiter.rate == 50
+        # Nobody configured 50 lately
+        with mock.patch('time.time', return_value=1400.):
+            get_client('https://foocompany.zendesk.com', 'Bob', 'bob123')
+            assert client.limiter.rate == 100
+        with mock.patch('time.time', return_value=1600.):
+            assert client.limiter.rate == 200
+
+
+class RedisBackendTest(TestCase):
+
+    def setUp(self):
+        super(RedisBackendTest, self).setUp()
+        self.backend = RedisBackend('https://foocompany.zendesk.com')
+        self.addCleanup(self._delete_keys)
+
+    def _delete_keys(self):
+        with self.backend.cluster.all() as client:
+            client.flushdb()
+
+    def test_fixed_window_counter(self):
+        with mock.patch('time.time', return_value=6030.):
+            assert self.backend.take(2, 0) == 0
+            assert self.backend.take(2, 0) == 0
+            # Waits for the next window
+            assert self.backend.take(2, 0) == 30
+
+    def test_block_until_retry_after(self):
+        self.backend.block(30)
+
+        assert 29 < self.backend.take(2, 0) <= 30
@@ -0,0 +1,58 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+import threading
+
+from sentry.testutils import TestCase
+import pytest
+
+from sentry_zendesk.singleflight import SingleFlight, canonical_key
+
+
+class SingleFlightTest(TestCase):
+
+    def test_canonical_key_ignores_order_of_payload_keys(self):
+        assert canonical_key('get', {'a': 1, 'b': [2]}) == canonical_key(
+            'get', {'b': [2], 'a': 1})
+        assert canonical_key('get', {'a': 1}) != canonical_key(
+            'post', {'a': 1})
+
+    def test_coalesce_concurrent_calls(self):
+        flights = SingleFlight()
+        release = threading.Event()
+        executions = []
+
+        def search():
+            executions.append(1)
+            release.wait()
+            return ['result']
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(flights.do('key', search)))
+            for i in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        # Wait for every thread to join the flight
+        while flights.calls < 4:
+            pass
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        assert executions == [1]
+        assert results == [['result']] * 4
+        assert flights.get_stats() == {'calls': 4, 'coalesced': 3}
+
+        # Finished calls are not reused
+        assert flights.do('key', lambda: 'new') == 'new'
+
+    def test_share_exception(self):
+        flights = SingleFlight()
+
+        def fail():
+            raise ValueError('boom')
+
+        with pytest.raises(ValueError):
+            flights.do('key', fail)
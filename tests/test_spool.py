@@ -0,0 +1,94 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+import os
+import shutil
+import tempfile
+
+from requests.exceptions import ConnectionError
+from sentry.testutils import TestCase
+from sentry_plugins.exceptions import ApiError
+
+from sentry_zendesk.client import is_transient_error
+from sentry_zendesk.spool import Spool
+
+
+class SpoolTest(TestCase):
+
+    def setUp(self):
+        super(SpoolTest, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def _replay(self, spool, fail=None):
+        replayed = []
+
+        def handler(record):
+            if fail is not None and record['n'] in fail:
+                raise fail[record['n']]
+            replayed.append(record['n'])
+
+        spool.replay(handler, is_transient_error)
+        return replayed
+
+    def test_replays_in_order_across_segments(self):
+        spool = Spool(self.directory, segment_size=100)
+        for n in range(10):
+            spool.append({'n': n, 'subject': 'x' * 40})
+
+        assert len(spool.segments()) > 1
+        assert self._replay(spool) == list(range(10))
+        assert spool.segments() == []
+        assert os.listdir(self.directory) == []
+
+    def test_records_survive_restart(self):
+        spool = Spool(self.directory)
+        spool.append({'n': 1})
+        spool.append({'n': 2})
+        # Another process takes over after this one died
+        del spool
+
+        assert self._replay(Spool(self.directory)) == [1, 2]
+
+    def test_transient_failure_stops_replay_until_next_time(self):
+        spool = Spool(self.directory)
+        for n in range(4):
+            spool.append({'n': n})
+
+        replayed = self._replay(spool, fail={2: ConnectionError('down')})
+        assert replayed == [0, 1]
+
+        spool = Spool(self.directory)
+        spool.append({'n': 4})
+        # Handled records are not replayed again
+        assert self._replay(spool) == [2, 3, 4]
+
+    def test_permanent_failure_drops_record(self):
+        spool = Spool(self.directory)
+        for n in range(3):
+            spool.append({'n': n})
+
+        replayed = self._replay(spool, fail={1: ApiError('invalid', 422)})
+
+        assert replayed == [0, 2]
+        assert spool.segments() == []
+
+    def test_corrupted_tail_is_dropped(self):
+        spool = Spool(self.directory)
+        spool.append({'n': 1})
+        spool.append({'n': 2})
+        spool.seal()
+        [path] = spool.segments()
+        with open(path, 'r+b') as f:
+            f.seek(-3, os.SEEK_END)
+            f.write(b'###')
+
+        assert self._replay(spool) == [1]
+        assert spool.segments() == []
+
+    def test_segment_being_written_by_other_process_is_skipped(self):
+        writer = Spool(self.directory)
+        writer.append({'n': 1})
+
+        # Replaying with other spool doesn't seal the writer's segment
+        assert self._replay(Spool(self.directory)) == []
+        assert self._replay(writer) == [1]
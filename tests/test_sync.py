@@ -0,0 +1,135 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+from django.core.management import call_command
+from exam import fixture
+from sentry.models import Group, GroupStatus
+from sentry.testutils import TestCase
+from sentry.utils import json
+from six.moves.urllib.parse import parse_qs, urlparse
+import mock
+import responses
+
+from sentry_zendesk.plugin import ZendeskPlugin
+from sentry_zendesk.sync import StatusSync, get_synced_projects
+
+
+EXPORT_URL = 'https://foocompany.zendesk.com/api/v2/incremental/tickets/cursor.json'  # noqa
+
+
+class StatusSyncTest(TestCase):
+
+    @fixture
+    def plugin(self):
+        return ZendeskPlugin()
+
+    def setUp(self):
+        super(StatusSyncTest, self).setUp()
+        self.plugin.set_option(
+            'zendesk_url', 'https://foocompany.zendesk.com', self.project)
+        self.plugin.set_option('username', 'Bob', self.project)
+        self.plugin.set_option('password', 'bob123', self.project)
+        self.plugin.set_option('sync_ticket_status', True, self.project)
+        self.plugin.enable(self.project)
+        self.pages = {}
+
+    def _mock_export(self):
+        def export(request):
+            params = parse_qs(urlparse(request.url).query)
+            key = params['cursor'][0] if 'cursor' in params else None
+            return 200, {}, json.dumps(self.pages[key])
+
+        responses.add_callback(responses.GET, EXPORT_URL, callback=export,
+                               content_type='application/json')
+
+    def _page(self, tickets, after_cursor, end_of_stream):
+        return {
+            'tickets': [{'id': ticket_id, 'status': status,
+                         'subject': 'Ticket {}'.format(ticket_id)}
+                        for ticket_id, status in tickets],
+            'after_cursor': after_cursor,
+            'end_of_stream': end_of_stream,
+        }
+
+    def _status(self, group):
+        return Group.objects.get(id=group.id).status
+
+    @responses.activate
+    def test_applies_status_of_changed_linked_tickets(self):
+        self._mock_export()
+        solved = self.create_group(message='Solved')
+        reopened = self.create_group(
+            message='Reopened', status=GroupStatus.RESOLVED)
+        self.plugin._set_linked_ticket(solved, '1')
+        self.plugin._set_linked_ticket(reopened, '2')
+        self.pages[None] = self._page(
+            [(1, 'open'), (2, 'solved'), (3, 'solved')], 'c1', False)
+        self.pages['c1'] = self._page(
+            [(1, 'solved'), (2, 'open')], 'c2', True)
+
+        sync = StatusSync(self.plugin, self.project)
+        read, changed = sync.run()
+
+        assert read == 5
+        assert sorted(changed) == sorted([solved.id, reopened.id])
+        assert self._status(solved) == GroupStatus.RESOLVED
+        assert self._status(reopened) == GroupStatus.UNRESOLVED
+        assert sync.get_cursor() == 'c2'
+
+        # Next run only reads what changed after the saved cursor
+        self.pages['c2'] = self._page([], 'c2', True)
+        assert sync.run() == (0, [])
+        assert 'cursor=c2' in responses.calls[-1].request.url
+
+    @responses.activate
+    def test_groups_resolved_in_sentry_stay_resolved(self):
+        self._mock_export()
+        group = self.create_group(
+            message='Resolved', status=GroupStatus.RESOLVED)
+        self.plugin._set_linked_ticket(group, '1')
+        self.pages[None] = self._page([(1, 'open')], 'c1', True)
+
+        assert StatusSync(self.plugin, self.project).run() == (1, [])
+        assert self._status(group) == GroupStatus.RESOLVED
+
+    @responses.activate
+    def test_groups_reopened_in_sentry_stay_unresolved(self):
+        self._mock_export()
+        group = self.create_group(message='Regressed')
+        self.plugin._set_linked_ticket(group, '1')
+        self.pages[None] = self._page([(1, 'solved')], 'c1', True)
+        sync = StatusSync(self.plugin, self.project)
+        assert sync.run() == (1, [group.id])
+        Group.objects.filter(id=group.id).update(
+            status=GroupStatus.UNRESOLVED)
+
+        # Zendesk closes solved tickets on its own
+        self.pages['c1'] = self._page([(1, 'closed')], 'c2', True)
+        assert sync.run() == (1, [])
+        assert self._status(group) == GroupStatus.UNRESOLVED
+
+    @responses.activate
+    def test_saving_the_cursor_keeps_the_cached_config(self):
+        from sentry_zendesk.config import configs
+
+        self._mock_export()
+        self.pages[None] = self._page([(1, 'open')], 'c1', True)
+        self.plugin.get_project_config(self.project)
+
+        with mock.patch.object(configs, 'delete') as delete:
+            StatusSync(self.plugin, self.project).run()
+        assert not delete.called
+        assert StatusSync(self.plugin, self.project).get_cursor() == 'c1'
+
+    @responses.activate
+    def test_command_syncs_enabled_projects(self):
+        self._mock_export()
+        group = self.create_group(message='Solved')
+        self.plugin._set_linked_ticket(group, '1')
+        self.pages[None] = self._page([(1, 'closed')], 'c1', True)
+        other = self.create_project(name='Other')
+        self.plugin.set_option(
+            'zendesk_url', 'https://foocompany.zendesk.com', other)
+
+        assert get_synced_projects(self.plugin) == [self.project]
+        call_command('zendesk_sync_statuses')
+        assert self._status(group) == GroupStatus.RESOLVED
@@ -0,0 +1,78 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+from sentry.exceptions import PluginError
+from sentry.testutils import TestCase
+import mock
+import pytest
+
+from sentry_zendesk.plugin import ZendeskPlugin
+from sentry_zendesk.templates import (
+    Template, TemplateCache, TicketTemplates, parse_custom_fields)
+
+
+class TemplatesTest(TestCase):
+
+    def test_render_template(self):
+        template = Template('[{short_id}] {title} {{literal}}')
+
+        assert template.render({'short_id': 'BAR-1', 'title': 'Boom'}) == (
+            '[BAR-1] Boom {literal}')
+
+    def test_unknown_fields_are_refused(self):
+        for source in ('{foo}', '{title.upper}', '{title!r}', '{}', '{'):
+            with pytest.raises(PluginError):
+                Template(source)
+
+    def test_parse_custom_fields(self):
+        custom_fields = parse_custom_fields('123: {level}\n\n456:x')
+
+        assert [(field_id, template.source)
+                for field_id, template in custom_fields] == [
+            (123, '{level}'), (456, 'x')]
+        with pytest.raises(PluginError):
+            parse_custom_fields('foo: {level}')
+
+    def test_render_ticket_fields(self):
+        templates = TicketTemplates.compile(
+            subject='{project}: {title}', tags='sentry, {level} {culprit}',
+            priority='high', custom_fields='123: {short_id}')
+
+        assert templates.render({
+            'project': 'bar', 'title': 'Boom', 'url': 'http://x/',
+            'level': 'error', 'culprit': 'foo.bar baz', 'short_id': 'BAR-1',
+        }) == {
+            'subject': 'bar: Boom',
+            'comment': '[http://x/](http://x/)',
+            'tags': ['sentry', 'error', 'foo_bar_baz'],
+            'priority': 'high',
+            'custom_fields': [{'id': 123, 'value': 'BAR-1'}],
+        }
+        with pytest.raises(PluginError):
+            TicketTemplates.compile(priority='asap')
+
+    def test_templates_are_compiled_once(self):
+        cache = TemplateCache()
+
+        templates = cache.compile('{title}', None, 'sentry')
+
+        assert cache.compile('{title}', None, 'sentry') is templates
+        assert cache.compile('{title}!', None, 'sentry') is not templates
+
+    def test_group_context_is_cached(self):
+        cache = TemplateCache()
+        plugin = ZendeskPlugin()
+        group = self.create_group(message='Hello world', culprit='foo.bar')
+        event = self.create_event(group=group)
+
+        with mock.patch.object(plugin, 'get_group_title',
+                               return_value='Boom') as get_group_title:
+            context = cache.get_context(plugin, group, event)
+            other_event = self.create_event(group=group, event_id='b' * 32)
+            other_context = cache.get_context(plugin, group, other_event)
+
+        assert get_group_title.call_count == 1
+        assert context['title'] == other_context['title'] == 'Boom'
+        assert context['culprit'] == 'foo.bar'
+        assert other_context['event_id'] == 'b' * 32
+        assert other_context['event_url'] == '{}events/{}/'.format(
+            context['url'], other_event.id)
@@ -0,0 +1,55 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+import mock
+from sentry.testutils import TestCase
+
+from sentry_zendesk.config import OPTIONS, PluginConfig
+from sentry_zendesk.throttling import IncidentThrottle
+
+
+def make_config(**options):
+    values = dict.fromkeys(OPTIONS)
+    values.update(options)
+    return PluginConfig(**values)
+
+
+class IncidentThrottleTest(TestCase):
+
+    def test_no_policy_creates_every_incident(self):
+        throttle = IncidentThrottle()
+        config = make_config()
+        assert [throttle.check(config, 1, False) for i in range(3)] == [0] * 3
+
+    def test_only_sampled_events(self):
+        throttle = IncidentThrottle()
+        config = make_config(incident_sampled_only=True)
+        # Sampled events are the ones Sentry doesn't keep
+        assert throttle.check(config, 1, is_sample=True) is None
+        assert throttle.check(config, 1, is_sample=True) is None
+        assert throttle.check(config, 1, is_sample=False) == 2
+        assert throttle.check(config, 1, is_sample=False) == 0
+
+    def test_every_kth_event(self):
+        throttle = IncidentThrottle()
+        config = make_config(incident_every=3)
+        results = [throttle.check(config, 1, False) for i in range(7)]
+        assert results == [0, None, None, 2, None, None, 2]
+
+    def test_limit_per_window(self):
+        throttle = IncidentThrottle()
+        config = make_config(incident_limit=2, incident_window=60)
+        with mock.patch('time.time', return_value=1000):
+            results = [throttle.check(config, 1, False) for i in range(4)]
+            # Groups are throttled independently
+            assert throttle.check(config, 2, False) == 0
+        assert results == [0, 0, None, None]
+
+        with mock.patch('time.time', return_value=1060):
+            assert throttle.check(config, 1, False) == 2
+
+    def test_forgets_least_recently_used_groups(self):
+        throttle = IncidentThrottle(max_size=1)
+        config = make_config(incident_limit=1)
+        assert throttle.check(config, 1, False) == 0
+        assert throttle.check(config, 2, False) == 0
+        assert throttle.check(config, 1, False) == 0
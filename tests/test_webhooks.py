@@ -0,0 +1,147 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+from datetime import datetime, timedelta
+
+from exam import fixture
+from sentry.models import Activity, Group, GroupStatus
+from sentry.testutils import TestCase
+from sentry.utils import json
+import mock
+
+from sentry_zendesk.models import TicketLink
+from sentry_zendesk.plugin import ZendeskPlugin
+from sentry_zendesk.statuses import apply_ticket_statuses
+from sentry_zendesk.webhooks import sign
+
+
+class WebhookTest(TestCase):
+
+    @fixture
+    def plugin(self):
+        return ZendeskPlugin()
+
+    @fixture
+    def path(self):
+        return self.plugin.get_webhook_path(self.project)
+
+    def setUp(self):
+        super(WebhookTest, self).setUp()
+        self.plugin.set_option('webhook_secret', 's3cr3t', self.project)
+
+    def _post(self, payload, secret='s3cr3t', timestamp=None):
+        body = json.dumps(payload).encode('utf8')
+        if timestamp is None:
+            timestamp = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+        return self.client.post(
+            self.path, body, content_type='application/json',
+            HTTP_X_ZENDESK_WEBHOOK_SIGNATURE=sign(secret, timestamp, body),
+            HTTP_X_ZENDESK_WEBHOOK_SIGNATURE_TIMESTAMP=timestamp,
+        )
+
+    def _status(self, group):
+        return Group.objects.get(id=group.id).status
+
+    def test_resolve_and_reopen_linked_groups(self):
+        group = self.create_group(message='Hello world')
+        other = self.create_group(message='Other')
+        self.plugin._set_linked_ticket(group, '123')
+        self.plugin._set_linked_ticket(other, '456')
+
+        with self.tasks():
+            response = self._post({'ticket_id': 123, 'status': 'Solved'})
+            assert response.status_code == 202
+            assert self._status(group) == GroupStatus.RESOLVED
+            assert self._status(other) == GroupStatus.UNRESOLVED
+            assert Activity.objects.filter(
+                group=group, type=Activity.SET_RESOLVED).exists()
+
+            self._post([{'ticket_id': 123, 'status': 'Open'},
+                        {'ticket_id': 456, 'status': 'Open'}])
+            assert self._status(group) == GroupStatus.UNRESOLVED
+            assert self._status(other) == GroupStatus.UNRESOLVED
+            assert not Activity.objects.filter(
+                group=other, type=Activity.SET_UNRESOLVED).exists()
+
+    def test_only_reopened_tickets_reopen_groups(self):
+        group = self.create_group(
+            message='Hello world', status=GroupStatus.RESOLVED)
+        self.plugin._set_linked_ticket(group, '123')
+
+        # Resolved in Sentry while its ticket is being worked on
+        assert apply_ticket_statuses(self.project.id, {'123': 'open'}) == []
+        assert apply_ticket_statuses(
+            self.project.id, {'123': 'pending'}) == []
+        assert self._status(group) == GroupStatus.RESOLVED
+
+        assert apply_ticket_statuses(self.project.id, {'123': 'solved'}) == []
+        assert apply_ticket_statuses(
+            self.project.id, {'123': 'open'}) == [group.id]
+        assert self._status(group) == GroupStatus.UNRESOLVED
+
+    def test_groups_reopened_in_sentry_stay_unresolved(self):
+        group = self.create_group(message='Hello world')
+        self.plugin._set_linked_ticket(group, '123')
+
+        with self.tasks():
+            self._post({'ticket_id': 123, 'status': 'solved'})
+            assert self._status(group) == GroupStatus.RESOLVED
+            # Reopened in Sentry (e.g. a regression) while its ticket is solved
+            Group.objects.filter(id=group.id).update(
+                status=GroupStatus.UNRESOLVED)
+
+            self._post({'ticket_id': 123, 'status': 'solved'})
+            self._post({'ticket_id': 123, 'status': 'closed'})
+        assert self._status(group) == GroupStatus.UNRESOLVED
+        assert Activity.objects.filter(
+            group=group, type=Activity.SET_RESOLVED).count() == 1
+
+    def test_changes_are_queued(self):
+        group = self.create_group(message='Hello world')
+        self.plugin._set_linked_ticket(group, '123')
+
+        with mock.patch(
+                'sentry_zendesk.tasks.apply_ticket_statuses.delay') as delay:
+            response = self._post([{'ticket_id': 123, 'status': 'solved'},
+                                   {'ticket_id': 456, 'status': 'open'}])
+        assert response.status_code == 202
+        assert self._status(group) == GroupStatus.UNRESOLVED
+        delay.assert_called_once_with(
+            project_id=self.project.id,
+            statuses={'123': 'solved', '456': 'open'})
+
+    def test_invalid_signature(self):
+        payload = {'ticket_id': 123, 'status': 'solved'}
+        assert self._post(payload, secret='wrong').status_code == 401
+
+        stale = (datetime.utcnow() - timedelta(hours=1)).strftime(
+            '%Y-%m-%dT%H:%M:%SZ')
+        assert self._post(payload, timestamp=stale).status_code == 401
+
+        self.plugin.unset_option('webhook_secret', self.project)
+        assert self._post(payload).status_code == 401
+
+    def test_invalid_requests(self):
+        assert self._post({'status': 'solved'}).status_code == 400
+        assert self.client.get(self.path).status_code == 405
+        assert self.client.post(
+            '/plugins/sentry_zendesk/projects/0/webhook/').status_code == 404
+
+
+class TicketLinkTest(TestCase):
+
+    def test_links_are_indexed_by_ticket(self):
+        plugin = ZendeskPlugin()
+        group = self.create_group(message='Hello world')
+        other = self.create_group(message='Other')
+        plugin._set_linked_ticket(group, '123')
+        plugin.set_linked_tickets(self.project, {other.id: '123'})
+
+        assert TicketLink.objects.get_group_ids(self.project.id, ['123']) == {
+            '123': [group.id, other.id]}
+
+        TicketLink.objects.set_links(self.project.id, {group.id: None})
+        assert TicketLink.objects.get_group_ids(
+            self.project.id, [123, 456]) == {'123': [other.id]}
+
+    def test_unknown_tickets_are_ignored(self):
+        assert apply_ticket_statuses(self.project.id, {'999': 'solved'}) == []